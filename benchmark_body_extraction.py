@@ -0,0 +1,107 @@
+# Usage:
+# uv run benchmark_body_extraction.py --num_emails 2000
+#
+# Micro-benchmark of email body extraction on a synthetic corpus of representative hotel
+# reservation and marketing emails: the previous regex based extractor against
+# email_body_extractor, inline and on a process pool.
+
+import argparse
+import base64
+import re
+import time
+from html import unescape
+
+from email_body_extractor import extract_body_text, extract_body_texts
+
+CONFIRMATION_TEXT = """Dear Jane Doe,
+Thank you for choosing The St. Regis Aspen Resort. Your reservation is confirmed.
+Confirmation Number: 73920184
+Check-in: Friday, February 14, 2025 (4:00 PM)   Check-out: Monday, February 17, 2025 (11:00 AM)
+Room Type: Deluxe King Room, Mountain View   Guests: 2 Adults, 1 Child
+Total for stay: $4,385.00 USD (including taxes and fees)
+Marriott Bonvoy Member: Platinum Elite
+"""
+
+MARKETING_STYLE = "<style>" + " ".join(f".c{i}{{color:#{i:06x};padding:{i % 9}px;font-family:Arial}}" for i in range(400)) + "</style>"
+MARKETING_SCRIPT = "<script>" + "var t=[" + ",".join(str(i) for i in range(3000)) + "];</script>"
+FOOTER = "<p>You are receiving this email because you opted in. <a href='#'>Unsubscribe</a> | <a href='#'>Privacy Policy</a></p>" * 20
+
+def _html_body(text):
+    rows = "".join(f"<tr><td class='c{i}'>{line}</td></tr>" for i, line in enumerate(text.splitlines()))
+    offers = "".join(f"<div class='c{i}'><img src='https://example.com/{i}.png'/><h3>Offer {i}</h3><p>Save 20% &amp; more at our resorts&nbsp;today.</p></div>" for i in range(60))
+    return f"<html><head>{MARKETING_STYLE}</head><body>{MARKETING_SCRIPT}<table>{rows}</table>{offers}{FOOTER}</body></html>"
+
+def _part(mime_type, content):
+    return {'mimeType': mime_type, 'body': {'data': base64.urlsafe_b64encode(content.encode('utf-8')).decode('ascii')}}
+
+def build_corpus(num_emails):
+    """Cycle through the shapes of email we see in practice."""
+    shapes = [
+        # Plain text only confirmation
+        lambda: _part('text/plain', CONFIRMATION_TEXT),
+        # HTML only confirmation with heavy marketing markup
+        lambda: _part('text/html', _html_body(CONFIRMATION_TEXT)),
+        # multipart/alternative (plain + html), the most common shape
+        lambda: {'mimeType': 'multipart/alternative', 'parts': [
+            _part('text/plain', CONFIRMATION_TEXT),
+            _part('text/html', _html_body(CONFIRMATION_TEXT)),
+        ]},
+        # multipart/mixed with an alternative body and a PDF attachment
+        lambda: {'mimeType': 'multipart/mixed', 'parts': [
+            {'mimeType': 'multipart/alternative', 'parts': [
+                _part('text/plain', CONFIRMATION_TEXT),
+                _part('text/html', _html_body(CONFIRMATION_TEXT)),
+            ]},
+            {'mimeType': 'application/pdf', 'filename': 'folio.pdf', 'body': {'attachmentId': 'abc', 'size': 120000}},
+        ]},
+    ]
+    return [shapes[i % len(shapes)]() for i in range(num_emails)]
+
+def legacy_extract_text_from_html(html):
+    text = re.sub(r'<[^>]+>', ' ', html)
+    text = unescape(text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def legacy_get_text_from_part(part):
+    """The extractor search_email.py used before email_body_extractor."""
+    if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
+        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+    if part.get('mimeType') == 'text/html' and 'data' in part.get('body', {}):
+        html = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+        return legacy_extract_text_from_html(html)
+    if 'parts' in part:
+        subpart_texts = [legacy_get_text_from_part(subpart) for subpart in part['parts']]
+        subpart_texts = [subpart_text for subpart_text in subpart_texts if subpart_text is not None]
+        return ' '.join(subpart_texts)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark email body extraction.')
+    parser.add_argument('--num_emails', type=int, default=2000,
+                        help='Number of emails in the synthetic corpus (default: 2000)')
+    return parser.parse_args()
+
+def main():
+    # Parsed here, not at import: the process pool workers import this script again.
+    args = parse_args()
+    corpus = build_corpus(args.num_emails)
+    corpus_mb = sum(len(str(payload)) for payload in corpus) / (1024 * 1024)
+    print(f"Corpus: {len(corpus)} emails, {corpus_mb:.1f} MB of base64 payloads.\n")
+
+    runs = [
+        ("legacy regex (inline)", lambda: [legacy_get_text_from_part(payload) for payload in corpus]),
+        ("single pass (inline)", lambda: [extract_body_text(payload) for payload in corpus]),
+        ("single pass (process pool, cold)", lambda: extract_body_texts(corpus)),
+        ("single pass (process pool, warm)", lambda: extract_body_texts(corpus)),
+    ]
+
+    print(f"{'extractor':<33} {'seconds':>9} {'emails/s':>10} {'avg chars':>10}")
+    for name, run in runs:
+        start = time.perf_counter()
+        bodies = run()
+        elapsed = time.perf_counter() - start
+        avg_chars = sum(len(body or '') for body in bodies) / len(bodies)
+        print(f"{name:<33} {elapsed:>9.2f} {len(bodies) / elapsed:>10.0f} {avg_chars:>10.0f}")
+
+if __name__ == "__main__":
+    main()
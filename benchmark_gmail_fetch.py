@@ -0,0 +1,71 @@
+# Usage:
+# uv run benchmark_gmail_fetch.py --num_messages 500
+#
+# Compares the Gmail batch endpoint with the thread pool path (one messages().get() per message)
+# for both the metadata and the full email fetch stages of search_email.py.
+
+import argparse
+import time
+
+from mailbox_context import current_mailbox
+from search_email import (
+    get_gmail_service,
+    load_jsonl,
+    search_emails,
+    get_email_metadatas_batch,
+    get_full_email_batch,
+)
+
+parser = argparse.ArgumentParser(description='Benchmark Gmail batch requests against the thread pool fetch path.')
+parser.add_argument('--num_messages', type=int, default=500,
+                    help='Number of matching messages to fetch in each run (default: 500)')
+parser.add_argument('--query',
+                    help='Gmail search query (default: the hotel reservation keyword query used by search_email.py)')
+parser.add_argument('--skip_full', action='store_true',
+                    help='Only benchmark the metadata stage')
+args = parser.parse_args()
+
+def time_fetch(fetch_fn, msg_ids, use_batch_api):
+    start = time.perf_counter()
+    records = fetch_fn(msg_ids, use_batch_api=use_batch_api)
+    elapsed = time.perf_counter() - start
+    return len(records), elapsed
+
+def main():
+    query = args.query
+    if not query:
+        keywords = load_jsonl('hotel_reservation_search_keywords.jsonl')
+        query = ' OR '.join(f'"{keyword}"' for keyword in keywords)
+
+    service = get_gmail_service()
+    messages = search_emails(service, query, max_results=args.num_messages)
+    msg_ids = [message['id'] for message in messages]
+    if not msg_ids:
+        print("No matching emails found.")
+        return
+    print(f"Benchmarking with {len(msg_ids)} messages.\n")
+
+    stages = [("metadata", get_email_metadatas_batch)]
+    if not args.skip_full:
+        stages.append(("full", get_full_email_batch))
+
+    rows = []
+    for stage_name, fetch_fn in stages:
+        for use_batch_api in [False, True]:
+            num_fetched, elapsed = time_fetch(fetch_fn, msg_ids, use_batch_api)
+            if use_batch_api:
+                mode_name = "batch API"
+            else:
+                # The thread pool is sized by the AIMD controller, report where it settled
+                controller = current_mailbox().gmail_concurrency
+                mode_name = f"thread pool (AIMD {controller.limit}/{controller.max_limit})"
+            rows.append((stage_name, mode_name, num_fetched, elapsed))
+
+    print("\n=== Gmail fetch benchmark ===\n")
+    print(f"{'stage':<10} {'mode':<28} {'fetched':>8} {'seconds':>9} {'msgs/s':>9}")
+    for stage_name, mode_name, num_fetched, elapsed in rows:
+        throughput = num_fetched / elapsed if elapsed > 0 else 0.0
+        print(f"{stage_name:<10} {mode_name:<28} {num_fetched:>8} {elapsed:>9.2f} {throughput:>9.1f}")
+
+if __name__ == "__main__":
+    main()
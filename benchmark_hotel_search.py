@@ -0,0 +1,154 @@
+# Usage:
+# uv run benchmark_hotel_search.py
+# uv run benchmark_hotel_search.py --mongodb-uri mongodb://localhost:27017 --num-hotels 50000 --concurrency 16
+#
+# Latency check of the hotel search service without the LLM steps (generate_keywords=0&rerank=0),
+# which should stay well under SLOW_SEARCH_MS. Seeds a scratch database of a local mongod with
+# synthetic hotels and trips, then sends searches from several threads through the Flask app of
+# hotel_search_service.py and reports the p50 / p95 / p99 of the whole request and of every
+# search step (timings_ms). Exits with status 1 when the p95 is over the threshold.
+
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from hotel_search_engine import HotelSearchEngine, HOTELS_COLLECTION, TRIPS_COLLECTION, create_mongo_client
+from hotel_search_service import SLOW_SEARCH_MS, create_app
+
+DESTINATIONS = [
+    ("Aspen", "CO", "United States"),
+    ("New York City", "NY", "United States"),
+    ("Miami Beach", "FL", "United States"),
+    ("San Francisco", "CA", "United States"),
+    ("Austin", "TX", "United States"),
+    ("Honolulu", "HI", "United States"),
+    ("London", "England", "United Kingdom"),
+    ("Paris", "Ile-de-France", "France"),
+]
+PRICE_LEVELS = ["$", "$$ - $$$", "$$$$"]
+STYLES = ["Luxury", "Modern", "Boutique", "Budget", "Family", "Romantic", "Business", "Classic"]
+AMENITIES = ["pool", "spa", "fitness center", "free wifi", "ski in ski out", "beach access", "restaurant",
+             "bar", "room service", "kids club", "airport shuttle", "pet friendly", "parking", "concierge"]
+TRIP_TYPES = ["family", "business", "couples", "solo travel", "friends"]
+TRIP_PURPOSES = ["family ski week", "business conference", "anniversary getaway", "beach vacation", "city break"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check the latency of hotel searches without the LLM steps.')
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017',
+                        help='MongoDB to seed and search, a local mongod by default')
+    parser.add_argument('--database', default='hotel_search_benchmark',
+                        help='Scratch database, dropped and seeded on every run')
+    parser.add_argument('--num-hotels', type=int, default=20000)
+    parser.add_argument('--num-trips', type=int, default=100)
+    parser.add_argument('--num-searches', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads sending searches at the same time')
+    parser.add_argument('--limit', type=int, default=10, help='Hotels returned per search')
+    parser.add_argument('--threshold-ms', type=float, default=SLOW_SEARCH_MS,
+                        help=f'Maximum p95 latency of a search in ms (default {SLOW_SEARCH_MS:g})')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+def synthetic_hotel(rng, location_id):
+    city, state, country = rng.choice(DESTINATIONS)
+    styles = rng.sample(STYLES, 2)
+    amenities = rng.sample(AMENITIES, 6)
+    return {
+        "location_id": str(location_id),
+        "name": f"{rng.choice(styles)} {city} Hotel {location_id}",
+        "rating": round(rng.uniform(2.5, 5.0), 1),
+        "price_level": rng.choice(PRICE_LEVELS),
+        "styles": styles,
+        "trip_types": [{"name": name} for name in rng.sample(TRIP_TYPES, 2)],
+        "amenities": amenities,
+        "description": f"A {' '.join(styles).lower()} hotel in {city} with {', '.join(amenities)}. " * 4,
+        "latitude": rng.uniform(-60, 60),
+        "longitude": rng.uniform(-180, 180),
+        "address_obj": {"city": city, "state": state, "country": country,
+                        "address_string": f"{location_id} Main Street, {city}, {state}"},
+        "photos": [{"images": {"original": {"url": f"https://example.com/{location_id}/{i}.jpg"}}} for i in range(5)],
+        # Review documents carry a lot more than the search reads
+        "reviews": [{"text": "Great stay, friendly staff and a comfortable room. " * 10} for _ in range(5)],
+    }
+
+def synthetic_trip(rng):
+    city, state, country = rng.choice(DESTINATIONS)
+    purpose = rng.choice(TRIP_PURPOSES)
+    return {
+        "name": f"{purpose.title()} in {city}",
+        "destination": {"city": city, "state": state, "country": country},
+        "startDate": "2025-02-14T00:00:00.000Z",
+        "endDate": "2025-02-17T00:00:00.000Z",
+        "totalBudget": rng.choice(PRICE_LEVELS),
+        "notes": f"Looking for {' and '.join(rng.sample(AMENITIES, 2))}",
+        "purpose": purpose,
+    }
+
+def seed_database(db, num_hotels, num_trips, rng):
+    """Replace the hotels and trips of the scratch database, returns the trip ids as strings."""
+    db[HOTELS_COLLECTION].drop()
+    db[TRIPS_COLLECTION].drop()
+    batch_size = 1000
+    for start in range(0, num_hotels, batch_size):
+        db[HOTELS_COLLECTION].insert_many([synthetic_hotel(rng, i) for i in range(start, min(start + batch_size, num_hotels))])
+    result = db[TRIPS_COLLECTION].insert_many([synthetic_trip(rng) for _ in range(num_trips)])
+    return [str(trip_id) for trip_id in result.inserted_ids]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def print_latencies(name, values):
+    print(f"{name:<20} p50 {percentile(values, 0.5):7.1f} ms   p95 {percentile(values, 0.95):7.1f} ms   "
+          f"p99 {percentile(values, 0.99):7.1f} ms   max {max(values):7.1f} ms")
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    client = create_mongo_client(uri=args.mongodb_uri, max_pool_size=max(args.concurrency, 2))
+    try:
+        start = time.monotonic()
+        trip_ids = seed_database(client[args.database], args.num_hotels, args.num_trips, rng)
+        engine = HotelSearchEngine(client, verbose=False, database=args.database)
+        # Creates the text index on the fresh collection
+        engine.warm_up()
+        print(f"Seeded {args.num_hotels} hotels and {args.num_trips} trips into {args.database} "
+              f"in {time.monotonic() - start:.1f}s")
+
+        app = create_app(engine)
+
+        def run_search(trip_id):
+            request_start = time.monotonic()
+            response = app.test_client().get(f'/trips/{trip_id}/hotels?limit={args.limit}&generate_keywords=0&rerank=0')
+            request_ms = (time.monotonic() - request_start) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f"Search for trip {trip_id} failed with {response.status_code}: {response.get_data(as_text=True)}")
+            return request_ms, response.get_json()['timings_ms']
+
+        # A few searches to fill the connection pool and the query plan cache
+        for trip_id in trip_ids[:args.concurrency]:
+            run_search(trip_id)
+
+        searches = [rng.choice(trip_ids) for _ in range(args.num_searches)]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(run_search, searches))
+        elapsed = time.monotonic() - start
+    finally:
+        client.close()
+
+    print(f"\n{len(results)} searches from {args.concurrency} threads in {elapsed:.1f}s "
+          f"({len(results) / elapsed:.0f} searches/s)")
+    print_latencies('request', [request_ms for request_ms, _ in results])
+    for step in results[0][1]:
+        print_latencies(step, [timings_ms.get(step, 0.0) for _, timings_ms in results])
+
+    p95 = percentile([request_ms for request_ms, _ in results], 0.95)
+    if p95 > args.threshold_ms:
+        print(f"\nFAIL: p95 {p95:.1f} ms is over {args.threshold_ms:g} ms")
+        sys.exit(1)
+    print(f"\nOK: p95 {p95:.1f} ms is under {args.threshold_ms:g} ms")
+
+if __name__ == "__main__":
+    main()
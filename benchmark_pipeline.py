@@ -0,0 +1,171 @@
+# Usage:
+# uv run benchmark_pipeline.py --num-emails 2000
+# uv run benchmark_pipeline.py --num-emails 5000 --streaming --gmail-rate-limit-rate 0.02 --groq-requests-per-minute 1000
+# uv run benchmark_pipeline.py --llm-mode batch --batch-turnaround-seconds 10 --batch-error-rate 0.05
+#
+# Runs the whole search_email.py pipeline offline, against a fake Gmail API serving a synthetic
+# mailbox and a fake Groq / OpenAI API (see fake_gmail_server.py and fake_groq_server.py), and
+# reports the wall time and throughput of every stage. No mailbox or API key is needed, so
+# performance changes can be measured before they ship. Each run gets a fresh data directory
+# and no LLM cache, like a first scan.
+
+import os
+import json
+import time
+
+BENCHMARK_DATA_DIR = './email_data/benchmark'
+RUN_DIR = f'{BENCHMARK_DATA_DIR}/{time.strftime("%Y%m%d_%H%M%S")}'
+
+# Read when the pipeline modules are imported, keep the benchmark away from the real cache and state files.
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('GROQ_BATCH_STATE_FILE', f'{RUN_DIR}/groq_batches.json')
+os.environ.setdefault('LLM_ROUTER_HISTORY_FILE', f'{RUN_DIR}/llm_routing.jsonl')
+
+from google.oauth2.credentials import Credentials
+
+from fake_api_server import add_fault_arguments, fault_profile_from_args
+from fake_gmail_server import start_fake_gmail_server
+from fake_groq_server import FakeGroqApi, start_fake_groq_server, DEFAULT_TOKENS_PER_SECOND, DEFAULT_BATCH_TURNAROUND_SECONDS
+from gmail_quota import GMAIL_USER_QUOTA_UNITS_PER_SECOND
+from mailbox_context import MailboxContext, set_default_mailbox
+from pipeline_metrics import metrics
+from synthetic_mailbox import SyntheticMailbox
+from search_email import (
+    CLIENT_ID,
+    CLIENT_SECRET,
+    SCOPES,
+    HOTEL_RESERVATION_KEY_INSIGHTS_STAGE,
+    build_arg_parser,
+    configure_llm_router,
+    scan_mailbox,
+    load_stage,
+    llm_router,
+    groq_concurrency,
+    get_email_preclassifier,
+)
+
+def parse_args():
+    parser = build_arg_parser(description='Benchmark the email pipeline offline against fake Gmail and Groq servers.')
+    parser.add_argument('--num-emails', type=int, default=2000,
+                        help='Size of the synthetic mailbox (default 2000), about 70%% of it matches the search')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic mailbox and of the injected faults')
+    parser.add_argument('--gmail-quota-units-per-second', type=float, default=GMAIL_USER_QUOTA_UNITS_PER_SECOND,
+                        help=f'Per-user Gmail quota, enforced by the fake server and paced by the client (default {GMAIL_USER_QUOTA_UNITS_PER_SECOND})')
+    add_fault_arguments(parser, 'gmail-', latency_ms=50)
+    parser.add_argument('--groq-requests-per-minute', type=float, default=0,
+                        help='Groq request rate limit enforced with 429s (default 0 for none)')
+    parser.add_argument('--groq-tokens-per-second', type=float, default=DEFAULT_TOKENS_PER_SECOND,
+                        help=f'Completion token generation speed (default {DEFAULT_TOKENS_PER_SECOND})')
+    add_fault_arguments(parser, 'groq-', latency_ms=300)
+    parser.add_argument('--batch-turnaround-seconds', type=float, default=DEFAULT_BATCH_TURNAROUND_SECONDS,
+                        help=f'Seconds until a Groq batch completes (default {DEFAULT_BATCH_TURNAROUND_SECONDS:.0f})')
+    parser.add_argument('--batch-error-rate', type=float, default=0.0,
+                        help='Share of Groq batch requests ending up in the error file (default 0)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='Share of key insights answers returned as malformed JSON (default 0)')
+    return parser.parse_args()
+
+def reservation_recall(mailbox):
+    """Share of the synthetic mailbox's reservations found in the key insights stage, as (found, expected)."""
+    expected = {
+        (email['reservation']['name'], email['reservation']['check_in'])
+        for email in mailbox.emails
+        if email['kind'] in ('hotel_confirmation', 'hotel_undecided')
+    }
+    found = {
+        (record['key_insights'].get('hotel'), record['key_insights'].get('check_in'))
+        for record in load_stage(HOTEL_RESERVATION_KEY_INSIGHTS_STAGE)
+    }
+    return len(expected & found), len(expected)
+
+def print_stage_table(report, emails_listed):
+    print(f"\n{'stage':<46} {'seconds':>9} {'in':>7} {'out':>7} {'items/s':>9} {'RSS MB':>8}")
+    for stage, values in report['stages'].items():
+        items_in = values['items_in'] if values['items_in'] is not None else ''
+        items_out = values['items_out'] if values['items_out'] is not None else ''
+        throughput = values['items_per_second'] if values['items_per_second'] is not None else ''
+        print(f"{stage:<46} {values['wall_seconds']:>9.2f} {items_in:>7} {items_out:>7} {throughput:>9} {values['peak_rss_mb']:>8}")
+    print(f"{'total':<46} {report['wall_seconds']:>9.2f} {emails_listed:>7} {'':>7} "
+          f"{round(emails_listed / report['wall_seconds'], 2) if report['wall_seconds'] else '':>9}")
+
+def main():
+    args = parse_args()
+    synthetic_mailbox = SyntheticMailbox(args.num_emails, seed=args.seed)
+    gmail_server, gmail_api, gmail_url = start_fake_gmail_server(
+        synthetic_mailbox,
+        fault_profile_from_args(args, 'gmail-'),
+        quota_units_per_second=args.gmail_quota_units_per_second,
+    )
+    groq_api = FakeGroqApi(
+        fault_profile_from_args(args, 'groq-'),
+        requests_per_minute=args.groq_requests_per_minute or None,
+        tokens_per_second=args.groq_tokens_per_second,
+        batch_turnaround_seconds=args.batch_turnaround_seconds,
+        batch_error_rate=args.batch_error_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    groq_server, groq_url = start_fake_groq_server(groq_api)
+    # The Groq and OpenAI clients read these when they are created, i.e. during the stages.
+    os.environ.update({
+        'GROQ_BASE_URL': groq_url,
+        'GROQ_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': f'{groq_url}/openai/v1',
+        'OPENAI_API_KEY': 'benchmark',
+    })
+    print(f"Benchmarking with {len(synthetic_mailbox.emails)} synthetic emails, fake Gmail on {gmail_url}, "
+          f"fake Groq on {groq_url}, data in {RUN_DIR}")
+
+    context = MailboxContext(
+        'benchmark',
+        f'{RUN_DIR}/token.pickle',
+        RUN_DIR,
+        CLIENT_ID,
+        CLIENT_SECRET,
+        SCOPES,
+        credentials=Credentials(token='benchmark'),
+        interactive=False,
+        client_options={'api_endpoint': gmail_url},
+        gmail_quota_units_per_second=args.gmail_quota_units_per_second,
+    )
+    set_default_mailbox(context)
+    configure_llm_router(args)
+    try:
+        trip_jsons = scan_mailbox(args)
+        found, expected = reservation_recall(synthetic_mailbox)
+    finally:
+        gmail_server.shutdown()
+        groq_server.shutdown()
+
+    report = metrics.report()
+    emails_listed = (report['stages'].get('search') or {}).get('items_out') or 0
+    print("\n=== Pipeline benchmark ===")
+    print_stage_table(report, emails_listed)
+    print(f"\nFound {found} / {expected} synthetic reservations, {len(trip_jsons or [])} trips generated.")
+    print(f"Fake Gmail: {gmail_api.faults.report()}, quota: {gmail_api.quota.report() if gmail_api.quota else None}")
+    print(f"Fake Groq: {groq_api.faults.report()}, rate limits: {groq_api.rate_limits.report() if groq_api.rate_limits else None}")
+    llm_router.print_report()
+    get_email_preclassifier().print_stats()
+    for controller in [context.gmail_concurrency, context.gmail_batch_concurrency, groq_concurrency]:
+        controller.print_report()
+    context.gmail_quota.print_report()
+    metrics.print_summary()
+
+    result = {
+        'args': vars(args),
+        'reservations_found': found,
+        'reservations_expected': expected,
+        'fake_gmail': {'faults': gmail_api.faults.report(), 'quota': gmail_api.quota.report() if gmail_api.quota else None},
+        'fake_groq': {'faults': groq_api.faults.report(), 'rate_limits': groq_api.rate_limits.report() if groq_api.rate_limits else None},
+        'metrics': report,
+    }
+    with open(f'{RUN_DIR}/benchmark.json', 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved the benchmark results to {RUN_DIR}/benchmark.json")
+    if args.profile:
+        metrics.write_report(RUN_DIR)
+    context.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Slot:
+    """Handle for one in-flight request, lets the caller report how the request went."""
+
+    def __init__(self):
+        self.throttled = False
+        self.failed = False
+
+    def mark_throttled(self):
+        self.throttled = True
+
+    def mark_failed(self):
+        self.failed = True
+
+
+class AIMDConcurrencyController:
+    """Adaptive concurrency limit using additive increase / multiplicative decrease.
+
+    Callers take a slot before each request and report the outcome when they give it back. Once a
+    full window of requests (as many as the current limit) completes with healthy latency and no
+    throttling, the limit grows by `additive_increase`. A throttling signal (429,
+    rateLimitExceeded, ...) or a latency above `latency_threshold` multiplies the limit by
+    `decrease_factor`, at most once per `decrease_cooldown` so a burst of 429s from the same
+    window only counts once. Every limit change is recorded in `history` for reporting.
+    """
+
+    def __init__(self, name, initial_limit=10, min_limit=1, max_limit=64, additive_increase=1,
+                 decrease_factor=0.5, latency_threshold=None, decrease_cooldown=1.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self.decrease_cooldown = decrease_cooldown
+        self.limit = max(min_limit, min(initial_limit, max_limit))
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_throttled = 0
+        self.num_failed = 0
+        self._healthy_in_window = 0
+        self._last_decrease_at = 0.0
+        self._started_at = time.monotonic()
+        self.history = [(0.0, self.limit)]
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(0.02)
+
+    def release(self, latency=None, throttled=False, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            self.num_requests += 1
+            now = time.monotonic()
+            slow = self.latency_threshold is not None and latency is not None and latency > self.latency_threshold
+
+            if throttled or slow:
+                self.num_throttled += int(throttled)
+                if now - self._last_decrease_at >= self.decrease_cooldown:
+                    self._last_decrease_at = now
+                    self._healthy_in_window = 0
+                    self._set_limit(int(self.limit * self.decrease_factor), now)
+            elif failed:
+                self.num_failed += 1
+            else:
+                self._healthy_in_window += 1
+                if self._healthy_in_window >= self.limit:
+                    self._healthy_in_window = 0
+                    self._set_limit(self.limit + self.additive_increase, now)
+
+            self._condition.notify_all()
+
+    def _set_limit(self, new_limit, now):
+        new_limit = max(self.min_limit, min(new_limit, self.max_limit))
+        if new_limit != self.limit:
+            self.limit = new_limit
+            self.history.append((now - self._started_at, new_limit))
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of a request: `with controller.slot() as slot: ...`.
+
+        Exceptions count as failures unless the caller already marked the slot as throttled.
+        """
+        self.acquire()
+        slot = _Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception:
+            slot.failed = True
+            raise
+        finally:
+            self.release(time.monotonic() - start, throttled=slot.throttled, failed=slot.failed)
+
+    def report(self):
+        limits = [limit for _, limit in self.history]
+        return {
+            'name': self.name,
+            'limit': self.limit,
+            'min_limit_seen': min(limits),
+            'max_limit_seen': max(limits),
+            'requests': self.num_requests,
+            'throttled': self.num_throttled,
+            'failed': self.num_failed,
+            'history': [(round(elapsed, 2), limit) for elapsed, limit in self.history],
+        }
+
+    def print_report(self, max_points=20):
+        report = self.report()
+        history = report['history']
+        step = max(1, len(history) // max_points)
+        sampled = history[::step]
+        if history[-1] not in sampled:
+            sampled.append(history[-1])
+        print(f"Concurrency {report['name']}: limit {report['limit']} (range {report['min_limit_seen']}-{report['max_limit_seen']}), "
+              f"{report['requests']} requests, {report['throttled']} throttled, {report['failed']} failed")
+        print(f"   limit over time (seconds, limit): {sampled}")
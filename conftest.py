@@ -0,0 +1,19 @@
+import pytest
+
+
+class FakeClock:
+    """Stand-in for time.monotonic / time.time that only moves when the test advances it."""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
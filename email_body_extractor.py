@@ -0,0 +1,207 @@
+import base64
+import re
+import threading
+import multiprocessing
+import concurrent.futures
+from html.parser import HTMLParser
+
+MAX_BODY_CHARS = 20000  # Reservation details fit comfortably, marketing tails get cut
+PROCESS_POOL_MIN_BATCH = 64  # Below this many payloads, process startup costs more than it saves
+PROCESS_POOL_CHUNKSIZE = 16
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Tags whose text content is never shown to the reader.
+_SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template'}
+# Tags that visually separate text, so their boundaries become a space.
+_BREAK_TAGS = {'br', 'p', 'div', 'tr', 'td', 'th', 'li', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+class _TextExtractingHTMLParser(HTMLParser):
+    """Incremental HTML to text converter that drops script / style content and stops at a size cap."""
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.num_chars = 0
+        self.chunks = []
+        self._skip_depth = 0
+
+    @property
+    def is_full(self):
+        return self.num_chars >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in _BREAK_TAGS:
+            self.chunks.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS and self._skip_depth > 0:
+            self._skip_depth -= 1
+        elif tag in _BREAK_TAGS:
+            self.chunks.append(' ')
+
+    def handle_data(self, data):
+        if self._skip_depth or self.is_full:
+            return
+        self.chunks.append(data)
+        self.num_chars += len(data)
+
+    def text(self):
+        return _WHITESPACE_RE.sub(' ', ''.join(self.chunks)).strip()
+
+
+def html_to_text(html, max_chars=MAX_BODY_CHARS, feed_size=8192):
+    """Convert HTML to plain text in a single streaming pass, stopping once max_chars are collected."""
+    parser = _TextExtractingHTMLParser(max_chars)
+    for i in range(0, len(html), feed_size):
+        parser.feed(html[i:i + feed_size])
+        if parser.is_full:
+            break
+    else:
+        parser.close()
+    return parser.text()[:max_chars]
+
+def _decode_part_data(part):
+    data = part.get('body', {}).get('data')
+    if not data:
+        return None
+    return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+def _find_text_part(part, mime_type):
+    """Depth-first search for the first part of the given text type that carries inline data."""
+    if part.get('mimeType') == mime_type and part.get('body', {}).get('data'):
+        return part
+    for subpart in part.get('parts', []):
+        found = _find_text_part(subpart, mime_type)
+        if found is not None:
+            return found
+    return None
+
+def select_text_parts(payload):
+    """Return the parts extract_body_text would read, whether or not their data is inline.
+
+    Used to decide which text parts are worth downloading separately (Gmail moves large bodies
+    behind an attachmentId): one alternative per multipart/alternative, text/plain first.
+    """
+    mime_type = payload.get('mimeType', '')
+    if mime_type in ('text/plain', 'text/html'):
+        return [payload]
+    subparts = payload.get('parts', [])
+    if mime_type == 'multipart/alternative':
+        for preferred in ('text/plain', 'text/html'):
+            for subpart in subparts:
+                selected = select_text_parts(subpart)
+                if selected and selected[0].get('mimeType') == preferred:
+                    return selected[:1]
+        return []
+    selected = []
+    for subpart in subparts:
+        selected.extend(select_text_parts(subpart))
+    return selected
+
+def iter_parts(payload):
+    """Yield every part of a MIME tree, depth first."""
+    yield payload
+    for subpart in payload.get('parts', []):
+        yield from iter_parts(subpart)
+
+def _collect_text(part, chunks, budget):
+    """Walk the MIME tree once, appending the text of each displayable part while budget lasts."""
+    if budget[0] <= 0:
+        return
+
+    mime_type = part.get('mimeType', '')
+    if mime_type == 'multipart/alternative':
+        # Alternatives carry the same content: take text/plain if present, else text/html.
+        chosen = _find_text_part(part, 'text/plain') or _find_text_part(part, 'text/html')
+        if chosen is not None:
+            _collect_text(chosen, chunks, budget)
+        return
+
+    if mime_type == 'text/plain':
+        text = _decode_part_data(part)
+        if text:
+            text = _WHITESPACE_RE.sub(' ', text[:budget[0] * 2]).strip()[:budget[0]]
+    elif mime_type == 'text/html':
+        html = _decode_part_data(part)
+        text = html_to_text(html, max_chars=budget[0]) if html else None
+    else:
+        text = None
+
+    if text:
+        chunks.append(text)
+        budget[0] -= len(text) + 1
+
+    for subpart in part.get('parts', []):
+        _collect_text(subpart, chunks, budget)
+
+def extract_body_text(payload, max_chars=MAX_BODY_CHARS):
+    """Extract the readable text of a Gmail message payload (format='full').
+
+    Prefers text/plain inside multipart/alternative (so the same content is never decoded twice),
+    converts HTML with a streaming parser that drops script / style, and caps the result at
+    max_chars.
+
+    Returns:
+        The body text, or None if the message has no text part.
+    """
+    chunks = []
+    _collect_text(payload, chunks, [max_chars])
+    if not chunks:
+        return None
+    return ' '.join(chunks)[:max_chars]
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool(max_workers=None):
+    """Process pool shared by every extract_body_texts call, started on first use.
+
+    Workers are started by a forkserver (spawn where there is none), never by fork()ing the
+    caller: extraction runs on the scanner's worker threads, and a child forked from a
+    multithreaded process can deadlock on a lock another thread held at fork time.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                # The forkserver only needs this module, not the (heavier) main script's imports.
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        return _process_pool
+
+def _reset_process_pool(executor):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is executor:
+            _process_pool = None
+    executor.shutdown(wait=False)
+
+def extract_body_texts(payloads, max_chars=MAX_BODY_CHARS, max_workers=None):
+    """Extract body text for many payloads, on a process pool when the batch is large.
+
+    Body extraction is CPU-bound, so threads don't help under the GIL; batches smaller than
+    PROCESS_POOL_MIN_BATCH are processed inline since starting workers would cost more. The pool
+    (max_workers processes, taken into account when it is first started) is kept for the
+    following batches.
+
+    Returns:
+        List of body texts in the same order as payloads.
+    """
+    if len(payloads) < PROCESS_POOL_MIN_BATCH:
+        return [extract_body_text(payload, max_chars) for payload in payloads]
+
+    executor = _get_process_pool(max_workers)
+    try:
+        return list(executor.map(extract_body_text, payloads, [max_chars] * len(payloads), chunksize=PROCESS_POOL_CHUNKSIZE))
+    except concurrent.futures.process.BrokenProcessPool as e:
+        # A worker died (e.g. killed for memory): start a new pool next time, finish this batch inline.
+        print(f"Body extraction process pool broke ({e}), extracting {len(payloads)} bodies inline.")
+        _reset_process_pool(executor)
+        return [extract_body_text(payload, max_chars) for payload in payloads]
@@ -0,0 +1,186 @@
+import re
+import hashlib
+from collections import defaultdict
+from email.utils import parseaddr, parsedate_to_datetime
+
+from prompt_compactor import RELEVANT_PATTERNS
+
+MINHASH_NUM_PERMUTATIONS = 32
+LSH_BANDS = 8  # 8 bands of 4 rows: pairs above ~0.6 Jaccard become candidates
+SHINGLE_SIZE = 3
+MAX_DEDUP_TEXT_CHARS = 4000
+MIN_SHINGLES_FOR_FUZZY_MATCH = 8  # Too little text (e.g. a generic subject alone) to call two emails duplicates
+
+_CONFIRMATION_NUMBER_RE = re.compile(
+    r'\b(?:confirmation|reservation|booking|itinerary)\s*(?:number|no\.?|#|code|id)?\s*[:#]?\s*((?=[A-Z0-9-]*\d)[A-Z0-9][A-Z0-9-]{4,19})\b',
+    re.IGNORECASE,
+)
+# Words hotels add to the subject of follow-ups of the same reservation.
+_FOLLOW_UP_WORDS_RE = re.compile(
+    r'\b(?:re|fw|fwd|reminder|updated?|modified|modification|changed?|revised|upcoming|pre-?arrival|'
+    r'arriving soon|countdown|your trip is coming up|see you soon)\b:?',
+    re.IGNORECASE,
+)
+_RELEVANT_RE = re.compile('|'.join(RELEVANT_PATTERNS), re.IGNORECASE)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def extract_confirmation_numbers(text):
+    """Confirmation / reservation numbers mentioned in text (uppercased, must contain a digit)."""
+    return {match.upper().strip('-') for match in _CONFIRMATION_NUMBER_RE.findall(text or '')}
+
+def normalize_for_dedup(text):
+    text = _FOLLOW_UP_WORDS_RE.sub(' ', (text or '').lower())
+    return _TOKEN_RE.findall(text)
+
+def shingle_hashes(tokens):
+    """Set of 64-bit hashes of the SHINGLE_SIZE-token shingles."""
+    shingles = {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    return {int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles}
+
+def minhash_signature(hashes):
+    """One permutation MinHash signature of the token shingles, None if there are too few shingles.
+
+    Each shingle hash is assigned to one of MINHASH_NUM_PERMUTATIONS bins and every bin keeps its
+    minimum, so signing costs one pass over the shingles instead of one per permutation. Empty
+    bins borrow the value of the next non-empty bin (densification) so signatures stay comparable.
+    """
+    if len(hashes) < MIN_SHINGLES_FOR_FUZZY_MATCH:
+        return None
+    bins = [None] * MINHASH_NUM_PERMUTATIONS
+    for h in hashes:
+        index, value = h % MINHASH_NUM_PERMUTATIONS, h // MINHASH_NUM_PERMUTATIONS
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    signature = []
+    for index in range(MINHASH_NUM_PERMUTATIONS):
+        offset = 0
+        while bins[(index + offset) % MINHASH_NUM_PERMUTATIONS] is None:
+            offset += 1
+        signature.append((bins[(index + offset) % MINHASH_NUM_PERMUTATIONS], offset))
+    return tuple(signature)
+
+def jaccard_similarity(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def _sender_domain(sender):
+    address = parseaddr(sender or '')[1].lower()
+    return address.rsplit('@', 1)[1] if '@' in address else ''
+
+def _timestamp(email):
+    try:
+        return parsedate_to_datetime(email.get('date')).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return 0
+
+def _has_body(email):
+    body = email.get('body')
+    return bool(body) and body != "Unknown body"
+
+def _dedup_text(email):
+    """Subject and body (snippet when the body isn't fetched yet), capped at MAX_DEDUP_TEXT_CHARS."""
+    body = email['body'] if _has_body(email) else email.get('snippet', '')
+    return f"{email.get('subject', '')} {body}"[:MAX_DEDUP_TEXT_CHARS]
+
+def completeness_score(email):
+    """Rank emails of one reservation: most reservation details first, then the most recent, then the longest."""
+    text = _dedup_text(email)
+    return (len({match.lower() for match in _RELEVANT_RE.findall(text)}), _timestamp(email), len(text))
+
+
+class _ReservationGroups:
+    """Union-find over email indices that never merges groups with different confirmation numbers."""
+
+    def __init__(self, confirmation_numbers):
+        self.parent = list(range(len(confirmation_numbers)))
+        self.confirmation_numbers = [set(numbers) for numbers in confirmation_numbers]
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return
+        numbers_i, numbers_j = self.confirmation_numbers[root_i], self.confirmation_numbers[root_j]
+        if numbers_i and numbers_j and not numbers_i & numbers_j:
+            return  # Similar template, different reservations
+        self.parent[root_j] = root_i
+        numbers_i |= numbers_j
+
+
+def collapse_duplicate_emails(emails, similarity_threshold=0.8):
+    """Collapse emails about the same reservation (confirmation, modification, reminder, ...).
+
+    Emails from the same sender domain are grouped when they share a confirmation number, or
+    when their normalized subject + body text is near-identical: MinHash signatures are bucketed
+    with LSH bands so only emails sharing a bucket are compared (by exact shingle Jaccard
+    similarity), keeping this sub-quadratic. Emails whose confirmation numbers differ are never
+    merged, and emails without a body (metadata only) are only merged on a shared confirmation
+    number: a subject and snippet alone look the same for different stays at one hotel. The most
+    complete email of each group goes forward, with the IDs of the others in 'duplicate_ids'.
+
+    Args:
+        emails: Email metadata (optionally with 'snippet' / 'body') dicts.
+        similarity_threshold: Minimum Jaccard similarity of the shingles of two duplicate emails.
+
+    Returns:
+        The kept emails, in input order.
+    """
+    texts = [_dedup_text(email) for email in emails]
+    domains = [_sender_domain(email.get('sender')) for email in emails]
+    groups = _ReservationGroups([extract_confirmation_numbers(text) for text in texts])
+
+    by_confirmation_number = {}
+    for i, domain in enumerate(domains):
+        for number in groups.confirmation_numbers[i]:
+            key = (domain, number)
+            if key in by_confirmation_number:
+                groups.union(by_confirmation_number[key], i)
+            else:
+                by_confirmation_number[key] = i
+
+    shingles = [shingle_hashes(normalize_for_dedup(text)) for text in texts]
+    signatures = [minhash_signature(hashes) if _has_body(email) else None for email, hashes in zip(emails, shingles)]
+    rows_per_band = MINHASH_NUM_PERMUTATIONS // LSH_BANDS
+    buckets = defaultdict(list)
+    for i, signature in enumerate(signatures):
+        if signature is None:
+            continue
+        for band in range(LSH_BANDS):
+            buckets[(domains[i], band, signature[band * rows_per_band:(band + 1) * rows_per_band])].append(i)
+
+    compared = set()
+    for candidates in buckets.values():
+        for a in range(len(candidates)):
+            for b in range(a + 1, len(candidates)):
+                pair = (candidates[a], candidates[b])
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                # LSH only proposes candidates, the exact shingle Jaccard decides.
+                if jaccard_similarity(shingles[pair[0]], shingles[pair[1]]) >= similarity_threshold:
+                    groups.union(*pair)
+
+    members = defaultdict(list)
+    for i in range(len(emails)):
+        members[groups.find(i)].append(i)
+
+    kept = {}
+    for indices in members.values():
+        best = max(indices, key=lambda i: completeness_score(emails[i])) if len(indices) > 1 else indices[0]
+        # Carry over the duplicates found by an earlier pass.
+        duplicate_ids = list(emails[best].get('duplicate_ids', []))
+        for i in indices:
+            if i != best:
+                duplicate_ids.append(emails[i]['id'])
+                duplicate_ids.extend(emails[i].get('duplicate_ids', []))
+        kept[best] = {**emails[best], 'duplicate_ids': duplicate_ids} if duplicate_ids else emails[best]
+
+    num_collapsed = len(emails) - len(kept)
+    if num_collapsed:
+        print(f"Collapsed {num_collapsed} duplicate emails, {len(kept)} / {len(emails)} emails go forward "
+              f"({len(compared)} candidate pairs compared).")
+    return [kept[i] for i in sorted(kept)]
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+
+# Marks the end of a stage's input stream.
+_END_OF_STREAM = object()
+
+
+class StreamingPipelineError(Exception):
+    """Some batches failed in a streaming pipeline, after all the other items went through it.
+
+    Attributes:
+        failed_items: Dict of stage name -> number of items whose batch raised an exception.
+    """
+
+    def __init__(self, failed_items):
+        super().__init__(f"Streaming pipeline stages failed on some items: {failed_items}")
+        self.failed_items = failed_items
+
+
+class PipelineStage:
+    """One stage of a streaming pipeline.
+
+    Args:
+        name: Stage name, used as key in the returned output counts.
+        process_batch: Function list of input items -> list of output items. Outputs are passed
+            on to the next stage (an empty list drops the inputs, e.g. a filter saying False).
+        workers: Number of threads running process_batch concurrently.
+        batch_size: Maximum number of items handed to process_batch at once.
+        max_batch_wait: Seconds to wait for a batch to fill up before processing a partial one,
+            so items keep flowing when the upstream stage is slow.
+    """
+
+    def __init__(self, name, process_batch, workers=1, batch_size=1, max_batch_wait=0.5):
+        self.name = name
+        self.process_batch = process_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_batch_wait = max_batch_wait
+
+
+def _next_batch(input_queue, batch_size, max_batch_wait):
+    """Take up to batch_size items from the queue, returns (items, reached end of stream)."""
+    item = input_queue.get()
+    if item is _END_OF_STREAM:
+        return [], True
+
+    items = [item]
+    deadline = time.monotonic() + max_batch_wait
+    while len(items) < batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            item = input_queue.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if item is _END_OF_STREAM:
+            return items, True
+        items.append(item)
+    return items, False
+
+
+def run_streaming_pipeline(source_items, stages, queue_size=200, collect_outputs=False):
+    """Run items through a chain of stages connected by bounded queues.
+
+    Every stage runs in its own worker threads and starts processing as soon as the first item
+    reaches it, so the network and LLM latency of different stages overlap. Bounded queues apply
+    back-pressure: a fast stage blocks instead of buffering the whole mailbox in memory when the
+    next stage falls behind. The outputs are only counted, stages save what they need
+    themselves (e.g. to a StageJournal), unless collect_outputs is set.
+
+    Args:
+        source_items: Iterable of items fed into the first stage.
+        stages: List of PipelineStage, in order.
+        queue_size: Maximum number of items waiting between two stages.
+        collect_outputs: Keep every stage's outputs in memory and return them instead of counts.
+
+    Returns:
+        Dict of stage name -> number of items that stage emitted, or the list of those items
+        with collect_outputs.
+
+    Raises:
+        StreamingPipelineError: If process_batch raised on some batches. The failed items are
+            dropped (and logged) so the rest of the stream isn't blocked, and reported once every
+            stage finished.
+        Exception: Whatever source_items raised, once the items read before it went through
+            every stage.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    num_outputs = {stage.name: 0 for stage in stages}
+    outputs = {stage.name: [] for stage in stages}
+    failed_items = {}
+    source_errors = []
+    outputs_lock = threading.Lock()
+    threads = []
+
+    def feed_source():
+        try:
+            for item in source_items:
+                queues[0].put(item)
+        except Exception as exc:
+            print(f"Streaming pipeline source failed: {exc}")
+            source_errors.append(exc)
+        finally:
+            # Always end the stream, or the first stage's workers would wait for items forever.
+            for _ in range(stages[0].workers):
+                queues[0].put(_END_OF_STREAM)
+
+    def run_stage_worker(stage_idx, finished_workers):
+        stage = stages[stage_idx]
+        input_queue = queues[stage_idx]
+        output_queue = queues[stage_idx + 1]
+        # The last stage's output queue has no consumer, so only record its outputs.
+        is_last_stage = stage_idx == len(stages) - 1
+
+        while True:
+            items, end_of_stream = _next_batch(input_queue, stage.batch_size, stage.max_batch_wait)
+            if items:
+                try:
+                    results = stage.process_batch(items) or []
+                except Exception as exc:
+                    print(f"Stage {stage.name} failed on {len(items)} items: {exc}")
+                    results = []
+                    with outputs_lock:
+                        failed_items[stage.name] = failed_items.get(stage.name, 0) + len(items)
+                with outputs_lock:
+                    num_outputs[stage.name] += len(results)
+                    if collect_outputs:
+                        outputs[stage.name].extend(results)
+                if not is_last_stage:
+                    for result in results:
+                        output_queue.put(result)
+            if end_of_stream:
+                break
+
+        with finished_workers['lock']:
+            finished_workers['count'] += 1
+            all_finished = finished_workers['count'] == stage.workers
+        if all_finished:
+            print(f"Stage {stage.name} finished with {num_outputs[stage.name]} outputs.")
+            if not is_last_stage:
+                for _ in range(stages[stage_idx + 1].workers):
+                    output_queue.put(_END_OF_STREAM)
+
+    threads.append(threading.Thread(target=feed_source, name="pipeline-source", daemon=True))
+    for stage_idx, stage in enumerate(stages):
+        finished_workers = {'count': 0, 'lock': threading.Lock()}
+        for worker_idx in range(stage.workers):
+            threads.append(threading.Thread(
+                target=run_stage_worker,
+                args=(stage_idx, finished_workers),
+                name=f"pipeline-{stage.name}-{worker_idx}",
+                daemon=True,
+            ))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if source_errors:
+        raise source_errors[0]
+    if failed_items:
+        raise StreamingPipelineError(failed_items)
+    return outputs if collect_outputs else num_outputs
@@ -0,0 +1,119 @@
+import json
+import re
+import threading
+from email.utils import parseaddr
+
+# Hotel chains, hotel collections and OTAs that send reservation confirmations.
+HOTEL_SENDER_DOMAINS = {
+    'marriott.com', 'ritzcarlton.com', 'hilton.com', 'hyatt.com', 'ihg.com', 'accor.com', 'fourseasons.com',
+    'rosewoodhotels.com', 'aubergeresorts.com', 'mandarinoriental.com', 'peninsula.com', 'aman.com',
+    'belmond.com', 'kempinski.com', 'shangri-la.com', 'fairmont.com', 'wyndhamhotels.com', 'choicehotels.com',
+    'bestwestern.com', 'radissonhotels.com', 'omnihotels.com', 'loewshotels.com', 'kimptonhotels.com',
+    'relaischateaux.com', 'lhw.com', 'slh.com', 'designhotels.com', 'montage.com', 'oetkercollection.com',
+    'booking.com', 'expedia.com', 'hotels.com', 'agoda.com', 'priceline.com', 'trip.com', 'hoteltonight.com',
+    'kayak.com', 'orbitz.com', 'travelocity.com', 'amextravel.com', 'fora.travel', 'virtuoso.com',
+}
+
+# Senders that never send hotel reservations: restaurants, airlines, ride sharing, shops, social, newsletters.
+NON_HOTEL_SENDER_DOMAINS = {
+    'opentable.com', 'resy.com', 'exploretock.com', 'sevenrooms.com', 'yelp.com',
+    'united.com', 'delta.com', 'aa.com', 'southwest.com', 'alaskaair.com', 'jetblue.com', 'britishairways.com',
+    'uber.com', 'lyft.com', 'doordash.com', 'instacart.com', 'amazon.com', 'ebay.com', 'apple.com',
+    'linkedin.com', 'facebookmail.com', 'twitter.com', 'x.com', 'instagram.com', 'substack.com',
+    'medium.com', 'mailchimp.com', 'list-manage.com', 'github.com', 'google.com', 'venmo.com', 'paypal.com',
+}
+
+# Subjects that are (almost) always a hotel reservation from a hotel / OTA sender.
+RESERVATION_SUBJECT_PATTERNS = [
+    r'\b(?:reservation|booking|stay)\b.{0,20}\bconfirm(?:ed|ation)?\b',
+    r'\bconfirm(?:ed|ation)\b.{0,30}\b(?:reservation|booking|stay)\b',
+    r'\bconfirmation\s*(?:#|number|no\.?|code)',
+    r'\byour (?:upcoming )?(?:stay|reservation|booking) at\b',
+    r'\b(?:reservation|booking|itinerary)\s*(?:#|number|no\.?)\s*[a-z0-9-]{4,}',
+]
+_RESERVATION_SUBJECT_RE = re.compile('|'.join(RESERVATION_SUBJECT_PATTERNS), re.IGNORECASE)
+
+# Subjects that are never a reservation confirmation.
+NON_RESERVATION_SUBJECT_PATTERNS = [
+    r'\bnewsletter\b', r'\bwebinar\b', r'\bsurvey\b', r'\b\d{1,2}\s?% off\b', r'\bflash sale\b',
+    r'\bhow was your (?:stay|trip|visit)\b', r'\breview your (?:stay|trip)\b', r'\brate your\b',
+    r'\bboarding pass\b', r'\bflight\b', r'\btable for\b', r'\bdinner reservation\b', r'\brestaurant\b',
+    r'\byour (?:uber|lyft) (?:trip|ride)\b', r'\bpassword\b', r'\bverify your (?:email|account)\b',
+    r'\bexclusive (?:offer|deals?)\b', r'\bspecial offer\b',
+]
+_NON_RESERVATION_SUBJECT_RE = re.compile('|'.join(NON_RESERVATION_SUBJECT_PATTERNS), re.IGNORECASE)
+
+def _sender_domain(sender):
+    address = parseaddr(sender or '')[1].lower()
+    return address.rsplit('@', 1)[1] if '@' in address else ''
+
+def _matches_domain(domain, domains):
+    """Exact domain match or any subdomain of it (e.g. email.marriott.com)."""
+    return any(domain == known or domain.endswith('.' + known) for known in domains)
+
+def load_keyword_phrases(file_path='hotel_reservation_search_keywords.jsonl'):
+    """Load the Gmail search keyword phrases, whitespace normalized and lowercased."""
+    with open(file_path, 'r') as f:
+        return [' '.join(json.loads(line).split()).lower() for line in f if line.strip()]
+
+
+class EmailPreclassifier:
+    """Cheap local hotel reservation classifier for email metadata.
+
+    Combines sender domain allow / deny lists, subject regexes and the search keyword phrases.
+    Only confident decisions are returned; everything else is left to the LLM.
+    """
+
+    def __init__(self, keyword_phrases=None):
+        self.keyword_phrases = keyword_phrases if keyword_phrases is not None else load_keyword_phrases()
+        self.num_true = 0
+        self.num_false = 0
+        self.num_ambiguous = 0
+        self._lock = threading.Lock()
+
+    def classify(self, email_metadata):
+        """Return (decision, reason): decision is True / False when confident, None when ambiguous."""
+        domain = _sender_domain(email_metadata.get('sender'))
+        subject = ' '.join(str(email_metadata.get('subject', '')).split())
+        subject_lower = subject.lower()
+
+        is_hotel_sender = _matches_domain(domain, HOTEL_SENDER_DOMAINS)
+        is_non_hotel_sender = _matches_domain(domain, NON_HOTEL_SENDER_DOMAINS)
+        has_reservation_subject = bool(_RESERVATION_SUBJECT_RE.search(subject))
+        has_non_reservation_subject = bool(_NON_RESERVATION_SUBJECT_RE.search(subject))
+        has_keyword_phrase = any(phrase in subject_lower for phrase in self.keyword_phrases)
+
+        if is_non_hotel_sender and not has_reservation_subject:
+            decision, reason = False, f"non-hotel sender {domain}"
+        elif has_non_reservation_subject and not has_reservation_subject:
+            decision, reason = False, "non-reservation subject"
+        elif is_hotel_sender and (has_reservation_subject or has_keyword_phrase) and not has_non_reservation_subject:
+            decision, reason = True, f"hotel sender {domain} with reservation subject"
+        else:
+            decision, reason = None, "ambiguous"
+
+        with self._lock:
+            if decision is True:
+                self.num_true += 1
+            elif decision is False:
+                self.num_false += 1
+            else:
+                self.num_ambiguous += 1
+        return decision, reason
+
+    def stats(self):
+        with self._lock:
+            total = self.num_true + self.num_false + self.num_ambiguous
+            decided = self.num_true + self.num_false
+            return {
+                'total': total,
+                'decided_true': self.num_true,
+                'decided_false': self.num_false,
+                'ambiguous': self.num_ambiguous,
+                'decided_locally_share': decided / total if total else 0.0,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Pre-classifier: {stats['decided_locally_share']:.0%} of {stats['total']} emails decided locally "
+              f"({stats['decided_true']} True, {stats['decided_false']} False), {stats['ambiguous']} sent to the LLM.")
@@ -0,0 +1,100 @@
+import time
+import random
+import threading
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from rate_limiter import TokenBucket
+
+
+class FaultProfile:
+    """Latency and failures a fake API server injects into its responses.
+
+    Every call waits latency_seconds plus up to latency_jitter_seconds, then fails with a 429 with
+    probability rate_limit_rate or with a 503 with probability error_rate. With a
+    requests_per_second limit, calls beyond it (averaged over burst_seconds) are answered with a
+    429 as well, like a provider enforcing its quota. Cost lets one call count as several
+    requests (e.g. Gmail quota units).
+    """
+
+    def __init__(self, latency_seconds=0.0, latency_jitter_seconds=0.0, error_rate=0.0, rate_limit_rate=0.0, requests_per_second=None,
+                 burst_seconds=1.0, seed=None):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.bucket = TokenBucket(requests_per_second * burst_seconds, requests_per_second) if requests_per_second else None
+        self.num_calls = 0
+        self.num_rate_limited = 0
+        self.num_errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, scale=1.0):
+        with self._lock:
+            jitter = self._rng.uniform(0, self.latency_jitter_seconds)
+        if self.latency_seconds or jitter:
+            time.sleep((self.latency_seconds + jitter) * scale)
+
+    def fault(self, cost=1):
+        """Decide the outcome of one call: None to answer it, or the HTTP status (429 / 503) to fail it with."""
+        with self._lock:
+            self.num_calls += 1
+            draw = self._rng.random()
+            status = None
+            if draw < self.rate_limit_rate:
+                status = 429
+            elif draw < self.rate_limit_rate + self.error_rate:
+                status = 503
+            elif self.bucket is not None:
+                if self.bucket.available() < cost:
+                    status = 429
+                else:
+                    self.bucket.reserve(cost)
+            if status == 429:
+                self.num_rate_limited += 1
+            elif status:
+                self.num_errors += 1
+            return status
+
+    def report(self):
+        with self._lock:
+            return {'calls': self.num_calls, 'rate_limited': self.num_rate_limited, 'errors': self.num_errors}
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Skips the access log line of every request, which would drown the benchmark's own output."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve_in_thread(app, host='127.0.0.1', port=0):
+    """Serve a Flask app from a daemon thread (one thread per request), returns (server, base URL).
+
+    Port 0 picks a free port. Call server.shutdown() to stop it.
+    """
+    server = make_server(host, port, app, threaded=True, request_handler=_QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+def add_fault_arguments(parser, prefix='', latency_ms=50):
+    """Add the FaultProfile command line options, with an optional prefix (e.g. 'gmail-')."""
+    parser.add_argument(f'--{prefix}latency-ms', type=float, default=latency_ms,
+                        help=f'Latency added to every call (default {latency_ms})')
+    parser.add_argument(f'--{prefix}latency-jitter-ms', type=float, default=latency_ms,
+                        help=f'Up to this much random latency added on top (default {latency_ms})')
+    parser.add_argument(f'--{prefix}error-rate', type=float, default=0.0,
+                        help='Share of calls failing with a 503 (default 0)')
+    parser.add_argument(f'--{prefix}rate-limit-rate', type=float, default=0.0,
+                        help='Share of calls failing with a 429 regardless of load (default 0)')
+
+def fault_profile_from_args(args, prefix=''):
+    prefix = prefix.replace('-', '_')
+    return FaultProfile(
+        latency_seconds=getattr(args, f'{prefix}latency_ms') / 1000,
+        latency_jitter_seconds=getattr(args, f'{prefix}latency_jitter_ms') / 1000,
+        error_rate=getattr(args, f'{prefix}error_rate'),
+        rate_limit_rate=getattr(args, f'{prefix}rate_limit_rate'),
+    )
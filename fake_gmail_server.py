@@ -0,0 +1,171 @@
+# Usage:
+# uv run fake_gmail_server.py --port 8081 --num-emails 5000 --latency-ms 80 --rate-limit-rate 0.01
+#
+# Local stand-in for the Gmail API endpoints the email pipeline uses (profile, messages.list,
+# messages.get, attachments.get, history.list and the batch endpoint), serving a synthetic
+# mailbox (see synthetic_mailbox.py) with configurable latency, errors and quota enforcement.
+# Point a GmailServicePool at it with client_options={'api_endpoint': 'http://127.0.0.1:8081/'}.
+
+import re
+import json
+import time
+import uuid
+import argparse
+from email.parser import FeedParser
+from urllib.parse import urlsplit, parse_qs
+
+from flask import Flask, Response, request
+
+from fake_api_server import FaultProfile, serve_in_thread, add_fault_arguments, fault_profile_from_args
+from gmail_quota import GMAIL_QUOTA_UNITS, GMAIL_USER_QUOTA_UNITS_PER_SECOND
+from synthetic_mailbox import SyntheticMailbox, BENCHMARK_EMAIL_ADDRESS
+
+# Extra latency of each sub-request of a batch call, on top of the call's own latency.
+BATCH_PART_LATENCY_SECONDS = 0.002
+GMAIL_MAX_PAGE_SIZE = 500
+# Gmail enforces the per-user quota as a moving average, a one-off burst of a 100 message batch call passes.
+GMAIL_QUOTA_WINDOW_SECONDS = 2.0
+
+_ROUTES = [
+    (re.compile(r'^/gmail/v1/users/[^/]+/profile$'), 'getProfile'),
+    (re.compile(r'^/gmail/v1/users/[^/]+/history$'), 'history.list'),
+    (re.compile(r'^/gmail/v1/users/[^/]+/messages$'), 'messages.list'),
+    (re.compile(r'^/gmail/v1/users/[^/]+/messages/(?P<msg_id>[^/]+)$'), 'messages.get'),
+    (re.compile(r'^/gmail/v1/users/[^/]+/messages/(?P<msg_id>[^/]+)/attachments/(?P<attachment_id>[^/]+)$'), 'messages.attachments.get'),
+]
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests', 503: 'Service Unavailable'}
+
+
+def _error(status, message=None):
+    reason = {429: 'rateLimitExceeded', 404: 'notFound', 400: 'invalidArgument'}.get(status, 'backendError')
+    message = message or ('User-rate limit exceeded.' if status == 429 else 'Backend Error')
+    return status, {'error': {'code': status, 'message': message, 'errors': [{'message': message, 'domain': 'global', 'reason': reason}]}}
+
+
+class FakeGmailApi:
+    """Answers Gmail API calls from a SyntheticMailbox, with the faults of a FaultProfile.
+
+    With quota_units_per_second set, calls beyond the per-user quota unit rate over
+    quota_window_seconds (each call costing its GMAIL_QUOTA_UNITS, batch sub-requests each on
+    their own) get a 429 rateLimitExceeded.
+    """
+
+    def __init__(self, mailbox, faults=None, quota_units_per_second=None, quota_window_seconds=GMAIL_QUOTA_WINDOW_SECONDS,
+                 batch_part_latency_seconds=BATCH_PART_LATENCY_SECONDS):
+        self.mailbox = mailbox
+        self.faults = faults or FaultProfile()
+        self.quota = FaultProfile(requests_per_second=quota_units_per_second, burst_seconds=quota_window_seconds) if quota_units_per_second else None
+        self.batch_part_latency_seconds = batch_part_latency_seconds
+
+    def call(self, path, params):
+        """Answer one API call (not delayed), returns (HTTP status, JSON body)."""
+        for pattern, method in _ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return _error(404, f'Unknown path {path}')
+
+        status = self.faults.fault() or (self.quota.fault(GMAIL_QUOTA_UNITS[method]) if self.quota else None)
+        if status:
+            return _error(status)
+
+        if method == 'getProfile':
+            return 200, {'emailAddress': BENCHMARK_EMAIL_ADDRESS, 'messagesTotal': len(self.mailbox.emails),
+                         'threadsTotal': len(self.mailbox.emails), 'historyId': str(self.mailbox.history_id)}
+        if method == 'history.list':
+            return 200, {'history': [], 'historyId': str(self.mailbox.history_id)}
+        if method == 'messages.list':
+            hits = self.mailbox.search(params.get('q', [''])[0])
+            offset = int(params.get('pageToken', ['0'])[0] or 0)
+            page_size = min(int(params.get('maxResults', ['100'])[0]), GMAIL_MAX_PAGE_SIZE)
+            result = {'resultSizeEstimate': len(hits)}
+            page = hits[offset:offset + page_size]
+            if page:
+                result['messages'] = [{'id': email['id'], 'threadId': email['thread_id']} for email in page]
+            if offset + page_size < len(hits):
+                result['nextPageToken'] = str(offset + page_size)
+            return 200, result
+        if method == 'messages.get':
+            message = self.mailbox.message(
+                match.group('msg_id'),
+                format=params.get('format', ['full'])[0],
+                metadata_headers=params.get('metadataHeaders'),
+                fields=params.get('fields', [None])[0],
+            )
+            return (200, message) if message else _error(404, 'Requested entity was not found.')
+        attachment = self.mailbox.attachment(match.group('msg_id'), match.group('attachment_id'))
+        return (200, attachment) if attachment else _error(404, 'Requested entity was not found.')
+
+    def batch(self, content_type, body):
+        """Answer a multipart/mixed batch call, returns (content type, multipart body)."""
+        parser = FeedParser()
+        parser.feed(f'Content-Type: {content_type}\r\n\r\n')
+        parser.feed(body)
+        parts = parser.close().get_payload()
+
+        boundary = f'batch_{uuid.uuid4().hex}'
+        lines = []
+        for part in parts:
+            request_line = part.get_payload().lstrip().split('\n', 1)[0].strip()
+            _, url, _ = request_line.split(' ', 2)
+            url = urlsplit(url)
+            status, response = self.call(url.path, parse_qs(url.query))
+            content_id = part['Content-ID'].strip()[1:-1]
+            lines += [
+                f'--{boundary}',
+                'Content-Type: application/http',
+                f'Content-ID: <response-{content_id}>',
+                '',
+                f'HTTP/1.1 {status} {_REASONS.get(status, "Error")}',
+                'Content-Type: application/json; charset=UTF-8',
+                '',
+                json.dumps(response),
+                '',
+            ]
+        lines.append(f'--{boundary}--')
+        time.sleep(self.batch_part_latency_seconds * len(parts))
+        return f'multipart/mixed; boundary={boundary}', '\r\n'.join(lines)
+
+
+def create_fake_gmail_app(api):
+    app = Flask(__name__)
+
+    @app.route('/gmail/v1/<path:path>', methods=['GET'])
+    def gmail_call(path):
+        api.faults.delay()
+        status, body = api.call(f'/gmail/v1/{path}', request.args.to_dict(flat=False))
+        return Response(json.dumps(body), status=status, mimetype='application/json')
+
+    @app.route('/batch/gmail/v1', methods=['POST'])
+    @app.route('/batch', methods=['POST'])
+    def gmail_batch():
+        api.faults.delay()
+        content_type, body = api.batch(request.headers['Content-Type'], request.get_data(as_text=True))
+        return Response(body, status=200, content_type=content_type)
+
+    return app
+
+def start_fake_gmail_server(mailbox, faults=None, quota_units_per_second=None, host='127.0.0.1', port=0):
+    """Serve a fake Gmail API for mailbox from a background thread, returns (server, FakeGmailApi, base URL)."""
+    api = FakeGmailApi(mailbox, faults, quota_units_per_second)
+    server, url = serve_in_thread(create_fake_gmail_app(api), host, port)
+    return server, api, f'{url}/'
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic mailbox through a fake Gmail API.')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--num-emails', type=int, default=2000, help='Size of the synthetic mailbox (default 2000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quota-units-per-second', type=float, default=GMAIL_USER_QUOTA_UNITS_PER_SECOND,
+                        help=f'Per-user quota unit rate enforced with 429s (default {GMAIL_USER_QUOTA_UNITS_PER_SECOND}, 0 for none)')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    mailbox = SyntheticMailbox(args.num_emails, seed=args.seed)
+    api = FakeGmailApi(mailbox, fault_profile_from_args(args), args.quota_units_per_second or None)
+    print(f"Serving {len(mailbox.emails)} synthetic emails on http://127.0.0.1:{args.port}/")
+    create_fake_gmail_app(api).run(host='127.0.0.1', port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
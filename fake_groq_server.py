@@ -0,0 +1,287 @@
+# Usage:
+# uv run fake_groq_server.py --port 8082 --latency-ms 300 --requests-per-minute 1000 --batch-turnaround-seconds 20
+#
+# Local stand-in for the Groq chat completions, files and batches endpoints (also usable as an
+# OpenAI chat completions endpoint), answering the email pipeline's prompts about the synthetic
+# mailbox (see synthetic_mailbox.py) with configurable latency, errors and rate limits.
+# Point the clients at it with GROQ_BASE_URL=http://127.0.0.1:8082 and
+# OPENAI_BASE_URL=http://127.0.0.1:8082/openai/v1.
+
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+
+from flask import Flask, Response, request
+
+from fake_api_server import FaultProfile, serve_in_thread, add_fault_arguments, fault_profile_from_args
+from synthetic_mailbox import SYNTHETIC_HOTELS
+
+DEFAULT_TOKENS_PER_SECOND = 500
+DEFAULT_BATCH_TURNAROUND_SECONDS = 20.0
+# Labels of the reservation fields in the synthetic emails, in order.
+RESERVATION_FIELD_LABELS = ['Confirmation Number', 'Guest Name', 'Arrival Date', 'Departure Date', 'Room Type', 'Guests', 'Rate Plan', 'Total', 'Payment', 'Loyalty']
+_FIELD_END = r'(?=\s+(?:' + '|'.join(RESERVATION_FIELD_LABELS) + r'):|\n|$)'
+
+
+def count_tokens(text):
+    """Rough token count (4 characters per token), good enough for usage numbers and pacing."""
+    return len(text) // 4 + 1
+
+def _field(text, label):
+    match = re.search(rf'{label}: (.*?){_FIELD_END}', text)
+    return match.group(1).strip() if match else None
+
+def _find_hotel(text):
+    return next((hotel for hotel in SYNTHETIC_HOTELS if hotel['name'] in text), None)
+
+def _key_insights(email_text):
+    hotel = _find_hotel(email_text)
+    if hotel is None:
+        return {'hotel': None, 'city': None, 'country': None}
+    total = (_field(email_text, 'Total') or '').split()
+    return {
+        'hotel': hotel['name'],
+        'city': hotel['city'],
+        'country': hotel['country'],
+        'check_in': _field(email_text, 'Arrival Date'),
+        'check_out': _field(email_text, 'Departure Date'),
+        'guests': int(_field(email_text, 'Guests') or 0) or None,
+        'total_price': float(total[0]) if total else None,
+        'currency': total[1] if len(total) > 1 else None,
+        'loyalty_tier': _field(email_text, 'Loyalty'),
+        'payment_method': _field(email_text, 'Payment'),
+        'room_type': _field(email_text, 'Room Type'),
+    }
+
+def fake_completion(prompt, rng=random, malformed_rate=0.0):
+    """Answer one of the email pipeline's prompts about the synthetic mailbox like a model would."""
+    if 'Just answer True or False' in prompt:
+        email_text = prompt.split('Metadata:', 1)[-1].split('Email:', 1)[-1]
+        is_reservation = _find_hotel(email_text) is not None and ('Metadata:' in prompt or 'Confirmation Number' in email_text)
+        return 'True' if is_reservation else 'False'
+    if 'Extract the reservation as a single JSON object' in prompt:
+        answer = json.dumps(_key_insights(prompt.split('Email data:', 1)[-1]))
+        if rng.random() < malformed_rate:
+            # A trailing comma and Python literals, the mistakes key_insights_schema repairs locally.
+            answer = answer[:-1].replace('null', 'None') + ',}'
+        return answer
+    if 'Rewrite it as valid JSON' in prompt:
+        answer = prompt.split('Answer:\n', 1)[-1]
+        return re.sub(r',\s*}', '}', answer).replace('None', 'null')
+    if 'future possile trips' in prompt:
+        match = re.search(r'up to (\d+) trip objects', prompt)
+        num_trips = int(match.group(1)) if match else 5
+        hotels = [hotel for hotel in SYNTHETIC_HOTELS if hotel['name'] in prompt or hotel['city'] in prompt] or SYNTHETIC_HOTELS
+        return json.dumps([
+            {
+                'name': f"{hotel['city']} getaway",
+                'startDate': '2027-02-18T07:00:00.000Z',
+                'endDate': '2027-02-21T07:00:00.000Z',
+                'destination': {'city': hotel['city'], 'state': '', 'country': hotel['country']},
+                'numberOfGuests': {'$numberInt': '2'},
+                'notes': f"Stayed at {hotel['name']} before",
+                'totalBudget': '$$$',
+                'purpose': 'Couple\'s getaway',
+            }
+            for hotel in hotels[:num_trips]
+        ])
+    if 'trip types' in prompt or 'types of trips' in prompt:
+        hotels = [hotel for hotel in SYNTHETIC_HOTELS if hotel['name'] in prompt or hotel['city'] in prompt]
+        return '\n'.join(
+            f"{i + 1}. {hotel['city']}, {hotel['country']}: stays at {hotel['name']}, 3 nights on average, 2 adults."
+            for i, hotel in enumerate(hotels)
+        ) or '1. No trip types found.'
+    return 'OK'
+
+
+class FakeGroqApi:
+    """Chat completions and Batch API of a fake Groq, with the faults of a FaultProfile.
+
+    requests_per_minute is enforced with 429s carrying a retry-after header. Completions take
+    the profile's latency plus their completion tokens at tokens_per_second. Batches complete
+    batch_turnaround_seconds after creation, and batch_error_rate of their requests end up in
+    the error file.
+    """
+
+    def __init__(self, faults=None, requests_per_minute=None, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 batch_turnaround_seconds=DEFAULT_BATCH_TURNAROUND_SECONDS, batch_error_rate=0.0, malformed_rate=0.0, seed=0):
+        self.faults = faults or FaultProfile()
+        self.rate_limits = FaultProfile(requests_per_second=requests_per_minute / 60) if requests_per_minute else None
+        self.tokens_per_second = tokens_per_second
+        self.batch_turnaround_seconds = batch_turnaround_seconds
+        self.batch_error_rate = batch_error_rate
+        self.malformed_rate = malformed_rate
+        self.files = {}
+        self.batches = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._batches_lock = threading.Lock()
+
+    def completion(self, body):
+        """The chat.completion object answering a request body."""
+        prompt = '\n'.join(message.get('content') or '' for message in body.get('messages', []))
+        with self._lock:
+            content = fake_completion(prompt, self._rng, self.malformed_rate)
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(content)
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop', 'logprobs': None}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    def create_file(self, file_name, content, purpose):
+        file_id = f'file_{uuid.uuid4().hex}'
+        with self._lock:
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()), 'filename': file_name, 'purpose': purpose}
+
+    def create_batch(self, body):
+        batch_id = f'batch_{uuid.uuid4().hex}'
+        batch = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': body.get('endpoint'),
+            'errors': None,
+            'input_file_id': body['input_file_id'],
+            'completion_window': body.get('completion_window'),
+            'status': 'in_progress',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'completed_at': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            'metadata': body.get('metadata'),
+        }
+        with self._batches_lock:
+            self.batches[batch_id] = batch
+        return batch
+
+    def _run_batch(self, batch):
+        outputs = []
+        errors = []
+        for line in self.files[batch['input_file_id']].splitlines():
+            if not line.strip():
+                continue
+            batch_request = json.loads(line)
+            if self._rng.random() < self.batch_error_rate:
+                errors.append({'id': f'batch_req_{uuid.uuid4().hex}', 'custom_id': batch_request['custom_id'], 'response': None,
+                               'error': {'code': 'internal_error', 'message': 'Injected batch request failure'}})
+                continue
+            outputs.append({'id': f'batch_req_{uuid.uuid4().hex}', 'custom_id': batch_request['custom_id'], 'error': None,
+                            'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': self.completion(batch_request['body'])}})
+        for key, entries in (('output_file_id', outputs), ('error_file_id', errors)):
+            if entries:
+                file_id = f'file_{uuid.uuid4().hex}'
+                self.files[file_id] = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+                batch[key] = file_id
+        batch.update({
+            'status': 'completed',
+            'completed_at': int(time.time()),
+            'request_counts': {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)},
+        })
+
+    def retrieve_batch(self, batch_id):
+        with self._batches_lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None and batch['status'] == 'in_progress' and time.time() >= batch['created_at'] + self.batch_turnaround_seconds:
+                self._run_batch(batch)
+            return batch
+
+    def cancel_batch(self, batch_id):
+        with self._batches_lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None and batch['status'] == 'in_progress':
+                batch.update({'status': 'cancelled', 'cancelled_at': int(time.time())})
+            return batch
+
+
+def _error_response(status, message, headers=None):
+    error_type = 'rate_limit_exceeded' if status == 429 else 'internal_server_error'
+    body = {'error': {'message': message, 'type': error_type, 'code': error_type}}
+    return Response(json.dumps(body), status=status, mimetype='application/json', headers=headers)
+
+def create_fake_groq_app(api):
+    app = Flask(__name__)
+
+    @app.route('/openai/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        api.faults.delay()
+        status = api.faults.fault() or (api.rate_limits.fault() if api.rate_limits else None)
+        if status == 429:
+            return _error_response(429, 'Rate limit reached for requests per minute.', headers={'retry-after': '1'})
+        if status:
+            return _error_response(status, 'Service unavailable.')
+        completion = api.completion(request.get_json())
+        if api.tokens_per_second:
+            time.sleep(completion['usage']['completion_tokens'] / api.tokens_per_second)
+        return Response(json.dumps(completion), mimetype='application/json')
+
+    @app.route('/openai/v1/files', methods=['POST'])
+    def create_file():
+        upload = request.files['file']
+        return Response(json.dumps(api.create_file(upload.filename, upload.read(), request.form.get('purpose'))), mimetype='application/json')
+
+    @app.route('/openai/v1/files/<file_id>/content', methods=['GET'])
+    def file_content(file_id):
+        if file_id not in api.files:
+            return _error_response(404, f'File {file_id} not found.')
+        return Response(api.files[file_id], mimetype='application/octet-stream')
+
+    @app.route('/openai/v1/batches', methods=['POST'])
+    def create_batch():
+        body = request.get_json()
+        if body.get('input_file_id') not in api.files:
+            return _error_response(400, 'Unknown input_file_id.')
+        return Response(json.dumps(api.create_batch(body)), mimetype='application/json')
+
+    @app.route('/openai/v1/batches/<batch_id>/cancel', methods=['POST'])
+    def cancel_batch(batch_id):
+        batch = api.cancel_batch(batch_id)
+        if batch is None:
+            return _error_response(404, f'Batch {batch_id} not found.')
+        return Response(json.dumps(batch), mimetype='application/json')
+
+    @app.route('/openai/v1/batches/<batch_id>', methods=['GET'])
+    def retrieve_batch(batch_id):
+        batch = api.retrieve_batch(batch_id)
+        if batch is None:
+            return _error_response(404, f'Batch {batch_id} not found.')
+        return Response(json.dumps(batch), mimetype='application/json')
+
+    return app
+
+def start_fake_groq_server(api, host='127.0.0.1', port=0):
+    """Serve a FakeGroqApi from a background thread, returns (server, base URL)."""
+    return serve_in_thread(create_fake_groq_app(api), host, port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Groq (and OpenAI) API answering the email pipeline prompts.')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--requests-per-minute', type=float, default=0,
+                        help='Request rate limit enforced with 429s (default 0 for none)')
+    parser.add_argument('--tokens-per-second', type=float, default=DEFAULT_TOKENS_PER_SECOND,
+                        help=f'Completion token generation speed (default {DEFAULT_TOKENS_PER_SECOND}, 0 for instant)')
+    parser.add_argument('--batch-turnaround-seconds', type=float, default=DEFAULT_BATCH_TURNAROUND_SECONDS,
+                        help=f'Seconds until a batch completes (default {DEFAULT_BATCH_TURNAROUND_SECONDS:.0f})')
+    parser.add_argument('--batch-error-rate', type=float, default=0.0,
+                        help='Share of batch requests ending up in the error file (default 0)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='Share of key insights answers returned as malformed JSON (default 0)')
+    add_fault_arguments(parser, latency_ms=300)
+    args = parser.parse_args()
+
+    api = FakeGroqApi(fault_profile_from_args(args), args.requests_per_minute or None, args.tokens_per_second,
+                      args.batch_turnaround_seconds, args.batch_error_rate, args.malformed_rate)
+    print(f"Serving a fake Groq API on http://127.0.0.1:{args.port} (OpenAI base URL http://127.0.0.1:{args.port}/openai/v1)")
+    create_fake_groq_app(api).run(host='127.0.0.1', port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import time
+import datetime
+from typing import List
+
+# Windows start at Gmail's launch, older (imported) mail falls in an open-ended "before:" shard.
+GMAIL_SHARDS_START_DATE = datetime.date(2004, 4, 1)
+DEFAULT_SHARD_DAYS = 365
+# A window whose first page isn't its last is split into windows down to this length.
+MIN_SHARD_SECONDS = 7 * 24 * 60 * 60
+# The newest window ends a little in the future so mail dated slightly ahead of our clock still falls inside.
+SHARDS_END_MARGIN_SECONDS = 24 * 60 * 60
+
+
+class QueryShard:
+    """One slice of a search: a group of OR-ed keyword phrases within an after:/before: window.
+
+    after / before are epoch seconds, None for an open end.
+    """
+
+    def __init__(self, keywords, after, before, keyword_group=0):
+        self.keywords = keywords
+        self.after = after
+        self.before = before
+        self.keyword_group = keyword_group
+
+    def query(self):
+        terms = [f'({or_query(self.keywords)})']
+        # Overlap neighbouring windows by a second, messages on a boundary are deduplicated after listing.
+        if self.after is not None:
+            terms.append(f'after:{self.after - 1}')
+        if self.before is not None:
+            terms.append(f'before:{self.before}')
+        return ' '.join(terms)
+
+    def can_split(self):
+        return self.after is not None and self.before is not None and self.before - self.after >= 2 * MIN_SHARD_SECONDS
+
+    def split(self, num_pieces=2):
+        """Split the window in num_pieces windows of equal length (no shorter than MIN_SHARD_SECONDS), newest first."""
+        num_pieces = max(2, min(num_pieces, (self.before - self.after) // MIN_SHARD_SECONDS))
+        bounds = [self.after + (self.before - self.after) * i // num_pieces for i in range(num_pieces + 1)]
+        return [
+            QueryShard(self.keywords, after, before, self.keyword_group)
+            for after, before in reversed(list(zip(bounds, bounds[1:])))
+        ]
+
+    def sort_key(self):
+        """Newest window first, like Gmail's own result order."""
+        return (-(self.after if self.after is not None else float('-inf')), self.keyword_group)
+
+    def describe(self):
+        window = ' to '.join(
+            datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime('%Y-%m-%d') if t is not None else '...'
+            for t in (self.after, self.before)
+        )
+        return f'{window}, keyword group {self.keyword_group}'
+
+    def __repr__(self):
+        return f'QueryShard(group {self.keyword_group}, after {self.after}, before {self.before})'
+
+
+def or_query(keywords):
+    """OR the keyword phrases, quoted, into one Gmail search query."""
+    return ' OR '.join(f'"{keyword}"' for keyword in keywords)
+
+def keyword_groups(keywords, num_groups):
+    """Split keywords into at most num_groups groups of similar size (round robin, keeps each group's order)."""
+    num_groups = max(1, min(num_groups, len(keywords)))
+    return [tuple(keywords[i::num_groups]) for i in range(num_groups)]
+
+def date_windows(shard_days, start_date=GMAIL_SHARDS_START_DATE, end_time=None, start_time=None):
+    """Cover all time with (after, before) epoch second windows of shard_days, newest first.
+
+    The oldest window is open-ended before start_date and the newest one open-ended after end_time
+    (default now plus a margin), so no message falls outside of every window. With start_time
+    (epoch seconds) only the time from then on is covered, without the open-ended oldest window.
+    """
+    if start_time is not None:
+        start = int(start_time)
+    else:
+        start = int(datetime.datetime.combine(start_date, datetime.time(), tzinfo=datetime.timezone.utc).timestamp())
+    end = int(end_time if end_time is not None else time.time() + SHARDS_END_MARGIN_SECONDS)
+    step = max(1, int(shard_days * 24 * 60 * 60))
+
+    windows = [(end, None)]
+    before = end
+    while before > start:
+        after = max(start, before - step)
+        windows.append((after, before))
+        before = after
+    if start_time is None:
+        windows.append((None, start))
+    return windows
+
+def build_query_shards(keywords, shard_days=DEFAULT_SHARD_DAYS, num_keyword_groups=1, start_date=GMAIL_SHARDS_START_DATE, start_time=None) -> List[QueryShard]:
+    """Shards covering the OR of keywords over all time (or since start_time): every keyword group within every date window."""
+    return [
+        QueryShard(group, after, before, keyword_group=group_idx)
+        for after, before in date_windows(shard_days, start_date, start_time=start_time)
+        for group_idx, group in enumerate(keyword_groups(keywords, num_keyword_groups))
+    ]
@@ -0,0 +1,110 @@
+import time
+import threading
+
+from rate_limiter import TokenBucket
+from pipeline_metrics import metrics
+
+# Quota units charged per call, see https://developers.google.com/gmail/api/reference/quota.
+# Each sub-request of a batch call is charged as its own call.
+GMAIL_QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.attachments.get': 5,
+    'history.list': 2,
+    'getProfile': 1,
+}
+# Per-user ceiling (a moving average, Gmail tolerates short bursts above it).
+GMAIL_USER_QUOTA_UNITS_PER_SECOND = 250
+GMAIL_QUOTA_BURST_SECONDS = 1.0
+GMAIL_QUOTA_MIN_UNITS_PER_SECOND = 25
+GMAIL_QUOTA_DECREASE_FACTOR = 0.5
+GMAIL_QUOTA_DECREASE_COOLDOWN_SECONDS = 1.0
+# Without throttling for this long, the rate grows back by a tenth of the ceiling.
+GMAIL_QUOTA_RECOVERY_SECONDS = 5.0
+
+
+class GmailQuotaScheduler:
+    """Paces a mailbox's Gmail calls by the quota units they cost.
+
+    Calls take their units from a token bucket refilled at the current unit rate, which starts
+    at the per-user ceiling. A rate limited response halves the rate (at most once per cooldown)
+    and every quiet recovery period adds a tenth of the ceiling back, so calls are released at
+    the highest rate Gmail sustains for this user rather than as fast as the threads start.
+    Callers announce work with plan() to get its projected completion time.
+    """
+
+    def __init__(self, name, units_per_second=GMAIL_USER_QUOTA_UNITS_PER_SECOND, burst_seconds=GMAIL_QUOTA_BURST_SECONDS):
+        self.name = name
+        self.max_units_per_second = units_per_second
+        self.units_per_second = units_per_second
+        self.bucket = TokenBucket(units_per_second * burst_seconds, units_per_second)
+        self.backlog_units = 0
+        self.units_used = 0
+        self.num_throttled = 0
+        self._last_change_at = time.monotonic()
+        self._last_throttled_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def units(method, count=1):
+        return GMAIL_QUOTA_UNITS[method] * count
+
+    def _set_rate(self, units_per_second, now):
+        self.units_per_second = max(GMAIL_QUOTA_MIN_UNITS_PER_SECOND, min(units_per_second, self.max_units_per_second))
+        self.bucket.set_rate(self.units_per_second)
+        self._last_change_at = now
+
+    def _maybe_recover(self, now):
+        # Called with the lock held.
+        quiet_since = max(self._last_change_at, self._last_throttled_at)
+        if self.units_per_second < self.max_units_per_second and now - quiet_since >= GMAIL_QUOTA_RECOVERY_SECONDS:
+            self._set_rate(self.units_per_second + self.max_units_per_second / 10, now)
+
+    def plan(self, method, count=1):
+        """Announce count upcoming calls, returns the projected completion time (epoch seconds) of all planned work."""
+        with self._lock:
+            self.backlog_units += self.units(method, count)
+        return self.projected_completion_time()
+
+    def projected_completion_seconds(self):
+        """Seconds until the planned calls not released yet can all be, at the current unit rate."""
+        with self._lock:
+            self._maybe_recover(time.monotonic())
+            deficit = max(0.0, -self.bucket.available())
+            return (self.backlog_units + deficit) / self.units_per_second
+
+    def projected_completion_time(self):
+        return time.time() + self.projected_completion_seconds()
+
+    def acquire(self, method, count=1):
+        """Block until the units of count calls of method can be spent, returns the seconds waited."""
+        units = self.units(method, count)
+        with self._lock:
+            self._maybe_recover(time.monotonic())
+            self.backlog_units = max(0, self.backlog_units - units)
+            self.units_used += units
+        # Reserve in bucket sized pieces (a 100 message batch costs more than the burst), the last delay covers them all.
+        delay = 0.0
+        remaining = units
+        while remaining > 0:
+            amount = min(remaining, self.bucket.capacity)
+            delay = self.bucket.reserve(amount)
+            remaining -= amount
+        if delay > 0:
+            time.sleep(delay)
+        metrics.increment('gmail_quota_units', units)
+        metrics.observe_latency('gmail_quota_wait', delay)
+        return delay
+
+    def on_throttled(self):
+        """Report a rate limited response (429 / rateLimitExceeded): back off the unit rate."""
+        with self._lock:
+            self.num_throttled += 1
+            now = time.monotonic()
+            self._last_throttled_at = now
+            if now - self._last_change_at >= GMAIL_QUOTA_DECREASE_COOLDOWN_SECONDS:
+                self._set_rate(self.units_per_second * GMAIL_QUOTA_DECREASE_FACTOR, now)
+
+    def print_report(self):
+        print(f"Gmail quota {self.name}: {self.units_used} units used, rate {self.units_per_second:.0f} / "
+              f"{self.max_units_per_second} units/s, {self.num_throttled} throttled responses")
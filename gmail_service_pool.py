@@ -0,0 +1,127 @@
+import os
+import pickle
+import threading
+
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build, build_from_document
+
+
+class GmailServicePool:
+    """Thread-safe source of authenticated Gmail API clients.
+
+    httplib2 (used under the hood by googleapiclient) is not thread-safe, so each worker thread
+    gets its own client. All clients share one credentials object, which is loaded from the token
+    file once and refreshed under a lock so concurrent threads never refresh or rewrite the token
+    file at the same time. The discovery document is fetched for the first client only and reused
+    to build the others.
+
+    Credentials can also be passed in directly (e.g. built from a stored refresh token), and with
+    interactive=False a missing or unrefreshable token raises instead of opening a browser, which
+    is what a scanner running many users' mailboxes unattended needs.
+    """
+
+    def __init__(self, token_file, client_id, client_secret, scopes, client_options=None, credentials=None, interactive=True):
+        self.token_file = token_file
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scopes = scopes
+        self.client_options = client_options
+        self.interactive = interactive
+        self._creds = credentials
+        self._creds_lock = threading.Lock()
+        self._discovery_doc = None
+        self._discovery_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_new_credentials(self):
+        if not self.interactive:
+            raise RuntimeError(f"No valid Gmail credentials in {self.token_file} and interactive login is disabled")
+        # Create flow instance with client ID and secret
+        flow = InstalledAppFlow.from_client_config(
+            {
+                "installed": {
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "redirect_uris": ["http://localhost", "urn:ietf:wg:oauth:2.0:oob"],
+                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                    "token_uri": "https://oauth2.googleapis.com/token"
+                }
+            },
+            self.scopes
+        )
+        # Open browser for user authentication
+        return flow.run_local_server(port=8080)
+
+    def _save_credentials(self, creds):
+        dirname = os.path.dirname(self.token_file)
+        if len(dirname.strip()) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        # Write to a temp file and rename so a crash never leaves a truncated token file behind.
+        tmp_file = f"{self.token_file}.tmp"
+        with open(tmp_file, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(tmp_file, self.token_file)
+
+    def get_credentials(self):
+        """Return the shared credentials, loading or refreshing them once under the lock."""
+        creds = self._creds
+        if creds is not None and creds.valid:
+            return creds
+
+        with self._creds_lock:
+            # Another thread may have refreshed while we were waiting for the lock.
+            if self._creds is not None and self._creds.valid:
+                return self._creds
+
+            creds = self._creds
+            if creds is None and os.path.exists(self.token_file):
+                with open(self.token_file, 'rb') as token:
+                    creds = pickle.load(token)
+
+            # If credentials don't exist or are invalid, get new ones
+            if not creds or not creds.valid:
+                # Credentials built from a stored refresh token have no access token (nor expiry) yet.
+                if creds and creds.refresh_token and (creds.expired or not creds.token):
+                    try:
+                        creds.refresh(Request())
+                    except Exception as e:
+                        if not self.interactive:
+                            raise
+                        print(f"Error refreshing credentials (asking user to re-authenticate): {e}")
+                        creds = self._get_new_credentials()
+                else:
+                    creds = self._get_new_credentials()
+
+                # Save credentials for next run
+                self._save_credentials(creds)
+
+            self._creds = creds
+            return creds
+
+    def _api_endpoint(self):
+        if isinstance(self.client_options, dict):
+            return self.client_options.get('api_endpoint')
+        return getattr(self.client_options, 'api_endpoint', None)
+
+    def _build_service(self, creds):
+        with self._discovery_lock:
+            if self._discovery_doc is None:
+                service = build('gmail', 'v1', credentials=creds, client_options=self.client_options)
+                self._discovery_doc = service._rootDesc
+                api_endpoint = self._api_endpoint()
+                if not api_endpoint:
+                    return service
+                # Batch calls go to the discovery document's rootUrl, which client_options don't override.
+                self._discovery_doc = {**service._rootDesc, 'rootUrl': api_endpoint}
+        return build_from_document(self._discovery_doc, credentials=creds, client_options=self.client_options)
+
+    def get_service(self):
+        """Return the Gmail client owned by the calling thread, building it on first use."""
+        creds = self.get_credentials()
+        service = getattr(self._local, 'service', None)
+        if service is None or getattr(self._local, 'creds', None) is not creds:
+            service = self._build_service(creds)
+            self._local.service = service
+            self._local.creds = creds
+        return service
@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+import threading
+
+from groq import AsyncGroq, APIStatusError, APIConnectionError, APITimeoutError, RateLimitError
+
+from llm_cache import get_llm_cache
+from rate_limiter import TokenBucket
+from pipeline_metrics import metrics
+
+# Sampling parameters used for every Groq chat completion (also part of the LLM cache key).
+GROQ_SAMPLING_PARAMS = {
+    "temperature": 0.6,
+    "max_completion_tokens": 128,
+    "top_p": 1.0,
+    "stop": None,
+}
+
+# Per-model requests / tokens per minute. These are the developer tier limits at the time of
+# writing, check https://console.groq.com/settings/limits for the limits of your organization.
+GROQ_MODEL_RATE_LIMITS = {
+    "meta-llama/llama-4-scout-17b-16e-instruct": {"rpm": 1000, "tpm": 300000},
+    "meta-llama/llama-4-maverick-17b-128e-instruct": {"rpm": 1000, "tpm": 300000},
+}
+GROQ_DEFAULT_RATE_LIMITS = {"rpm": 500, "tpm": 150000}
+
+GROQ_MAX_CONCURRENCY = 32
+GROQ_MAX_RETRIES = 6
+GROQ_BACKOFF_BASE_SECONDS = 1.0
+GROQ_BACKOFF_MAX_SECONDS = 60.0
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token for English text), good enough for rate limiting."""
+    return max(1, len(text) // 4)
+
+_model_rate_buckets = {}
+_model_rate_buckets_lock = threading.Lock()
+
+def get_model_rate_buckets(model):
+    """(requests per minute, tokens per minute) TokenBuckets of a model, one pair per process.
+
+    Every Groq call for the model (async engines, the sync run_groq_inference, ...) reserves from
+    the same buckets, so concurrent stages and engines together stay under the model's limits.
+    """
+    with _model_rate_buckets_lock:
+        if model not in _model_rate_buckets:
+            limits = GROQ_MODEL_RATE_LIMITS.get(model, GROQ_DEFAULT_RATE_LIMITS)
+            _model_rate_buckets[model] = (TokenBucket.per_minute(limits["rpm"]), TokenBucket.per_minute(limits["tpm"]))
+        return _model_rate_buckets[model]
+
+def reserve_groq_quota(model, prompt, sampling_params=None, buckets=None):
+    """Reserve one request and the prompt's expected tokens, returns the seconds to wait before sending it."""
+    request_bucket, token_bucket = buckets or get_model_rate_buckets(model)
+    expected_tokens = estimate_tokens(prompt) + (sampling_params or GROQ_SAMPLING_PARAMS).get("max_completion_tokens", 0)
+    return max(request_bucket.reserve(1), token_bucket.reserve(expected_tokens))
+
+def is_retryable_groq_error(error):
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def _retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class GroqAsyncInferenceEngine:
+    """Asyncio Groq chat completion runner that stays under the per-model rate limits.
+
+    A semaphore bounds the number of in-flight requests (an optional AIMD controller adapts the
+    limit below that bound), the model's shared token buckets (requests per minute and tokens per
+    minute, see get_model_rate_buckets) pace the calls, and 429 / 5xx / connection errors are
+    retried with jittered exponential backoff (honoring Retry-After when Groq sends it). Prompts
+    that still fail are reported as errors, separately from the model's answers.
+    """
+
+    def __init__(self, model, max_concurrency=GROQ_MAX_CONCURRENCY, rpm=None, tpm=None, max_retries=GROQ_MAX_RETRIES, sampling_params=None, concurrency_controller=None):
+        self.model = model
+        # Optional AIMDConcurrencyController adapting the number of in-flight requests below max_concurrency.
+        self.concurrency_controller = concurrency_controller
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.sampling_params = sampling_params or GROQ_SAMPLING_PARAMS
+        if rpm or tpm:
+            # Explicit limits get buckets of their own, e.g. for a separate API key.
+            limits = GROQ_MODEL_RATE_LIMITS.get(model, GROQ_DEFAULT_RATE_LIMITS)
+            self.request_bucket = TokenBucket.per_minute(rpm or limits["rpm"])
+            self.token_bucket = TokenBucket.per_minute(tpm or limits["tpm"])
+        else:
+            self.request_bucket, self.token_bucket = get_model_rate_buckets(model)
+        self.num_retries = 0
+        self.num_rate_limited = 0
+
+    async def _wait_for_quota(self, prompt):
+        delay = reserve_groq_quota(self.model, prompt, self.sampling_params, buckets=(self.request_bucket, self.token_bucket))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _complete(self, client, prompt):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_quota(prompt)
+            if self.concurrency_controller:
+                await self.concurrency_controller.acquire_async()
+            start = time.monotonic()
+            try:
+                completion = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=False,
+                    **self.sampling_params,
+                )
+            except Exception as error:
+                metrics.observe_latency('groq', time.monotonic() - start)
+                if self.concurrency_controller:
+                    self.concurrency_controller.release(time.monotonic() - start, throttled=isinstance(error, RateLimitError), failed=True)
+                if isinstance(error, RateLimitError):
+                    metrics.increment('groq_rate_limited')
+                if not is_retryable_groq_error(error) or attempt == self.max_retries:
+                    metrics.increment('groq_failures')
+                    raise
+                if isinstance(error, RateLimitError):
+                    self.num_rate_limited += 1
+                self.num_retries += 1
+                metrics.increment('groq_retries')
+                delay = min(GROQ_BACKOFF_MAX_SECONDS, GROQ_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                delay = _retry_after_seconds(error) or random.uniform(delay / 2, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            metrics.observe_latency('groq', time.monotonic() - start)
+            if self.concurrency_controller:
+                self.concurrency_controller.release(time.monotonic() - start)
+            if completion.usage:
+                metrics.record_tokens(self.model, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+            return completion.choices[0].message.content
+
+    async def run(self, prompts_dict, on_result=None):
+        """Run all prompts, returns (results, errors): prompt ID -> response / error message.
+
+        on_result, if given, is called with (prompt ID, response) as soon as each prompt succeeds.
+        """
+        results = {}
+        errors = {}
+        total_prompts = len(prompts_dict)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        cache = get_llm_cache()
+
+        async def process_single_prompt(client, prompt_id, prompt_text):
+            response = cache.get(self.model, prompt_text, self.sampling_params)
+            if response is None:
+                async with semaphore:
+                    try:
+                        response = await self._complete(client, prompt_text)
+                    except Exception as e:
+                        errors[prompt_id] = str(e)
+                        print(f"Error processing prompt ID {prompt_id}: {e}")
+                        return
+                if response:
+                    cache.set(self.model, prompt_text, self.sampling_params, response)
+            results[prompt_id] = response
+            if on_result:
+                on_result(prompt_id, response)
+            completed_count = len(results) + len(errors)
+            if completed_count % 10 == 0 or completed_count == total_prompts:
+                print(f"Completed {completed_count} / {total_prompts} prompts ({len(errors)} errors).")
+
+        # Retries are handled here (with rate limit awareness), not by the SDK.
+        async with AsyncGroq(max_retries=0) as client:
+            await asyncio.gather(*(
+                process_single_prompt(client, prompt_id, prompt_text)
+                for prompt_id, prompt_text in prompts_dict.items()
+            ))
+
+        if self.num_retries:
+            print(f"Groq {self.model}: {self.num_retries} retries ({self.num_rate_limited} rate limited).")
+        return results, errors
+
+def run_groq_inference_async_batch(prompts_dict, model="meta-llama/llama-4-scout-17b-16e-instruct", max_concurrency=GROQ_MAX_CONCURRENCY, concurrency_controller=None, on_result=None, sampling_params=None):
+    """Synchronous entry point: run prompts through GroqAsyncInferenceEngine.
+
+    Returns:
+        Tuple (results, errors) of dicts keyed by prompt ID. A prompt is in exactly one of them.
+    """
+    if not prompts_dict:
+        return {}, {}
+    engine = GroqAsyncInferenceEngine(model, max_concurrency=max_concurrency, sampling_params=sampling_params, concurrency_controller=concurrency_controller)
+    return asyncio.run(engine.run(prompts_dict, on_result=on_result))
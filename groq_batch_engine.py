@@ -0,0 +1,335 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+from groq import Groq
+
+from llm_cache import get_llm_cache
+from groq_async_inference import GROQ_SAMPLING_PARAMS
+from pipeline_metrics import metrics
+
+# Groq batch input file limits (https://console.groq.com/docs/batch), with some headroom.
+GROQ_BATCH_MAX_REQUESTS_PER_FILE = 50000
+GROQ_BATCH_MAX_FILE_BYTES = 100 * 1024 * 1024
+
+GROQ_BATCH_COMPLETION_WINDOW = "24h"
+GROQ_BATCH_POLL_INITIAL_SECONDS = 5.0
+GROQ_BATCH_POLL_MAX_SECONDS = 300.0
+GROQ_BATCH_POLL_BACKOFF_FACTOR = 1.5
+GROQ_BATCH_MAX_REQUEUES = 2
+
+GROQ_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+GROQ_BATCH_STATE_FILE = os.getenv('GROQ_BATCH_STATE_FILE', './email_data/v0/groq_batches.json')
+
+_state_lock = threading.Lock()
+# Tells the batch jobs of this process from the ones an earlier (interrupted) run left in the state file.
+_PROCESS_ID = uuid.uuid4().hex
+
+def _load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def _save_state(state_file, state):
+    dirname = os.path.dirname(state_file)
+    if len(dirname.strip()) > 0:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+def batch_job_name(job_group, prompts_dict):
+    """Job name of one set of prompts of a job group (e.g. a stage), so concurrent calls keep separate batch state."""
+    digest = hashlib.sha256()
+    for prompt_id in sorted(prompts_dict):
+        digest.update(prompt_id.encode('utf-8') + b'\n')
+    return f"{job_group}-{digest.hexdigest()[:12]}"
+def chunk_batch_requests(request_lines, max_requests=GROQ_BATCH_MAX_REQUESTS_PER_FILE, max_bytes=GROQ_BATCH_MAX_FILE_BYTES):
+    """Split encoded JSONL request lines into chunks that fit the batch input file limits."""
+    chunks = []
+    current = []
+    current_bytes = 0
+    for line in request_lines:
+        if current and (len(current) >= max_requests or current_bytes + len(line) > max_bytes):
+            chunks.append(current)
+            current = []
+            current_bytes = 0
+        current.append(line)
+        current_bytes += len(line)
+    if current:
+        chunks.append(current)
+    return chunks
+
+def parse_batch_output_line(line):
+    """Parse one line of a batch output / error file.
+
+    Returns:
+        Tuple (custom_id, content or None, error message or None, usage dict or None).
+    """
+    entry = json.loads(line)
+    custom_id = entry.get("custom_id")
+    if entry.get("error"):
+        return custom_id, None, str(entry["error"]), None
+    response = entry.get("response") or {}
+    body = response.get("body") or {}
+    choices = body.get("choices")
+    if response.get("status_code", 200) >= 400 or not choices:
+        return custom_id, None, str(body.get("error") or f"status {response.get('status_code')} without choices"), body.get("usage")
+    return custom_id, choices[0].get("message", {}).get("content"), None, body.get("usage")
+
+
+class GroqBatchEngine:
+    """Groq Batch API runner that survives restarts.
+
+    Requests are split into input files within the provider limits and uploaded from memory.
+    Batch IDs are persisted in a state file under a job name (with a fingerprint of the model,
+    parameters and prompt IDs) right after creation, so a restarted process reattaches to the
+    running batches instead of paying for them twice. When the prompts changed since (e.g. some
+    were answered in the meantime), the earlier batches are still collected into the LLM cache if
+    they used the same model and parameters, and cancelled otherwise. Jobs of one job_group (e.g.
+    one per prompt set of a stage, see batch_job_name) that an earlier process left behind are
+    treated the same way, by the first job of the group to start; jobs of this process are left to
+    their own engine. Batches are polled with exponential
+    backoff, output and error files are streamed and parsed line by line, and custom_ids that
+    failed (error file, no choices, failed / expired batch) are re-queued in a new batch.
+    """
+
+    def __init__(self, model, job_name, state_file=GROQ_BATCH_STATE_FILE, sampling_params=None, system_message=None,
+                 completion_window=GROQ_BATCH_COMPLETION_WINDOW, max_requeues=GROQ_BATCH_MAX_REQUEUES,
+                 max_requests_per_file=GROQ_BATCH_MAX_REQUESTS_PER_FILE, max_file_bytes=GROQ_BATCH_MAX_FILE_BYTES,
+                 job_group=None):
+        self.model = model
+        self.job_name = job_name
+        self.job_group = job_group or job_name
+        self.state_file = state_file
+        self.sampling_params = sampling_params or GROQ_SAMPLING_PARAMS
+        self.system_message = system_message
+        self.completion_window = completion_window
+        self.max_requeues = max_requeues
+        self.max_requests_per_file = max_requests_per_file
+        self.max_file_bytes = max_file_bytes
+        self.client = Groq()
+        # Seconds from creation to a terminal status of each batch this engine waited for.
+        self.turnaround_seconds = []
+
+    def _params_fingerprint(self):
+        return hashlib.sha256(json.dumps([self.model, self.sampling_params, self.system_message], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _fingerprint(self, prompts_dict):
+        digest = hashlib.sha256(self._params_fingerprint().encode('utf-8'))
+        for prompt_id in sorted(prompts_dict):
+            digest.update(prompt_id.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _update_job_state(self, update):
+        with _state_lock:
+            state = _load_state(self.state_file)
+            job_state = state.get(self.job_name, {})
+            update(job_state)
+            state[self.job_name] = job_state
+            _save_state(self.state_file, state)
+
+    def _clear_job_state(self):
+        with _state_lock:
+            state = _load_state(self.state_file)
+            if state.pop(self.job_name, None) is not None:
+                _save_state(self.state_file, state)
+
+    def _claim_stale_jobs(self):
+        """Remove and return {job name: state} of the other jobs of this group left by an earlier process."""
+        with _state_lock:
+            state = _load_state(self.state_file)
+            stale = {
+                name: job_state for name, job_state in state.items()
+                if name != self.job_name
+                and job_state.get('job_group', name) == self.job_group
+                and job_state.get('owner') != _PROCESS_ID
+            }
+            if stale:
+                for name in stale:
+                    del state[name]
+                _save_state(self.state_file, state)
+        return stale
+
+    def _salvage_previous_batches(self, job_state, pending_prompts, results):
+        """Deal with the batches of an earlier run of this job for other prompts, before its state is cleared.
+
+        Batches sent with the same model and parameters are waited for and their answers to
+        prompts still pending go to the results and the LLM cache, instead of being paid for again.
+        Other batches are cancelled if they are still running.
+        """
+        batch_ids = job_state.get('batch_ids') or []
+        if not batch_ids:
+            return
+        if job_state.get('params_fingerprint') != self._params_fingerprint():
+            for batch_id in batch_ids:
+                try:
+                    if self.client.batches.retrieve(batch_id).status not in GROQ_BATCH_TERMINAL_STATUSES:
+                        self.client.batches.cancel(batch_id)
+                        print(f"Cancelled batch job {batch_id} of an earlier run of {self.job_name} with other parameters.")
+                except Exception as e:
+                    print(f"Could not cancel batch job {batch_id} of {self.job_name}: {e}")
+            return
+
+        print(f"Collecting {len(batch_ids)} batch jobs of an earlier run of {self.job_name} for other prompts.")
+        previous_results = {}
+        self._collect(self._wait(batch_ids), previous_results, {})
+        cache = get_llm_cache()
+        for prompt_id, response in previous_results.items():
+            if prompt_id in pending_prompts and response:
+                results[prompt_id] = response
+                cache.set(self.model, pending_prompts[prompt_id], self.sampling_params, response)
+
+    def _request_line(self, prompt_id, prompt):
+        messages = []
+        if self.system_message:
+            messages.append({"role": "system", "content": self.system_message})
+        messages.append({"role": "user", "content": prompt})
+        request = {
+            "custom_id": prompt_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": self.model, "messages": messages, **self.sampling_params},
+        }
+        return (json.dumps(request) + "\n").encode('utf-8')
+
+    def _submit(self, prompts_dict, round_num):
+        """Upload the prompts as one or more input files and create their batches, returns the batch IDs."""
+        request_lines = [self._request_line(prompt_id, prompt) for prompt_id, prompt in prompts_dict.items()]
+        chunks = chunk_batch_requests(request_lines, self.max_requests_per_file, self.max_file_bytes)
+        batch_ids = []
+        for i, chunk in enumerate(chunks):
+            file_response = self.client.files.create(
+                file=(f"{self.job_name}_{round_num}_{i}.jsonl", b"".join(chunk)),
+                purpose="batch",
+            )
+            batch = self.client.batches.create(
+                completion_window=self.completion_window,
+                endpoint="/v1/chat/completions",
+                input_file_id=file_response.id,
+                metadata={"job_name": self.job_name, "round": str(round_num)},
+            )
+            batch_ids.append(batch.id)
+            # Persist each batch as soon as it exists, a crash between two chunks must not orphan it.
+            self._update_job_state(lambda job_state: job_state.setdefault('batch_ids', []).append(batch.id))
+            print(f"Batch job {batch.id} created with {len(chunk)} requests ({self.job_name}, round {round_num}).")
+        return batch_ids
+
+    def _wait(self, batch_ids):
+        """Poll the batches with exponential backoff until all of them reach a terminal status."""
+        pending = set(batch_ids)
+        finished = {}
+        delay = GROQ_BATCH_POLL_INITIAL_SECONDS
+        while pending:
+            for batch_id in sorted(pending):
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in GROQ_BATCH_TERMINAL_STATUSES:
+                    print(f"Batch job {batch_id} {batch.status}.")
+                    if batch.created_at:
+                        self.turnaround_seconds.append(time.time() - batch.created_at)
+                        metrics.observe_latency('groq_batch_turnaround', self.turnaround_seconds[-1])
+                    finished[batch_id] = batch
+                    pending.discard(batch_id)
+            if pending:
+                print(f"Waiting for {len(pending)} batch jobs, next check in {delay:.0f}s...")
+                time.sleep(delay)
+                delay = min(GROQ_BATCH_POLL_MAX_SECONDS, delay * GROQ_BATCH_POLL_BACKOFF_FACTOR)
+        return [finished[batch_id] for batch_id in batch_ids]
+
+    def _stream_file_lines(self, file_id):
+        with self.client.with_streaming_response.files.content(file_id) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield line
+
+    def _collect(self, batches, results, errors):
+        for batch in batches:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                for line in self._stream_file_lines(file_id):
+                    custom_id, content, error, usage = parse_batch_output_line(line)
+                    if usage:
+                        metrics.record_tokens(f"{self.model} (batch)", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+                    if content is not None:
+                        results[custom_id] = content
+                        errors.pop(custom_id, None)
+                    elif custom_id not in results:
+                        errors[custom_id] = error
+            if batch.status != "completed":
+                print(f"Batch job {batch.id} ended as {batch.status}: {batch.errors}")
+
+    def run(self, prompts_dict):
+        """Run all prompts through the Batch API.
+
+        Returns:
+            Tuple (results, errors) of dicts keyed by prompt ID. A prompt is in exactly one of them.
+        """
+        cache = get_llm_cache()
+        results = {}
+        for prompt_id, prompt in prompts_dict.items():
+            cached = cache.get(self.model, prompt, self.sampling_params)
+            if cached is not None:
+                results[prompt_id] = cached
+        pending_prompts = {prompt_id: prompt for prompt_id, prompt in prompts_dict.items() if prompt_id not in results}
+        if not pending_prompts:
+            return results, {}
+
+        errors = {}
+        fingerprint = self._fingerprint(pending_prompts)
+        job_state = _load_state(self.state_file).get(self.job_name, {})
+        if job_state.get('fingerprint') == fingerprint and job_state.get('batch_ids'):
+            batch_ids = job_state['batch_ids']
+            print(f"Reattaching to {len(batch_ids)} batch jobs of {self.job_name}.")
+            self._update_job_state(lambda job_state: job_state.update({'owner': _PROCESS_ID, 'job_group': self.job_group}))
+        else:
+            self._salvage_previous_batches(job_state, pending_prompts, results)
+            for stale_job_state in self._claim_stale_jobs().values():
+                self._salvage_previous_batches(stale_job_state, pending_prompts, results)
+            pending_prompts = {prompt_id: prompt for prompt_id, prompt in pending_prompts.items() if prompt_id not in results}
+            self._clear_job_state()
+            if not pending_prompts:
+                return results, {}
+            self._update_job_state(lambda job_state: job_state.update({
+                'fingerprint': self._fingerprint(pending_prompts),
+                'params_fingerprint': self._params_fingerprint(),
+                'job_group': self.job_group,
+                'owner': _PROCESS_ID,
+                'model': self.model,
+                'created_at': int(time.time()),
+            }))
+            batch_ids = self._submit(pending_prompts, round_num=0)
+
+        for round_num in range(1, self.max_requeues + 2):
+            self._collect(self._wait(batch_ids), results, errors)
+            # custom_ids missing from both files (failed / expired batch) failed too.
+            for prompt_id in pending_prompts:
+                if prompt_id not in results and prompt_id not in errors:
+                    errors[prompt_id] = "no result in the batch output"
+            if not errors or round_num > self.max_requeues:
+                break
+            print(f"Re-queuing {len(errors)} failed requests of {self.job_name} (round {round_num}).")
+            batch_ids = self._submit({prompt_id: pending_prompts[prompt_id] for prompt_id in errors}, round_num=round_num)
+
+        for prompt_id in pending_prompts:
+            if results.get(prompt_id):
+                cache.set(self.model, pending_prompts[prompt_id], self.sampling_params, results[prompt_id])
+        self._clear_job_state()
+        return results, errors
+
+def run_groq_batch(prompts_dict, model="meta-llama/llama-4-scout-17b-16e-instruct", job_name="default", sampling_params=None, system_message=None):
+    """Synchronous entry point: run prompts through GroqBatchEngine.
+
+    Returns:
+        Tuple (results, errors) of dicts keyed by prompt ID. A prompt is in exactly one of them.
+    """
+    if not prompts_dict:
+        return {}, {}
+    engine = GroqBatchEngine(model, job_name, sampling_params=sampling_params, system_message=system_message)
+    return engine.run(prompts_dict)
@@ -0,0 +1,232 @@
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+COLLECTION_STATS_TTL_SECONDS = float(os.getenv('COLLECTION_STATS_TTL_SECONDS', '600'))
+COLLECTION_STATS_REFRESH_SECONDS = 60
+# Ingest scripts bump a marker document here (one per collection) after writing, see mark_collection_ingested.
+INGEST_MARKERS_COLLECTION = "ingest_markers"
+# The only fields the diagnostics count on, see collection_stats_pipeline.
+COLLECTION_STATS_FIELDS = ['address_obj.city', 'address_obj.state', 'address_obj.country', 'price_level']
+
+_UNREAD = object()
+
+
+def mark_collection_ingested(db, collection_name):
+    """Record that new documents were written to a collection, so cached statistics about it are recomputed."""
+    db[INGEST_MARKERS_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {"ingested_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}},
+        upsert=True,
+    )
+
+def collection_stats_pipeline(location_filters, price_level):
+    """Aggregation computing all the hotel collection diagnostics in one $facet stage.
+
+    The documents are projected down to COLLECTION_STATS_FIELDS first, so the facets don't carry
+    the full review documents around.
+
+    Args:
+        location_filters: List of (name, filter) pairs, e.g. [('city', {...}), ('state', {...})],
+            counted cumulatively (city, city_state, ...)
+        price_level: Price level counted on its own and within the first location filter
+    """
+    facets = {
+        'total': [{'$count': 'count'}],
+        'with_city': [{'$match': {'address_obj.city': {'$exists': True}}}, {'$count': 'count'}],
+        'price_levels': [{'$group': {'_id': '$price_level', 'count': {'$sum': 1}}}],
+    }
+    names = []
+    conditions = []
+    for name, condition in location_filters:
+        names.append(name)
+        conditions.append(condition)
+        facets['_'.join(names)] = [{'$match': {'$and': list(conditions)}}, {'$count': 'count'}]
+    if location_filters and price_level:
+        name, condition = location_filters[0]
+        facets[f'{name}_price_level'] = [{'$match': {'$and': [condition, {'price_level': price_level}]}}, {'$count': 'count'}]
+    return [
+        {'$project': {'_id': 0, **{field: 1 for field in COLLECTION_STATS_FIELDS}}},
+        {'$facet': facets},
+    ]
+
+def _parse_stats(result, price_level):
+    price_levels = {str(row['_id']): row['count'] for row in result.pop('price_levels')}
+    counts = {name: rows[0]['count'] if rows else 0 for name, rows in result.items()}
+    return {
+        'total_hotels': counts.pop('total'),
+        'hotels_with_city': counts.pop('with_city'),
+        'price_levels': price_levels,
+        'price_level': price_level,
+        'price_level_hotels': price_levels.get(str(price_level), 0),
+        'location_hotels': counts,
+        'computed_at': time.time(),
+    }
+
+
+class CollectionStatsCache:
+    """Diagnostic counts about the hotels collection, cached with a TTL.
+
+    The counts a search prints to explain its results (total hotels, price levels, hotels at the
+    trip's destination...) come from a single $facet aggregation instead of one round trip per
+    count, and are computed at most once per TTL for a given destination and price level.
+
+    The cache is dropped when an ingest marker shows the collection was written to. get() checks
+    the marker at most once per refresh interval, when it returns an entry older than that, and
+    an entry computed before an ingest or an invalidate() is never stored. A background thread can
+    refresh the entries read within the last TTL before they expire and evicts the others.
+    """
+
+    def __init__(self, collection, ttl_seconds=COLLECTION_STATS_TTL_SECONDS, refresh_seconds=COLLECTION_STATS_REFRESH_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries = {}
+        self._ingest_version = _UNREAD
+        self._ingest_checked_at = 0.0
+        # Bumped by every invalidate(), tells computations started before one to drop their result
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(location_filters, price_level):
+        return repr((location_filters, price_level))
+
+    def _compute(self, location_filters, price_level):
+        result = next(self.collection.aggregate(collection_stats_pipeline(location_filters, price_level)))
+        return _parse_stats(result, price_level)
+
+    def _lookup(self, key, now):
+        """Return (stats, check_ingest) for a fresh entry and count the hit, (None, False) otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry['stats']['computed_at'] >= self.ttl_seconds:
+                return None, False
+            check_ingest = (now - entry['stats']['computed_at'] >= self.refresh_seconds
+                            and now - self._ingest_checked_at >= self.refresh_seconds)
+            if not check_ingest:
+                entry['last_hit_at'] = now
+                self.hits += 1
+            return entry['stats'], check_ingest
+
+    def _store(self, key, location_filters, price_level, stats, ingest_version, generation, last_hit_at):
+        """Cache stats unless the collection was ingested into or the cache invalidated since they were computed."""
+        with self._lock:
+            if ingest_version != self._ingest_version or generation != self._generation:
+                return False
+            self._entries[key] = {
+                'location_filters': location_filters,
+                'price_level': price_level,
+                'stats': stats,
+                'ingest_version': ingest_version,
+                'last_hit_at': last_hit_at,
+            }
+            return True
+
+    def get(self, location_filters, price_level):
+        """Return the stats for a destination (see collection_stats_pipeline), from the cache when fresh."""
+        key = self._key(location_filters, price_level)
+        now = time.time()
+        stats, check_ingest = self._lookup(key, now)
+        if check_ingest:
+            self.check_ingest_version()
+            stats, _ = self._lookup(key, now)
+        if stats is not None:
+            return stats
+
+        with self._lock:
+            self.misses += 1
+            generation = self._generation
+        if self._ingest_version is _UNREAD:
+            self.check_ingest_version()
+        ingest_version = self._ingest_version
+        stats = self._compute(location_filters, price_level)
+        self._store(key, location_filters, price_level, stats, ingest_version, generation, now)
+        return stats
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def _read_ingest_version(self):
+        marker = self.collection.database[INGEST_MARKERS_COLLECTION].find_one({"_id": self.collection.name})
+        return marker.get('version') if marker else None
+
+    def check_ingest_version(self):
+        """Read the ingest marker and drop the cache if the collection was ingested into since the last check."""
+        ingest_version = self._read_ingest_version()
+        with self._lock:
+            self._ingest_checked_at = time.time()
+            changed = self._ingest_version is not _UNREAD and ingest_version != self._ingest_version
+            self._ingest_version = ingest_version
+        if changed:
+            print(f"New documents ingested into {self.collection.name}, dropping cached collection stats")
+            self.invalidate()
+        return changed
+
+    def refresh(self):
+        """Drop the entries if the collection was ingested into, otherwise evict the ones not read
+        within the TTL and recompute the remaining ones past half their TTL."""
+        if self.check_ingest_version():
+            return
+
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if now - entry['last_hit_at'] >= self.ttl_seconds]:
+                del self._entries[key]
+                self.evictions += 1
+            entries = list(self._entries.items())
+            generation = self._generation
+        for key, entry in entries:
+            if now - entry['stats']['computed_at'] < self.ttl_seconds / 2:
+                continue
+            stats = self._compute(entry['location_filters'], entry['price_level'])
+            with self._lock:
+                current = self._entries.get(key)
+                last_hit_at = current['last_hit_at'] if current else None
+            if last_hit_at is not None:
+                self._store(key, entry['location_filters'], entry['price_level'], stats,
+                            entry['ingest_version'], generation, last_hit_at)
+
+    def start_background_refresh(self, interval_seconds=None):
+        """Refresh the cache from a daemon thread every interval_seconds (refresh_seconds by default),
+        until stop_background_refresh()."""
+        interval_seconds = interval_seconds or self.refresh_seconds
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Collection stats refresh failed: {e}")
+
+        if self._ingest_version is _UNREAD:
+            self.check_ingest_version()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,509 @@
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime
+
+from bson import json_util
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from hotel_collection_stats import CollectionStatsCache
+from llm_cache import invoke_chain_cached
+
+try:
+    from langchain_openai import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate
+except ImportError:
+    ChatOpenAI = None
+    ChatPromptTemplate = None
+
+load_dotenv()
+
+HOTEL_SEARCH_LLM_MODEL = "gpt-4o-mini"
+MONGODB_DATABASE = "viammo-alpha"
+TRIPS_COLLECTION = "trips"
+HOTELS_COLLECTION = "tripadvisor-hotel_review"
+TEXT_SEARCH_INDEX_NAME = "text_search_index"
+DEFAULT_SEARCH_LIMIT = 10
+# A long-running process keeps a few connections open so a search never waits for a TLS handshake.
+MONGODB_MAX_POOL_SIZE = 20
+MONGODB_MIN_POOL_SIZE = 2
+
+# Only the fields the results are built from, the full review documents are much larger.
+HOTEL_RESULT_PROJECTION = {
+    "location_id": 1,
+    "name": 1,
+    "rating": 1,
+    "price_level": 1,
+    "styles": 1,
+    "trip_types": 1,
+    "amenities": 1,
+    "description": 1,
+    "latitude": 1,
+    "longitude": 1,
+    "address_obj": 1,
+    "photos": {"$slice": 1},
+}
+
+# US state abbreviation to full name mapping
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas",
+    "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho",
+    "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+    "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi",
+    "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma",
+    "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina",
+    "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah",
+    "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia",
+    "WI": "Wisconsin", "WY": "Wyoming", "DC": "District of Columbia"
+}
+
+# Create a reverse mapping (full name to abbreviation)
+US_STATE_ABBREVS = {v: k for k, v in US_STATES.items()}
+
+US_COUNTRY_NAMES = ["United States", "USA", "U.S.A.", "U.S."]
+UK_COUNTRY_NAMES = ["United Kingdom", "UK", "U.K.", "Great Britain"]
+
+# Filter out common stop words and short words
+STOP_WORDS = set(['the', 'and', 'or', 'a', 'an', 'in', 'on', 'at', 'to', 'for', 'with',
+                'by', 'about', 'as', 'of', 'from', 'that', 'this', 'it', 'is', 'are',
+                'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does',
+                'did', 'will', 'would', 'should', 'could', 'can', 'may', 'might', 'must',
+                'i', 'you', 'he', 'she', 'we', 'they', 'me', 'him', 'her', 'us', 'them'])
+
+KEYWORDS_TEMPLATE = """
+                    Based on the following trip information, generate keywords for ideal hotel characteristics that would best match this trip:
+
+                    {trip_data}
+
+                    Please provide a list of keywords from the following categories to use in a bm25 hotel search:
+                    1. Ideal detailed hotel description
+                    2. 10-15 amenity keywords that would be important for this trip
+                    3. 3-5 trip type keywords that match this traveler (e.g., "family", "business", "couples", "solo travel")
+                    4. 2-3 hotel style keywords that would be appropriate (e.g., "Luxury", "Modern", "Boutique", "Budget")
+
+                    Format your response as a simple list of lowercase keywords separated by spaces.
+
+                    Return only the list of keywords, no bullets, no numbers, no other text.
+                    """
+
+RERANK_TEMPLATE = """
+                        Based on the following trip information and list of hotels, select the single best hotel that matches the trip requirements.
+                        Consider the trip purpose, budget, and any specific requirements mentioned.
+
+                        Trip Information:
+                        {trip_data}
+
+                        Hotels:
+                        {hotels_data}
+
+                        Return only the hotel name that best matches the trip requirements.
+                        Do not include any explanation or additional text.
+
+                        Best Hotel: """
+
+
+def mongodb_uri():
+    """Atlas SRV URI built from MONGODB_USERNAME, MONGODB_PASSWORD and MONGODB_CLUSTER."""
+    username = os.getenv("MONGODB_USERNAME")
+    password = os.getenv("MONGODB_PASSWORD")
+    cluster = os.getenv("MONGODB_CLUSTER")
+    return f"mongodb+srv://{username}:{password}@{cluster}/?retryWrites=true&w=majority&appName=Viammo-Cluster-alpha"
+
+def create_mongo_client(max_pool_size=MONGODB_MAX_POOL_SIZE, min_pool_size=MONGODB_MIN_POOL_SIZE, uri=None):
+    """Create the MongoClient to share across searches. It is thread-safe and pools its connections.
+
+    uri defaults to the Atlas cluster of mongodb_uri(), e.g. mongodb://localhost:27017 for a local mongod.
+    """
+    return MongoClient(uri or mongodb_uri(), server_api=ServerApi('1'), maxPoolSize=max_pool_size, minPoolSize=min_pool_size)
+
+def parse_trip_id(trip_id):
+    """Convert a trip id string to an ObjectId, raises ValueError when it isn't one."""
+    try:
+        return ObjectId(trip_id)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid trip ID format: {trip_id}, it should be a 24 character hex string")
+
+def extract_keywords(text, keywords=None):
+    """Meaningful lowercase words of text (no stop words, 3+ letters), appended to keywords without duplicates."""
+    keywords = [] if keywords is None else keywords
+    for word in re.findall(r'\b[a-zA-Z]+\b', str(text)):
+        word = word.lower()
+        if len(word) > 2 and word not in STOP_WORDS and word not in keywords:
+            keywords.append(word)
+    return keywords
+
+def split_destination(destination):
+    """Return (city, state, country) of a trip destination, either an object or a "City, State, Country" string."""
+    if isinstance(destination, dict):
+        return destination.get('city', ''), destination.get('state', ''), destination.get('country', 'United States')
+    destination_parts = [part.strip() for part in str(destination).split(',')]
+    city = destination_parts[0] if len(destination_parts) >= 1 else ''
+    state = destination_parts[1] if len(destination_parts) >= 2 else ''
+    country = destination_parts[2] if len(destination_parts) >= 3 else 'United States'
+    return city, state, country
+
+def _date_only(value):
+    # Keep only the date part of an ISO timestamp
+    if isinstance(value, str) and 'T' in value:
+        return value.split('T')[0]
+    return value
+
+def describe_trip(trip_data):
+    """Pull the fields the search uses out of a trip document.
+
+    Returns:
+        Dictionary with title, dates, destination parts, budget, notes, purpose and trip_data_string,
+        the text summary given to the LLM prompts
+    """
+    title = trip_data.get('name', '')
+    destination = trip_data.get('destination', {})
+    start_date = _date_only(trip_data.get('startDate', 'N/A'))
+    end_date = _date_only(trip_data.get('endDate', 'N/A'))
+    city, state, country = split_destination(destination)
+    total_budget = trip_data.get('totalBudget', None)
+    notes = trip_data.get('notes', '')
+    purpose = trip_data.get('purpose', '')
+
+    trip_data_string = f"Found trip: {title}\n"
+    trip_data_string += f"\nTrip data:\n"
+    trip_data_string += f"- destination: {destination}\n"
+    trip_data_string += f"- startDate: {start_date}\n"
+    trip_data_string += f"- endDate: {end_date}\n"
+    trip_data_string += f"- totalBudget: {total_budget}\n"
+    trip_data_string += f"- notes: {notes[:50]}{'...' if len(str(notes)) > 50 else ''}\n"
+    trip_data_string += f"- title: {title}\n"
+    trip_data_string += f"- purpose: {purpose[:50]}{'...' if len(str(purpose)) > 50 else ''}\n"
+
+    return {
+        'trip_id': trip_data['_id'],
+        'title': title,
+        'start_date': start_date,
+        'end_date': end_date,
+        'city': city,
+        'state': state,
+        'country': country,
+        # totalBudget is already in the $ format of price_level
+        'price_level': total_budget or "",
+        'notes': notes,
+        'purpose': purpose,
+        'trip_data_string': trip_data_string,
+    }
+
+def state_condition(state):
+    """Match a state by both its abbreviation and its full name when it is a US state."""
+    state_value = state.strip()
+    if len(state_value) == 2 and state_value.upper() in US_STATES:
+        names = [state_value.upper(), US_STATES[state_value.upper()]]
+    elif state_value.title() in US_STATE_ABBREVS:
+        names = [US_STATE_ABBREVS[state_value.title()], state_value.title()]
+    else:
+        return {"address_obj.state": state_value}
+    return {"$or": [{"address_obj.state": name} for name in names]}
+
+def country_condition(country):
+    """Match the common spellings of the United States and the United Kingdom, other countries as-is."""
+    country_value = country.strip()
+    if country_value.upper() in ["USA", "U.S.A.", "U.S.", "UNITED STATES", "UNITED STATES OF AMERICA"]:
+        names = US_COUNTRY_NAMES
+    elif country_value.upper() in ["UK", "U.K.", "UNITED KINGDOM", "GREAT BRITAIN"]:
+        names = UK_COUNTRY_NAMES
+    else:
+        return {"address_obj.country": country_value}
+    return {"$or": [{"address_obj.country": name} for name in names]}
+
+def location_filters(trip):
+    """(name, filter) pairs matching the trip's city, state and country, the ones it has."""
+    filters = []
+    if trip['city']:
+        filters.append(('city', {"address_obj.city": trip['city']}))
+    if trip['state']:
+        filters.append(('state', state_condition(trip['state'])))
+    if trip['country']:
+        filters.append(('country', country_condition(trip['country'])))
+    return filters
+
+def build_hotel_query(trip, search_keywords=None, text_search=True):
+    """MongoDB filter for the hotels matching a trip (see describe_trip).
+
+    Location and price level must match, with text_search the keywords are added as a $text
+    search so results can be ranked by BM25 relevance.
+    """
+    query_conditions = [condition for _, condition in location_filters(trip)]
+    if trip['price_level']:
+        query_conditions.append({"price_level": trip['price_level']})
+    if search_keywords and text_search:
+        query_conditions.append({
+            "$text": {
+                "$search": " ".join(search_keywords),
+                "$caseSensitive": False,
+                "$diacriticSensitive": False
+            }
+        })
+    return {"$and": query_conditions} if len(query_conditions) > 1 else query_conditions[0] if query_conditions else {}
+
+def hotel_prompt_summary(index, hotel):
+    return f"""
+                            Hotel {index}:
+                            Name: {hotel.get('name', 'Unknown')}
+                            Rating: {hotel.get('rating', 'N/A')}/5
+                            Price Level: {hotel.get('price_level', 'N/A')}
+                            Styles: {', '.join(hotel.get('styles', []))}
+                            Trip Types: {', '.join([t.get('name', t) if isinstance(t, dict) else t for t in hotel.get('trip_types', [])])}
+                            Amenities: {', '.join([a.get('name', a) if isinstance(a, dict) else a for a in hotel.get('amenities', [])])}
+                            Description: {hotel.get('description', '')[:200]}  # Limit description length for each hotel
+                            """
+
+def main_photo_url(hotel):
+    photos = hotel.get('photos') or []
+    if photos and 'images' in photos[0] and 'original' in photos[0]['images']:
+        return photos[0]['images']['original'].get('url', None)
+    return None
+
+def format_hotel(hotel, trip):
+    """Trip accommodation draft (the trips app's JSON format) for a hotel search result."""
+    name = hotel.get('name', 'Unnamed Hotel')
+    latitude = hotel.get('latitude', None)
+    longitude = hotel.get('longitude', None)
+    address_string = (hotel.get('address_obj') or {}).get('address_string', '')
+    today_date = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    return {
+        "trip_id": {"$oid": str(trip['trip_id'])},
+        "type": "accommodation",
+        "name": f"Stay at {name}",
+        "date": trip['start_date'],
+        "endDate": trip['end_date'],
+        "location": {
+            "name": name,
+            "address": address_string or "",
+            "coordinates": {
+                "lat": {"$numberDouble": str(latitude) if latitude else "0"},
+                "lng": {"$numberDouble": str(longitude) if longitude else "0"}
+            }
+        },
+        "notes": f"Rating: {hotel.get('rating', 'N/A')}/5",
+        "status": "draft",
+        "createdAt": today_date,
+        "updatedAt": today_date,
+        "description": hotel.get('description', ''),
+        "main_media": main_photo_url(hotel) or "",
+        "budget": hotel.get('price_level', 'N/A')
+    }
+
+
+class HotelSearchEngine:
+    """Hotel recommendations for a trip, from the TripAdvisor hotels in MongoDB.
+
+    Meant to be long-lived: it shares one MongoClient (and its connection pool) and one ChatOpenAI
+    client across searches, checks the text index only once and keeps the collection diagnostics in
+    a CollectionStatsCache, so a search without the LLM steps costs a trip lookup and a hotel query.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, client, llm_model=HOTEL_SEARCH_LLM_MODEL, verbose=True, database=MONGODB_DATABASE):
+        self.client = client
+        self.db = client[database]
+        self.trips_collection = self.db[TRIPS_COLLECTION]
+        self.hotels_collection = self.db[HOTELS_COLLECTION]
+        self.collection_stats = CollectionStatsCache(self.hotels_collection)
+        self.llm_model = llm_model
+        self.verbose = verbose
+        self._llm = None
+        self._text_index_ready = False
+        self._lock = threading.Lock()
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+    def warm_up(self):
+        """Open the pooled connections, check the text index and create the LLM client ahead of the first search."""
+        self.client.admin.command('ping')
+        self.ensure_text_index()
+        self.llm()
+
+    def llm(self):
+        """The shared ChatOpenAI client, or None without LangChain or an OPENAI_API_KEY."""
+        with self._lock:
+            if self._llm is None:
+                openai_api_key = os.getenv("OPENAI_API_KEY")
+                if ChatOpenAI is None:
+                    self._log("Warning: LangChain or OpenAI packages not installed. Skipping keyword generation and reranking.")
+                    self._log("To install required packages: pip install langchain langchain-openai")
+                elif not openai_api_key:
+                    self._log("Warning: OPENAI_API_KEY environment variable not set. Skipping keyword generation and reranking.")
+                else:
+                    self._llm = ChatOpenAI(model=self.llm_model, openai_api_key=openai_api_key)
+            return self._llm
+
+    def ensure_text_index(self):
+        """Create the full-text search index if it is missing, checked once per engine."""
+        if self._text_index_ready:
+            return
+        with self._lock:
+            if self._text_index_ready:
+                return
+            if not any(index.get('name') == TEXT_SEARCH_INDEX_NAME for index in self.hotels_collection.list_indexes()):
+                print("Creating text index for full-text search (this may take a minute)...")
+                self.hotels_collection.create_index([
+                    ("name", "text"),
+                    ("description", "text"),
+                    ("styles", "text"),
+                    ("trip_types.name", "text"),
+                    ("amenities", "text"),
+                    ("brand", "text")
+                ], name=TEXT_SEARCH_INDEX_NAME)
+                print("Text index created successfully")
+            self._text_index_ready = True
+
+    def load_trip(self, trip_id):
+        """Return the trip document, or None when there is no trip with this id (ValueError for an invalid id)."""
+        return self.trips_collection.find_one({"_id": parse_trip_id(trip_id)})
+
+    def trip_keywords(self, trip):
+        """Search keywords from the trip's title, purpose and notes."""
+        search_keywords = []
+        for field in ('title', 'purpose', 'notes'):
+            if trip[field]:
+                before = len(search_keywords)
+                extract_keywords(trip[field], search_keywords)
+                self._log(f"Extracted keywords {search_keywords[before:]} from {field}")
+            elif field != 'notes':
+                self._log(f"No {field} keywords extracted (empty {field})")
+        return search_keywords
+
+    def generate_keywords(self, trip):
+        """Ideal hotel characteristics for the trip as keywords, generated by the LLM (empty list without one)."""
+        llm = self.llm()
+        if llm is None:
+            return []
+        self._log("Generating ideal hotel characteristics using LangChain and OpenAI...")
+        prompt = ChatPromptTemplate.from_template(KEYWORDS_TEMPLATE)
+        response_content = invoke_chain_cached(prompt, llm, self.llm_model, {"trip_data": trip['trip_data_string']})
+        self._log(f"Response content: {response_content}")
+        if not response_content or len(response_content.split()) == 0:
+            self._log(f"LLM did not return a response")
+            return []
+        generated_keywords = set([word.lower() for word in response_content.split()])
+        self._log(f"Extracted keywords: \n{generated_keywords}")
+        return list(generated_keywords)
+
+    def collection_diagnostics(self, trip):
+        """Counts about the hotels collection for the trip's destination and budget, see CollectionStatsCache."""
+        return self.collection_stats.get(location_filters(trip), trip['price_level'])
+
+    def find_hotels(self, query, text_search, limit=DEFAULT_SEARCH_LIMIT):
+        """Run the hotel query, sorted by BM25 text relevance with text_search or by rating otherwise."""
+        if text_search:
+            projection = {**HOTEL_RESULT_PROJECTION, "score": {"$meta": "textScore"}}
+            cursor = self.hotels_collection.find(query, projection).sort([("score", {"$meta": "textScore"})])
+        else:
+            cursor = self.hotels_collection.find(query, HOTEL_RESULT_PROJECTION).sort([("rating", -1)])
+        # Convert MongoDB documents to plain JSON
+        return json.loads(json_util.dumps(list(cursor.limit(limit))))
+
+    def rerank(self, trip, hotels):
+        """Move the hotel the LLM finds the best match for the trip to the top of hotels, in place."""
+        llm = self.llm()
+        if llm is None or not hotels:
+            return hotels
+        self._log("\nReranking results using OpenAI...")
+        prompt = ChatPromptTemplate.from_template(RERANK_TEMPLATE)
+        response_content = invoke_chain_cached(prompt, llm, self.llm_model, {
+            "trip_data": trip['trip_data_string'],
+            "hotels_data": "\n".join(hotel_prompt_summary(i, hotel) for i, hotel in enumerate(hotels, 1))
+        })
+        best_hotel_name = response_content.strip()
+        self._log(f"\nLLM selected best hotel: {best_hotel_name}")
+        for i, hotel in enumerate(hotels):
+            if hotel.get('name') == best_hotel_name:
+                hotels.insert(0, hotels.pop(i))
+                self._log(f"Moved {best_hotel_name} to the top of the results")
+                break
+        self._log("Reranking complete!")
+        return hotels
+
+    def search(self, trip_id, limit=DEFAULT_SEARCH_LIMIT, text_search=True, generate_keywords=True, rerank_results=True, diagnostics=False):
+        """Recommend hotels for a trip.
+
+        Args:
+            trip_id: MongoDB _id of the trip, as a string
+            limit: Maximum number of hotels returned
+            text_search: Rank by BM25 text search on the trip keywords, otherwise match fields only and sort by rating
+            generate_keywords: Add LLM generated hotel characteristics to the keywords
+            rerank_results: Let the LLM pick the best hotel and move it to the top
+            diagnostics: Add the collection diagnostics (see collection_diagnostics) to the result
+
+        Returns:
+            Dictionary with the trip summary, search_keywords, query, hotels (the matched documents),
+            results (trip accommodation drafts, see format_hotel), diagnostics and timings_ms per step,
+            or None when the trip doesn't exist. Raises ValueError for an invalid trip id.
+        """
+        timings_ms = {}
+        step_start = time.monotonic()
+
+        def step_done(step):
+            nonlocal step_start
+            now = time.monotonic()
+            timings_ms[step] = round((now - step_start) * 1000, 1)
+            step_start = now
+
+        trip_data = self.load_trip(trip_id)
+        step_done('load_trip')
+        if not trip_data:
+            self._log(f"No trip found with ID: {trip_id}")
+            return None
+        trip = describe_trip(trip_data)
+        self._log(trip['trip_data_string'])
+
+        search_keywords = self.trip_keywords(trip)
+        if generate_keywords:
+            generated_keywords = self.generate_keywords(trip)
+            for word in generated_keywords:
+                if word not in search_keywords:
+                    search_keywords.append(word)
+            if generated_keywords:
+                self._log(f"\nAdded {len(generated_keywords)} generated keywords to search")
+            step_done('generate_keywords')
+
+        use_text_search = bool(search_keywords) and text_search
+        if use_text_search:
+            self.ensure_text_index()
+            self._log(f"\nAdding full-text search with BM25 scoring for: '{' '.join(search_keywords)}'")
+        elif search_keywords:
+            self._log(f"\nText search disabled. Keywords will be ignored: {', '.join(search_keywords)}")
+        query = build_hotel_query(trip, search_keywords, text_search)
+        self._log(f"\nFinal query: {json.dumps(query, indent=2)}")
+
+        hotels = self.find_hotels(query, use_text_search, limit)
+        step_done('find_hotels')
+        self._log(f"\nFound {len(hotels)} hotels matching search criteria "
+                  f"(sorted by {'BM25 text relevance' if use_text_search else 'rating'})")
+
+        if rerank_results and hotels:
+            self.rerank(trip, hotels)
+            step_done('rerank')
+
+        collection_diagnostics = None
+        if diagnostics:
+            collection_diagnostics = self.collection_diagnostics(trip)
+            step_done('diagnostics')
+
+        return {
+            'trip': {**trip, 'trip_id': str(trip['trip_id'])},
+            'search_keywords': search_keywords,
+            'query': query,
+            'hotels': hotels,
+            'results': [format_hotel(hotel, trip) for hotel in hotels],
+            'diagnostics': collection_diagnostics,
+            'timings_ms': timings_ms,
+        }
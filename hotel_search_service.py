@@ -0,0 +1,150 @@
+# Usage:
+# uv run hotel_search_service.py --port 8090
+# uv run --with gunicorn gunicorn --workers 4 --threads 8 --bind 0.0.0.0:8090 'hotel_search_service:create_wsgi_app()'
+# curl "http://127.0.0.1:8090/trips/67e31524c3bdddc136254061/hotels?limit=5"
+# curl "http://127.0.0.1:8090/trips/67e31524c3bdddc136254061/hotels?generate_keywords=0&rerank=0"
+# curl "http://127.0.0.1:8090/trips/67e31524c3bdddc136254061/hotels?generate_keywords=0&rerank=0&diagnostics=1"
+#
+# Long-running HTTP service for the hotel search of search_hotels_for_trip.py. The MongoDB
+# connection pool, the text index check and the OpenAI client are set up once at startup, so a
+# search without the LLM steps (generate_keywords=0&rerank=0) is two indexed queries.
+#
+# The Flask development server of main() is for local use. In production run the app under
+# gunicorn through create_wsgi_app(), configured from the environment (HOTEL_SEARCH_MAX_POOL_SIZE,
+# HOTEL_SEARCH_VERBOSE). Don't pass --preload: every worker must open its own MongoDB connections
+# and start its own stats refresh thread after the fork. benchmark_hotel_search.py checks the
+# latency of the search without the LLM steps.
+
+import os
+import time
+import atexit
+import argparse
+
+from flask import Flask, Response, jsonify, request
+from pymongo.errors import PyMongoError
+
+from hotel_search_engine import HotelSearchEngine, create_mongo_client, DEFAULT_SEARCH_LIMIT, MONGODB_MAX_POOL_SIZE
+from pipeline_metrics import metrics
+
+MAX_SEARCH_LIMIT = 50
+# Searches without the LLM steps slower than this are logged with their timings_ms.
+SLOW_SEARCH_MS = float(os.getenv('HOTEL_SEARCH_SLOW_MS', '100'))
+
+
+def _flag(name, default=True):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+def create_app(engine):
+    """Flask app serving hotel searches from a shared HotelSearchEngine."""
+    app = Flask(__name__)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({'status': 'ok'})
+
+    @app.route('/collection_stats', methods=['GET'])
+    def collection_stats():
+        return jsonify(engine.collection_stats.stats())
+
+    @app.route('/collection_stats', methods=['DELETE'])
+    def invalidate_collection_stats():
+        engine.collection_stats.invalidate()
+        return jsonify(engine.collection_stats.stats())
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.prometheus_text(), mimetype='text/plain')
+
+    @app.route('/trips/<trip_id>/hotels', methods=['GET'])
+    def search_hotels(trip_id):
+        try:
+            limit = min(int(request.args.get('limit', DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        generate_keywords = _flag('generate_keywords')
+        rerank_results = _flag('rerank')
+        start = time.monotonic()
+        try:
+            search = engine.search(
+                trip_id,
+                limit=limit,
+                text_search=_flag('text_search'),
+                generate_keywords=generate_keywords,
+                rerank_results=rerank_results,
+                diagnostics=_flag('diagnostics', default=False),
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except PyMongoError as e:
+            print(f"MongoDB error while searching hotels for trip {trip_id}: {e}")
+            metrics.increment('hotel_search_errors')
+            return jsonify({'error': 'MongoDB unavailable'}), 503
+        finally:
+            metrics.observe_latency('hotel_search', time.monotonic() - start)
+
+        if search is None:
+            return jsonify({'error': f'No trip found with ID: {trip_id}'}), 404
+        elapsed_ms = (time.monotonic() - start) * 1000
+        if not generate_keywords and not rerank_results and elapsed_ms > SLOW_SEARCH_MS:
+            print(f"Slow hotel search for trip {trip_id}: {elapsed_ms:.1f} ms, timings_ms {search['timings_ms']}")
+            metrics.increment('hotel_search_slow')
+        return jsonify({
+            'trip_id': trip_id,
+            'search_keywords': search['search_keywords'],
+            'hotels': search['results'],
+            'diagnostics': search['diagnostics'],
+            'timings_ms': search['timings_ms'],
+        })
+
+    return app
+
+def start_engine(max_pool_size=MONGODB_MAX_POOL_SIZE, verbose=False):
+    """Connect to MongoDB and return a warmed up HotelSearchEngine refreshing its collection stats in the background."""
+    client = create_mongo_client(max_pool_size=max_pool_size)
+    engine = HotelSearchEngine(client, verbose=verbose)
+    try:
+        engine.warm_up()
+    except Exception:
+        client.close()
+        raise
+    engine.collection_stats.start_background_refresh()
+    print(f"Connected to MongoDB, LLM steps {'enabled' if engine.llm() else 'disabled'}.")
+    return engine
+
+def stop_engine(engine):
+    engine.collection_stats.stop_background_refresh()
+    engine.client.close()
+
+def create_wsgi_app():
+    """WSGI app for gunicorn ('hotel_search_service:create_wsgi_app()'), called once per worker."""
+    engine = start_engine(
+        max_pool_size=int(os.getenv('HOTEL_SEARCH_MAX_POOL_SIZE', str(MONGODB_MAX_POOL_SIZE))),
+        verbose=os.getenv('HOTEL_SEARCH_VERBOSE', '').lower() in ('1', 'true', 'yes', 'on'),
+    )
+    atexit.register(stop_engine, engine)
+    return create_app(engine)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve hotel recommendations for trips over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--max-pool-size', type=int, default=MONGODB_MAX_POOL_SIZE,
+                        help=f'Maximum number of pooled MongoDB connections (default {MONGODB_MAX_POOL_SIZE})')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Print the keywords, query and LLM answers of every search')
+    args = parser.parse_args()
+
+    engine = start_engine(max_pool_size=args.max_pool_size, verbose=args.verbose)
+    try:
+        print(f"Serving hotel searches on http://{args.host}:{args.port}/ (Flask development server, "
+              f"use gunicorn with create_wsgi_app() in production)")
+        create_app(engine).run(host=args.host, port=args.port, threaded=True)
+    finally:
+        stop_engine(engine)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import re
+import json
+import datetime
+
+# Fixed schema of the key insights extracted from a hotel reservation email: field -> type.
+KEY_INSIGHTS_FIELDS = {
+    'hotel': str,
+    'city': str,
+    'country': str,
+    'check_in': datetime.date,
+    'check_out': datetime.date,
+    'guests': int,
+    'total_price': float,
+    'currency': str,
+    'loyalty_tier': str,
+    'payment_method': str,
+    'room_type': str,
+}
+
+KEY_INSIGHTS_JSON_EXAMPLE = json.dumps({
+    'hotel': 'Four Seasons Resort Maui at Wailea',
+    'city': 'Wailea',
+    'country': 'USA',
+    'check_in': '2024-12-21',
+    'check_out': '2024-12-28',
+    'guests': 4,
+    'total_price': 12450.50,
+    'currency': 'USD',
+    'loyalty_tier': None,
+    'payment_method': 'credit card',
+    'room_type': 'Ocean View Suite, 1 King and 2 Queen beds',
+})
+
+_DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%B %d, %Y', '%b %d, %Y', '%d %B %Y', '%d %b %Y', '%A, %B %d, %Y', '%a, %b %d, %Y']
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+_PYTHON_LITERALS_RE = re.compile(r'\b(None|True|False)\b')
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+def _extract_json_object(text):
+    """Return the outermost {...} of an LLM answer, without code fences and surrounding prose."""
+    text = _CODE_FENCE_RE.sub('', text.strip())
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1:
+        return text
+    if end < start:
+        # Truncated answer (max tokens reached): close the object and let validation drop missing fields.
+        return text[start:].rstrip().rstrip(',') + '}'
+    return text[start:end + 1]
+
+def _repair_json(text):
+    """Fix the malformed JSON LLMs usually produce: trailing commas, single quotes, Python literals."""
+    text = _TRAILING_COMMA_RE.sub(r'\1', text)
+    text = _PYTHON_LITERALS_RE.sub(lambda m: {'None': 'null', 'True': 'true', 'False': 'false'}[m.group(1)], text)
+    if '"' not in text:
+        text = text.replace("'", '"')
+    return text
+
+def _parse_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    value = str(value).strip()
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    try:
+        return datetime.datetime.fromisoformat(value).date()
+    except ValueError:
+        return None
+
+def _coerce(value, field_type):
+    """Coerce a JSON value to the field type, None when missing or unusable."""
+    if value is None or (isinstance(value, str) and value.strip().lower() in ('', 'null', 'none', 'unknown', 'n/a')):
+        return None
+    if field_type is datetime.date:
+        return _parse_date(value)
+    if field_type in (int, float):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return field_type(value)
+        match = _NUMBER_RE.search(str(value).replace(',', ''))
+        return field_type(float(match.group())) if match else None
+    if isinstance(value, (list, dict)):
+        return None
+    return ' '.join(str(value).split())
+
+def validate_key_insights(data):
+    """Validate and normalize a parsed key insights object to KEY_INSIGHTS_FIELDS.
+
+    Unknown fields are dropped, values are coerced to the field types (dates become ISO strings)
+    and unusable values become None.
+
+    Returns:
+        The normalized dict.
+
+    Raises:
+        ValueError: If data isn't an object, or has neither a hotel nor a city.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    normalized = {}
+    for field, field_type in KEY_INSIGHTS_FIELDS.items():
+        value = _coerce(data.get(field), field_type)
+        normalized[field] = value.isoformat() if isinstance(value, datetime.date) else value
+    if not normalized['hotel'] and not normalized['city']:
+        raise ValueError("missing both hotel and city")
+    if normalized['check_in'] and normalized['check_out'] and normalized['check_out'] < normalized['check_in']:
+        normalized['check_out'] = None
+    if normalized['guests'] is not None and normalized['guests'] <= 0:
+        normalized['guests'] = None
+    return normalized
+
+def parse_key_insights(response):
+    """Parse an LLM key insights answer into the fixed schema, repairing common JSON mistakes.
+
+    Returns:
+        Tuple (key insights dict or None, error message or None).
+    """
+    if isinstance(response, dict):
+        candidates = [response]
+    elif not response:
+        return None, "empty response"
+    else:
+        text = _extract_json_object(str(response))
+        candidates = [text, _repair_json(text)]
+
+    error = None
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate) if isinstance(candidate, str) else candidate
+            return validate_key_insights(data), None
+        except (json.JSONDecodeError, ValueError) as e:
+            error = str(e)
+    return None, error
+
+def key_insights_repair_prompt(response, error):
+    return (
+        "The following answer was supposed to be a single JSON object with exactly these fields: "
+        f"{', '.join(KEY_INSIGHTS_FIELDS)}. It could not be used ({error}). Rewrite it as valid JSON, using null for unknown "
+        f"values and YYYY-MM-DD dates. Return just the JSON object. Example: {KEY_INSIGHTS_JSON_EXAMPLE}\n\nAnswer:\n{response}"
+    )
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+
+from pipeline_metrics import metrics
+
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', './cache/llm_cache.sqlite3')
+LLM_CACHE_MAX_BYTES = int(float(os.getenv('LLM_CACHE_MAX_MB', '512')) * 1024 * 1024)
+LLM_CACHE_TTL_SECONDS = float(os.getenv('LLM_CACHE_TTL_SECONDS', '0')) or None  # 0 / unset means entries never expire
+LLM_CACHE_DISABLED = os.getenv('LLM_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes')
+# Hits only update last_accessed_at in memory, written to SQLite in one transaction per this many hits.
+LLM_CACHE_ACCESS_FLUSH_SIZE = 256
+
+
+class LLMCache:
+    """Persistent content-addressed cache of LLM responses, backed by SQLite.
+
+    Entries are keyed by a hash of the model, the prompt and the sampling parameters, so a rerun
+    of the pipeline after a crash or a downstream code change never pays twice for the same call.
+    The cache is bounded by total response size with least-recently-used eviction, entries can
+    expire after an optional TTL, and hit / miss counters are kept for the current process.
+    A hit doesn't write to the database: access times are kept in memory and flushed in batches,
+    and before an eviction so the LRU order is up to date. Access times that weren't flushed when
+    the process dies are lost, which only makes those entries look older to the LRU eviction.
+    """
+
+    def __init__(self, db_path=LLM_CACHE_PATH, max_size_bytes=LLM_CACHE_MAX_BYTES, ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pending_accesses = {}
+
+        dirname = os.path.dirname(db_path)
+        if len(dirname.strip()) > 0:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_accessed ON llm_responses (last_accessed_at)")
+        self._conn.commit()
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt, params=None):
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        key_data = json.dumps({'model': model, 'prompt': prompt_hash, 'params': params or {}}, sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt, params=None):
+        """Return the cached response, or None on a miss (or an expired entry)."""
+        key = self.make_key(model, prompt, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, size_bytes, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._size_bytes -= row[1]
+                self._pending_accesses.pop(key, None)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._pending_accesses[key] = now
+            if len(self._pending_accesses) >= LLM_CACHE_ACCESS_FLUSH_SIZE:
+                self._flush_accesses()
+                self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, model, prompt, params, response):
+        key = self.make_key(model, prompt, params)
+        size_bytes = len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT size_bytes FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, model, response, size_bytes, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size_bytes, now, now)
+            )
+            self._size_bytes += size_bytes - (row[0] if row else 0)
+            self._pending_accesses.pop(key, None)
+            self._evict_if_needed()
+            self._conn.commit()
+
+    def _flush_accesses(self):
+        # Called with the lock held, the caller commits.
+        if self._pending_accesses:
+            self._conn.executemany(
+                "UPDATE llm_responses SET last_accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._pending_accesses.items()]
+            )
+            self._pending_accesses.clear()
+
+    def flush(self):
+        """Write the access times of the hits since the last flush."""
+        with self._lock:
+            self._flush_accesses()
+            self._conn.commit()
+
+    def _evict_if_needed(self):
+        # Called with the lock held: drop least recently used entries until we are under the size limit.
+        if self._size_bytes > self.max_size_bytes:
+            self._flush_accesses()
+        while self._size_bytes > self.max_size_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size_bytes FROM llm_responses ORDER BY last_accessed_at ASC LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size_bytes in rows:
+                if self._size_bytes <= self.max_size_bytes:
+                    break
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._size_bytes -= size_bytes
+                self.evictions += 1
+
+    def get_or_compute(self, model, prompt, params, compute_fn):
+        """Return the cached response for this call, or run compute_fn() and cache its result.
+
+        Empty responses are not cached, and exceptions from compute_fn propagate uncached.
+        """
+        response = self.get(model, prompt, params)
+        if response is not None:
+            return response
+
+        response = compute_fn()
+        if isinstance(response, str) and response:
+            self.set(model, prompt, params, response)
+        return response
+
+    def stats(self):
+        with self._lock:
+            self._flush_accesses()
+            self._conn.commit()
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size_bytes': self._size_bytes,
+            }
+
+
+class _DisabledLLMCache:
+    """Stand-in used when LLM_CACHE_DISABLED is set: always computes, never stores."""
+
+    def get(self, model, prompt, params=None):
+        return None
+
+    def set(self, model, prompt, params, response):
+        pass
+
+    def get_or_compute(self, model, prompt, params, compute_fn):
+        return compute_fn()
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'evictions': 0, 'entries': 0, 'size_bytes': 0}
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Return the process-wide LLM cache, opening it on first use."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = _DisabledLLMCache() if LLM_CACHE_DISABLED else LLMCache()
+            atexit.register(_llm_cache.flush)
+        return _llm_cache
+
+def invoke_chain_cached(prompt, llm, model, inputs, params=None):
+    """Invoke `prompt | llm` with LangChain, going through the LLM cache.
+
+    The cache key uses the fully formatted prompt, so any change to the template or the inputs
+    is a miss. Returns the response content string.
+    """
+    formatted_prompt = prompt.format(**inputs)
+    chain = prompt | llm
+
+    def invoke():
+        with metrics.timed('openai'):
+            message = chain.invoke(inputs)
+        usage = getattr(message, 'usage_metadata', None)
+        if usage:
+            metrics.record_tokens(model, usage.get('input_tokens'), usage.get('output_tokens'))
+        return message.content
+
+    return get_llm_cache().get_or_compute(model, formatted_prompt, params, invoke)
+
+def print_llm_cache_stats():
+    stats = get_llm_cache().stats()
+    print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+          f"{stats['entries']} entries, {stats['size_bytes'] / (1024 * 1024):.1f} MB, {stats['evictions']} evictions")
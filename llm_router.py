@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import statistics
+import threading
+
+from groq_async_inference import (
+    GROQ_SAMPLING_PARAMS,
+    GROQ_MODEL_RATE_LIMITS,
+    GROQ_DEFAULT_RATE_LIMITS,
+    estimate_tokens,
+    run_groq_inference_async_batch,
+)
+from groq_batch_engine import GroqBatchEngine, batch_job_name
+from pipeline_metrics import MODEL_PRICES, DEFAULT_MODEL_PRICES, BATCH_DISCOUNT
+
+# USD per million input / output tokens, shared with the pipeline metrics cost report.
+GROQ_MODEL_PRICES = MODEL_PRICES
+GROQ_DEFAULT_PRICES = DEFAULT_MODEL_PRICES
+GROQ_BATCH_DISCOUNT = BATCH_DISCOUNT
+
+# Below this many prompts a batch job's queueing isn't worth the savings.
+LLM_ROUTER_MIN_BATCH_PROMPTS = 200
+# Batch turnaround assumed until some batch jobs have been observed (the completion window is much longer).
+LLM_ROUTER_DEFAULT_BATCH_TURNAROUND_SECONDS = 3600
+LLM_ROUTER_HISTORY_FILE = os.getenv('LLM_ROUTER_HISTORY_FILE', './email_data/v0/llm_routing.jsonl')
+
+LLM_ROUTER_MODES = ('auto', 'realtime', 'batch')
+
+
+class LLMRouter:
+    """Chooses, per stage, between the real-time Groq pool and the Groq Batch API.
+
+    In 'auto' mode a stage goes real-time when it is small, or when the observed batch
+    turnaround wouldn't fit the deadline; otherwise it goes to a batch job at the discounted
+    price, optionally keeping its first realtime_head prompts real-time so early results
+    arrive quickly. Every decision is appended to a JSONL history with the estimated cost of
+    the chosen path, what it saved versus all real-time, and the measured durations; batch
+    turnarounds in that history are what later estimates are based on.
+    """
+
+    def __init__(self, mode='auto', deadline_seconds=None, realtime_head=0, min_batch_prompts=LLM_ROUTER_MIN_BATCH_PROMPTS, history_file=LLM_ROUTER_HISTORY_FILE):
+        self.configure(mode, deadline_seconds, realtime_head)
+        self.min_batch_prompts = min_batch_prompts
+        self.history_file = history_file
+        self._lock = threading.Lock()
+        self.decisions = []
+
+    def configure(self, mode='auto', deadline_seconds=None, realtime_head=0):
+        if mode not in LLM_ROUTER_MODES:
+            raise ValueError(f"Unknown LLM routing mode {mode}, expected one of {LLM_ROUTER_MODES}")
+        self.mode = mode
+        self.deadline_seconds = deadline_seconds
+        self.realtime_head = realtime_head
+
+    def observed_batch_turnaround(self):
+        """75th percentile of the batch turnarounds in the history (default until there are some)."""
+        turnarounds = []
+        if os.path.exists(self.history_file):
+            with open(self.history_file, 'r') as f:
+                for line in f:
+                    try:
+                        turnarounds.extend(json.loads(line).get('batch_turnaround_seconds', []))
+                    except json.JSONDecodeError:
+                        continue
+        if len(turnarounds) < 2:
+            return turnarounds[0] if turnarounds else LLM_ROUTER_DEFAULT_BATCH_TURNAROUND_SECONDS
+        return statistics.quantiles(turnarounds, n=4)[-1]
+
+    @staticmethod
+    def estimate_cost(prompts, model, sampling_params):
+        """Estimated real-time USD cost, counting max_completion_tokens as the output of each prompt."""
+        prices = GROQ_MODEL_PRICES.get(model, GROQ_DEFAULT_PRICES)
+        input_tokens = sum(estimate_tokens(prompt) for prompt in prompts)
+        output_tokens = len(prompts) * sampling_params.get("max_completion_tokens", 0)
+        return (input_tokens * prices["input"] + output_tokens * prices["output"]) / 1_000_000
+
+    @staticmethod
+    def estimate_realtime_seconds(prompts, model, sampling_params):
+        """Lower bound of the real-time duration imposed by the model's rpm / tpm limits."""
+        limits = GROQ_MODEL_RATE_LIMITS.get(model, GROQ_DEFAULT_RATE_LIMITS)
+        tokens = sum(estimate_tokens(prompt) for prompt in prompts) + len(prompts) * sampling_params.get("max_completion_tokens", 0)
+        return 60 * max(len(prompts) / limits["rpm"], tokens / limits["tpm"])
+
+    def plan(self, prompts_dict, model, sampling_params=None):
+        """Decide how many prompts go real-time (the first ones) and how many to a batch job.
+
+        Returns:
+            Dict with mode, num_realtime, num_batch, the reason and the estimates behind it.
+        """
+        sampling_params = sampling_params or GROQ_SAMPLING_PARAMS
+        prompts = list(prompts_dict.values())
+        realtime_seconds = self.estimate_realtime_seconds(prompts, model, sampling_params)
+        batch_seconds = self.observed_batch_turnaround()
+
+        if self.mode != 'auto':
+            num_realtime, reason = (len(prompts), "forced real-time") if self.mode == 'realtime' else (0, "forced batch")
+        elif len(prompts) < self.min_batch_prompts:
+            num_realtime, reason = len(prompts), f"fewer than {self.min_batch_prompts} prompts"
+        elif self.deadline_seconds is not None and batch_seconds > self.deadline_seconds:
+            num_realtime, reason = len(prompts), f"batch turnaround ~{batch_seconds:.0f}s exceeds the {self.deadline_seconds:.0f}s deadline"
+        else:
+            num_realtime = min(self.realtime_head, len(prompts))
+            reason = f"batch turnaround ~{batch_seconds:.0f}s fits the deadline" if self.deadline_seconds is not None else "no deadline"
+
+        realtime_cost = self.estimate_cost(prompts, model, sampling_params)
+        chosen_cost = (
+            self.estimate_cost(prompts[:num_realtime], model, sampling_params)
+            + self.estimate_cost(prompts[num_realtime:], model, sampling_params) * (1 - GROQ_BATCH_DISCOUNT)
+        )
+        num_batch = len(prompts) - num_realtime
+        return {
+            'mode': 'realtime' if num_batch == 0 else 'batch' if num_realtime == 0 else 'split',
+            'num_realtime': num_realtime,
+            'num_batch': num_batch,
+            'reason': reason,
+            'estimated_realtime_seconds': round(realtime_seconds, 1),
+            'estimated_batch_seconds': round(batch_seconds, 1) if num_batch else None,
+            'estimated_cost_usd': round(chosen_cost, 4),
+            'estimated_saved_usd': round(realtime_cost - chosen_cost, 4),
+        }
+
+    def run(self, stage_name, prompts_dict, model, sampling_params=None, concurrency_controller=None, on_result=None):
+        """Run a stage's prompts on the planned path(s), the batch part concurrently with the real-time part.
+
+        Returns:
+            Tuple (results, errors) of dicts keyed by prompt ID. A prompt is in exactly one of them.
+        """
+        if not prompts_dict:
+            return {}, {}
+        decision = self.plan(prompts_dict, model, sampling_params)
+        print(f"LLM router {stage_name}: {decision['num_realtime']} real-time, {decision['num_batch']} batch ({decision['reason']}), "
+              f"estimated ${decision['estimated_cost_usd']:.4f}, saving ${decision['estimated_saved_usd']:.4f}.")
+
+        prompt_ids = list(prompts_dict)
+        realtime_prompts = {prompt_id: prompts_dict[prompt_id] for prompt_id in prompt_ids[:decision['num_realtime']]}
+        batch_prompts = {prompt_id: prompts_dict[prompt_id] for prompt_id in prompt_ids[decision['num_realtime']:]}
+        results = {}
+        errors = {}
+        batch_outcome = {}
+
+        def run_batch():
+            # One job per prompt set: the calls of a stage run concurrently and each keeps its own batch state.
+            engine = GroqBatchEngine(model, job_name=batch_job_name(stage_name, batch_prompts), job_group=stage_name,
+                                     sampling_params=sampling_params)
+            start = time.monotonic()
+            try:
+                batch_outcome['results'], batch_outcome['errors'] = engine.run(batch_prompts)
+            except Exception as e:
+                print(f"Batch job for {stage_name} failed: {e}")
+                batch_outcome['results'], batch_outcome['errors'] = {}, {prompt_id: str(e) for prompt_id in batch_prompts}
+            batch_outcome['seconds'] = time.monotonic() - start
+            batch_outcome['turnarounds'] = engine.turnaround_seconds
+
+        batch_thread = None
+        if batch_prompts:
+            batch_thread = threading.Thread(target=run_batch, name=f"{stage_name}-batch", daemon=True)
+            batch_thread.start()
+
+        start = time.monotonic()
+        if realtime_prompts:
+            realtime_results, realtime_errors = run_groq_inference_async_batch(
+                realtime_prompts,
+                model=model,
+                concurrency_controller=concurrency_controller,
+                on_result=on_result,
+                sampling_params=sampling_params,
+            )
+            results.update(realtime_results)
+            errors.update(realtime_errors)
+        realtime_seconds = time.monotonic() - start
+
+        if batch_thread:
+            batch_thread.join()
+            results.update(batch_outcome['results'])
+            errors.update(batch_outcome['errors'])
+            if on_result:
+                for prompt_id, response in batch_outcome['results'].items():
+                    on_result(prompt_id, response)
+
+        self._record({
+            'stage': stage_name,
+            'model': model,
+            'at': int(time.time()),
+            'num_prompts': len(prompts_dict),
+            **decision,
+            'realtime_seconds': round(realtime_seconds, 1) if realtime_prompts else None,
+            'batch_seconds': round(batch_outcome['seconds'], 1) if batch_prompts else None,
+            'batch_turnaround_seconds': [round(seconds, 1) for seconds in batch_outcome.get('turnarounds', [])],
+            'num_errors': len(errors),
+        })
+        return results, errors
+
+    def _record(self, entry):
+        with self._lock:
+            self.decisions.append(entry)
+            dirname = os.path.dirname(self.history_file)
+            if len(dirname.strip()) > 0:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.history_file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def print_report(self):
+        if not self.decisions:
+            return
+        saved = sum(decision['estimated_saved_usd'] for decision in self.decisions)
+        print(f"LLM router: estimated ${saved:.4f} saved versus all real-time.")
+        for decision in self.decisions:
+            print(f"   {decision['stage']}: {decision['mode']} ({decision['num_realtime']} real-time, {decision['num_batch']} batch), "
+                  f"{decision['reason']}, saved ${decision['estimated_saved_usd']:.4f}")
@@ -0,0 +1,90 @@
+import contextvars
+import functools
+from contextlib import contextmanager
+
+from gmail_service_pool import GmailServicePool
+from concurrency_controller import AIMDConcurrencyController
+from stage_store import StageStore
+from gmail_quota import GmailQuotaScheduler, GMAIL_USER_QUOTA_UNITS_PER_SECOND
+
+GMAIL_INITIAL_CONCURRENCY = 10
+GMAIL_MAX_CONCURRENCY = 50
+GMAIL_BATCH_INITIAL_CONCURRENCY = 2
+GMAIL_BATCH_MAX_CONCURRENCY = 8
+
+
+class MailboxContext:
+    """Everything the email pipeline keeps per mailbox.
+
+    Gmail enforces its quota per user, so each mailbox has its own Gmail clients, its own quota
+    unit scheduler and its own adaptive Gmail concurrency limits: one throttled mailbox backs off
+    without slowing the others down. Stage outputs, journals, error logs and sync checkpoints live under the
+    mailbox's data directory. LLM calls are not per mailbox, they share the process-wide limits.
+    """
+
+    def __init__(self, name, token_file, data_dir, client_id, client_secret, scopes, credentials=None, interactive=True,
+                 gmail_max_concurrency=GMAIL_MAX_CONCURRENCY, gmail_batch_max_concurrency=GMAIL_BATCH_MAX_CONCURRENCY, client_options=None,
+                 gmail_quota_units_per_second=GMAIL_USER_QUOTA_UNITS_PER_SECOND):
+        self.name = name
+        self.data_dir = data_dir
+        self.gmail_service_pool = GmailServicePool(token_file, client_id, client_secret, scopes,
+                                                   client_options=client_options, credentials=credentials, interactive=interactive)
+        self.gmail_concurrency = AIMDConcurrencyController(
+            f'gmail {name}',
+            initial_limit=min(GMAIL_INITIAL_CONCURRENCY, gmail_max_concurrency),
+            max_limit=gmail_max_concurrency,
+            latency_threshold=10.0,
+        )
+        self.gmail_batch_concurrency = AIMDConcurrencyController(
+            f'gmail_batch {name}',
+            initial_limit=min(GMAIL_BATCH_INITIAL_CONCURRENCY, gmail_batch_max_concurrency),
+            max_limit=gmail_batch_max_concurrency,
+            latency_threshold=60.0,
+        )
+        self.gmail_quota = GmailQuotaScheduler(name, units_per_second=gmail_quota_units_per_second)
+        self.stage_store = StageStore(self.path('stages.sqlite3'))
+
+    def path(self, file_name):
+        """Path of a file in the mailbox's data directory."""
+        return f'{self.data_dir}/{file_name}'
+
+    def get_gmail_service(self):
+        return self.gmail_service_pool.get_service()
+
+    def qualified_name(self, name):
+        """name, qualified with the mailbox unless it is the default one (LLM batch job names, metrics stages, ...)."""
+        return name if self is _default_mailbox else f'{self.name}__{name}'
+
+    def close(self):
+        self.stage_store.close()
+
+
+_default_mailbox = None
+_current_mailbox = contextvars.ContextVar('current_mailbox', default=None)
+
+def set_default_mailbox(mailbox):
+    """Mailbox used where no other one was selected with use_mailbox() (the single-user scan)."""
+    global _default_mailbox
+    _default_mailbox = mailbox
+
+def current_mailbox():
+    return _current_mailbox.get() or _default_mailbox
+
+@contextmanager
+def use_mailbox(mailbox):
+    """Run the pipeline code of this block against mailbox (in the current thread only)."""
+    token = _current_mailbox.set(mailbox)
+    try:
+        yield mailbox
+    finally:
+        _current_mailbox.reset(token)
+
+def bind_mailbox(fn):
+    """Wrap fn so it runs against the caller's current mailbox, even from another thread."""
+    mailbox = current_mailbox()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with use_mailbox(mailbox):
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,188 @@
+# Usage:
+# uv run mailbox_scanner.py --credentials-dir ./credentials --max-parallel-mailboxes 4
+# uv run mailbox_scanner.py --credentials-table ./credentials.jsonl --incremental
+#
+# Scans many users' mailboxes concurrently with the search_email.py pipeline. Each mailbox gets
+# its own Gmail clients, Gmail concurrency limits (Gmail quotas are per user) and data directory
+# with its own stage store, LLM calls share the process-wide Groq limits and the LLM cache.
+
+import os
+import re
+import json
+import time
+import concurrent.futures
+
+from google.oauth2.credentials import Credentials
+
+from mailbox_context import MailboxContext, use_mailbox
+from pipeline_metrics import metrics
+from search_email import (
+    CLIENT_ID,
+    CLIENT_SECRET,
+    SCOPES,
+    EMAIL_DATA_DIR,
+    PROFILE_DIR,
+    build_arg_parser,
+    configure_llm_router,
+    scan_mailbox,
+    save_to_jsonl,
+    groq_concurrency,
+    llm_router,
+    print_llm_cache_stats,
+    get_email_preclassifier,
+)
+
+MAILBOXES_DATA_DIR = f'{EMAIL_DATA_DIR}/mailboxes'
+DEFAULT_MAX_PARALLEL_MAILBOXES = 4
+# Budgets of in-flight Gmail requests for the whole process, split evenly between the mailboxes scanned at once.
+GMAIL_GLOBAL_MAX_IN_FLIGHT = 100
+GMAIL_BATCH_GLOBAL_MAX_IN_FLIGHT = 16
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+def _safe_name(user):
+    return re.sub(r'[^A-Za-z0-9@._-]', '_', user)
+
+def load_mailbox_credentials(credentials_dir=None, credentials_table=None):
+    """List the mailboxes to scan from a directory of token pickles and / or a JSONL table.
+
+    In the directory every *.pickle file (as written by search_email.py) is one user, named after
+    the file. Each line of the table has a 'user' and either a 'token_file' or the fields of
+    stored OAuth credentials ('refresh_token', optionally 'token', 'client_id', 'client_secret'
+    and 'scopes', defaulting to the app's).
+
+    Returns:
+        List of dicts with 'user', 'token_file' and 'credentials' (None when loaded from token_file).
+    """
+    mailboxes = []
+    if credentials_dir:
+        for file_name in sorted(os.listdir(credentials_dir)):
+            if file_name.endswith('.pickle'):
+                mailboxes.append({
+                    'user': file_name[:-len('.pickle')],
+                    'token_file': os.path.join(credentials_dir, file_name),
+                    'credentials': None,
+                })
+    if credentials_table:
+        with open(credentials_table, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                user = row['user']
+                credentials = None
+                if 'token_file' not in row:
+                    credentials = Credentials(
+                        token=row.get('token'),
+                        refresh_token=row['refresh_token'],
+                        token_uri=row.get('token_uri', TOKEN_URI),
+                        client_id=row.get('client_id', CLIENT_ID),
+                        client_secret=row.get('client_secret', CLIENT_SECRET),
+                        scopes=row.get('scopes', SCOPES),
+                    )
+                mailboxes.append({
+                    'user': user,
+                    # Refreshed credentials are saved next to the mailbox's data.
+                    'token_file': row.get('token_file') or f'{MAILBOXES_DATA_DIR}/{_safe_name(user)}/token.pickle',
+                    'credentials': credentials,
+                })
+
+    users = [mailbox['user'] for mailbox in mailboxes]
+    duplicates = {user for user in users if users.count(user) > 1}
+    if duplicates:
+        raise ValueError(f"Users listed more than once: {sorted(duplicates)}")
+    return mailboxes
+
+def scan_mailboxes(mailboxes, args, max_parallel_mailboxes=DEFAULT_MAX_PARALLEL_MAILBOXES):
+    """Scan mailboxes concurrently, each against its own MailboxContext.
+
+    At most max_parallel_mailboxes mailboxes are scanned at once, and each of them gets an equal
+    share of the global Gmail in-flight budgets as the upper bound of its adaptive limits, so a
+    throttled or slow mailbox only ever slows itself down. A mailbox that fails is reported and
+    doesn't stop the others.
+
+    Returns:
+        List of per-mailbox results: user, status, number of trips, seconds and error.
+    """
+    num_parallel = max(1, min(max_parallel_mailboxes, len(mailboxes)))
+    gmail_share = max(1, GMAIL_GLOBAL_MAX_IN_FLIGHT // num_parallel)
+    gmail_batch_share = max(1, GMAIL_BATCH_GLOBAL_MAX_IN_FLIGHT // num_parallel)
+    print(f"Scanning {len(mailboxes)} mailboxes, {num_parallel} at a time "
+          f"(up to {gmail_share} Gmail requests / {gmail_batch_share} batch calls in flight each).")
+
+    def scan_one(mailbox):
+        data_dir = f'{MAILBOXES_DATA_DIR}/{_safe_name(mailbox["user"])}'
+        context = MailboxContext(
+            _safe_name(mailbox['user']),
+            mailbox['token_file'],
+            data_dir,
+            CLIENT_ID,
+            CLIENT_SECRET,
+            SCOPES,
+            credentials=mailbox['credentials'],
+            interactive=False,
+            gmail_max_concurrency=gmail_share,
+            gmail_batch_max_concurrency=gmail_batch_share,
+        )
+        start = time.monotonic()
+        result = {'user': mailbox['user'], 'data_dir': data_dir}
+        try:
+            with use_mailbox(context):
+                trip_jsons = scan_mailbox(args)
+            save_to_jsonl(context.path('trips.jsonl'), trip_jsons or [])
+            result.update({'status': 'ok', 'num_trips': len(trip_jsons or [])})
+        except Exception as e:
+            print(f"Scanning the mailbox of {mailbox['user']} failed: {e}")
+            result.update({'status': 'failed', 'error': str(e)})
+        finally:
+            context.close()
+        result['seconds'] = round(time.monotonic() - start, 1)
+        result['gmail_concurrency'] = context.gmail_concurrency.report()
+        result['gmail_quota_units'] = context.gmail_quota.units_used
+        result['gmail_quota_throttled'] = context.gmail_quota.num_throttled
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_parallel) as executor:
+        return list(executor.map(scan_one, mailboxes))
+
+def parse_args():
+    parser = build_arg_parser(description='Scan many users\' Gmail mailboxes concurrently for hotel reservation emails.')
+    parser.add_argument('--credentials-dir',
+                        help='Directory of <user>.pickle Gmail token files, one per mailbox')
+    parser.add_argument('--credentials-table',
+                        help='JSONL file with one {"user", "token_file" or "refresh_token", ...} line per mailbox')
+    parser.add_argument('--max-parallel-mailboxes', type=int, default=DEFAULT_MAX_PARALLEL_MAILBOXES,
+                        help=f'Number of mailboxes scanned at the same time (default {DEFAULT_MAX_PARALLEL_MAILBOXES})')
+    args = parser.parse_args()
+    if not args.credentials_dir and not args.credentials_table:
+        parser.error('one of --credentials-dir or --credentials-table is required')
+    return args
+
+def main():
+    args = parse_args()
+    configure_llm_router(args)
+    mailboxes = load_mailbox_credentials(args.credentials_dir, args.credentials_table)
+    if not mailboxes:
+        print("No mailbox credentials found.")
+        return
+
+    results = scan_mailboxes(mailboxes, args, args.max_parallel_mailboxes)
+    save_to_jsonl(f'{MAILBOXES_DATA_DIR}/scan_results.jsonl', results)
+
+    print("\n=== Mailbox scan results ===\n")
+    for result in results:
+        limits = result['gmail_concurrency']
+        print(f"{result['user']}: {result['status']} in {result['seconds']:.1f}s"
+              + (f", {result['num_trips']} trips" if result['status'] == 'ok' else f" ({result['error']})")
+              + f", Gmail limit range {limits['min_limit_seen']}-{limits['max_limit_seen']}, "
+              f"{result['gmail_quota_units']} quota units, {result['gmail_quota_throttled']} throttled")
+
+    print_llm_cache_stats()
+    llm_router.print_report()
+    get_email_preclassifier().print_stats()
+    groq_concurrency.print_report()
+    metrics.print_summary()
+    if args.profile:
+        metrics.write_report(PROFILE_DIR)
+
+if __name__ == "__main__":
+    main()
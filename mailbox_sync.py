@@ -0,0 +1,80 @@
+import os
+import json
+import time
+
+from googleapiclient.http import HttpError
+
+# Look back a little before the last sync when bounding the search query, Gmail's after: operator
+# works on message dates which can lag behind the time the message was added to the mailbox.
+SYNC_QUERY_LOOKBACK_SECONDS = 24 * 60 * 60
+
+def load_sync_state(file_path):
+    """Load the per-mailbox sync checkpoints, keyed by mailbox email address."""
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def save_sync_checkpoint(file_path, mailbox, history_id, synced_at=None):
+    """Record the Gmail historyId a mailbox has been synced up to."""
+    sync_state = load_sync_state(file_path)
+    sync_state[mailbox] = {
+        'history_id': str(history_id),
+        'synced_at': int(synced_at if synced_at is not None else time.time()),
+    }
+
+    dirname = os.path.dirname(file_path)
+    if len(dirname.strip()) > 0:
+        os.makedirs(dirname, exist_ok=True)
+
+    tmp_file = f"{file_path}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(sync_state, f, indent=2)
+    os.replace(tmp_file, file_path)
+    print(f"Saved sync checkpoint for {mailbox} at historyId {history_id}")
+
+def get_mailbox_profile(service):
+    """Return the mailbox email address and its current historyId."""
+    profile = service.users().getProfile(userId='me').execute()
+    return profile['emailAddress'], profile['historyId']
+
+def list_added_message_ids(service, start_history_id):
+    """List IDs of messages added to the mailbox since start_history_id.
+
+    Returns:
+        Tuple (message IDs, latest historyId), or (None, None) if start_history_id is too old
+        for Gmail to still have the history (the API answers 404 in that case).
+    """
+    msg_ids = []
+    latest_history_id = start_history_id
+    next_page_token = None
+
+    try:
+        while True:
+            result = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=next_page_token,
+                maxResults=500
+            ).execute()
+
+            for history in result.get('history', []):
+                for message_added in history.get('messagesAdded', []):
+                    msg_ids.append(message_added['message']['id'])
+
+            latest_history_id = result.get('historyId', latest_history_id)
+            next_page_token = result.get('nextPageToken')
+            if not next_page_token:
+                break
+    except HttpError as error:
+        if getattr(error.resp, 'status', None) == 404:
+            print(f"History since {start_history_id} is no longer available, falling back to a date bounded search.")
+            return None, None
+        raise
+
+    return list(dict.fromkeys(msg_ids)), latest_history_id
+
+def sync_search_start(since_epoch_seconds):
+    """Earliest message date (epoch seconds) a sync since the given time searches from, with a safety margin."""
+    return max(0, int(since_epoch_seconds) - SYNC_QUERY_LOOKBACK_SECONDS)
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+# Upper bounds (seconds) of the latency histogram buckets, Prometheus style (+Inf is implicit).
+LATENCY_BUCKETS_SECONDS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+RSS_SAMPLE_INTERVAL_SECONDS = 0.1
+
+# USD per million input / output tokens, check https://groq.com/pricing and https://openai.com/api/pricing
+# for current prices. Token usage recorded under "<model> (batch)" is billed at the batch discount.
+MODEL_PRICES = {
+    "meta-llama/llama-4-scout-17b-16e-instruct": {"input": 0.11, "output": 0.34},
+    "meta-llama/llama-4-maverick-17b-128e-instruct": {"input": 0.20, "output": 0.60},
+    "o4-mini": {"input": 1.10, "output": 4.40},
+}
+DEFAULT_MODEL_PRICES = {"input": 0.20, "output": 0.60}
+BATCH_DISCOUNT = 0.5  # Batch jobs are billed at half the real-time price
+
+def current_rss_bytes():
+    """Resident set size of this process (peak RSS where the current one can't be read)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_SECONDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS_SECONDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile ('+Inf' past the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS_SECONDS, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return '+Inf'
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum_seconds': round(self.total, 3),
+            'mean_seconds': round(self.total / self.count, 3) if self.count else None,
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'p99_seconds': self.quantile(0.99),
+            'buckets': {
+                **{str(bound): count for bound, count in zip(LATENCY_BUCKETS_SECONDS, self.bucket_counts)},
+                '+Inf': self.bucket_counts[-1],
+            },
+        }
+
+
+class _StageHandle:
+    def __init__(self):
+        self.items_in = None
+        self.items_out = None
+
+    def set_items(self, items_in=None, items_out=None):
+        if items_in is not None:
+            self.items_in = items_in
+        if items_out is not None:
+            self.items_out = items_out
+
+
+class PipelineMetrics:
+    """Process-wide, thread-safe metrics of the email pipeline.
+
+    Collects per-stage wall time, throughput and peak RSS, latency histograms of external calls
+    (Gmail, Groq, OpenAI), event counters (retries, 429s, ...) and token usage per model.
+    Recording is always on and cheap; write_report() dumps a JSON report and a Prometheus text
+    snapshot so runs can be compared across code changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.latencies = {}
+        self.counters = {}
+        self.tokens = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage and sample its peak RSS. Yields a handle to set item counts on."""
+        handle = _StageHandle()
+        stop = threading.Event()
+        peak_rss = [current_rss_bytes()]
+
+        def sample_rss():
+            while not stop.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+                peak_rss[0] = max(peak_rss[0], current_rss_bytes())
+
+        sampler = threading.Thread(target=sample_rss, name=f"rss-{name}", daemon=True)
+        sampler.start()
+        start = time.monotonic()
+        try:
+            yield handle
+        finally:
+            wall_seconds = time.monotonic() - start
+            stop.set()
+            sampler.join()
+            peak_rss[0] = max(peak_rss[0], current_rss_bytes())
+            items = handle.items_out if handle.items_in is None else handle.items_in
+            with self._lock:
+                self.stages[name] = {
+                    'wall_seconds': round(wall_seconds, 3),
+                    'items_in': handle.items_in,
+                    'items_out': handle.items_out,
+                    'items_per_second': round(items / wall_seconds, 2) if items and wall_seconds > 0 else None,
+                    'peak_rss_mb': round(peak_rss[0] / (1024 * 1024), 1),
+                }
+
+    def observe_latency(self, call, seconds):
+        """Record the latency of one external call, e.g. observe_latency('groq', 1.2)."""
+        with self._lock:
+            self.latencies.setdefault(call, LatencyHistogram()).observe(seconds)
+
+    @contextmanager
+    def timed(self, call):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe_latency(call, time.monotonic() - start)
+
+    def increment(self, counter, amount=1):
+        """Count an event, e.g. increment('groq_retries') or increment('gmail_rate_limited')."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_tokens(self, model, input_tokens, output_tokens):
+        with self._lock:
+            usage = self.tokens.setdefault(model, {'calls': 0, 'input_tokens': 0, 'output_tokens': 0})
+            usage['calls'] += 1
+            usage['input_tokens'] += input_tokens or 0
+            usage['output_tokens'] += output_tokens or 0
+
+    def report(self):
+        with self._lock:
+            tokens = {}
+            for model, usage in self.tokens.items():
+                is_batch = model.endswith(' (batch)')
+                prices = MODEL_PRICES.get(model[:-len(' (batch)')] if is_batch else model, DEFAULT_MODEL_PRICES)
+                cost = (usage['input_tokens'] * prices['input'] + usage['output_tokens'] * prices['output']) / 1_000_000
+                cost *= (1 - BATCH_DISCOUNT) if is_batch else 1
+                tokens[model] = {**usage, 'estimated_cost_usd': round(cost, 4)}
+            return {
+                'started_at': int(self.started_at),
+                'wall_seconds': round(time.time() - self.started_at, 3),
+                'stages': dict(self.stages),
+                'latencies': {call: histogram.to_dict() for call, histogram in self.latencies.items()},
+                'counters': dict(self.counters),
+                'tokens': tokens,
+                'estimated_cost_usd': round(sum(usage['estimated_cost_usd'] for usage in tokens.values()), 4),
+            }
+
+    def prometheus_text(self):
+        """Snapshot of the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric('email_pipeline_stage_wall_seconds', 'gauge', 'Wall time of each pipeline stage.',
+               [({'stage': stage}, values['wall_seconds']) for stage, values in report['stages'].items()])
+        metric('email_pipeline_stage_items', 'gauge', 'Items into and out of each pipeline stage.',
+               [({'stage': stage, 'direction': direction}, values[f'items_{direction}'])
+                for stage, values in report['stages'].items() for direction in ('in', 'out')
+                if values[f'items_{direction}'] is not None])
+        metric('email_pipeline_stage_peak_rss_bytes', 'gauge', 'Peak resident set size during each pipeline stage.',
+               [({'stage': stage}, int(values['peak_rss_mb'] * 1024 * 1024)) for stage, values in report['stages'].items()])
+
+        lines.append("# HELP email_pipeline_call_latency_seconds Latency of external calls.")
+        lines.append("# TYPE email_pipeline_call_latency_seconds histogram")
+        for call, histogram in report['latencies'].items():
+            cumulative = 0
+            for bound, bucket_count in histogram['buckets'].items():
+                cumulative += bucket_count
+                lines.append(f'email_pipeline_call_latency_seconds_bucket{{call="{call}",le="{bound}"}} {cumulative}')
+            lines.append(f'email_pipeline_call_latency_seconds_count{{call="{call}"}} {histogram["count"]}')
+            lines.append(f'email_pipeline_call_latency_seconds_sum{{call="{call}"}} {histogram["sum_seconds"]}')
+
+        metric('email_pipeline_events_total', 'counter', 'Retries, rate limited responses and other events.',
+               [({'event': counter}, value) for counter, value in report['counters'].items()])
+        metric('email_pipeline_tokens_total', 'counter', 'LLM tokens per model.',
+               [({'model': model, 'kind': kind}, usage[f'{kind}_tokens']) for model, usage in report['tokens'].items() for kind in ('input', 'output')])
+        metric('email_pipeline_estimated_cost_usd', 'gauge', 'Estimated LLM cost per model.',
+               [({'model': model}, usage['estimated_cost_usd']) for model, usage in report['tokens'].items()])
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, output_dir):
+        """Write profile_<timestamp>.json and profile_<timestamp>.prom to output_dir, returns the JSON path."""
+        os.makedirs(output_dir, exist_ok=True)
+        base_path = os.path.join(output_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}")
+        with open(f"{base_path}.json", 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        with open(f"{base_path}.prom", 'w') as f:
+            f.write(self.prometheus_text())
+        print(f"Wrote profile report to {base_path}.json and {base_path}.prom")
+        return f"{base_path}.json"
+
+    def print_summary(self):
+        report = self.report()
+        for stage, values in report['stages'].items():
+            print(f"Stage {stage}: {values['wall_seconds']:.1f}s, {values['items_in']} in / {values['items_out']} out, "
+                  f"{values['items_per_second']} items/s, peak RSS {values['peak_rss_mb']} MB")
+        for call, histogram in report['latencies'].items():
+            print(f"Calls {call}: {histogram['count']} calls, p50 <= {histogram['p50_seconds']}s, p95 <= {histogram['p95_seconds']}s")
+        if report['counters']:
+            print(f"Events: {report['counters']}")
+        for model, usage in report['tokens'].items():
+            print(f"Tokens {model}: {usage['input_tokens']} in / {usage['output_tokens']} out over {usage['calls']} calls, ~${usage['estimated_cost_usd']:.4f}")
+
+
+# Shared by every module of the pipeline.
+metrics = PipelineMetrics()
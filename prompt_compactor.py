@@ -0,0 +1,122 @@
+import re
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken missing (or its encoding files unavailable offline): fall back to ~4 chars per token.
+    _ENCODING = None
+
+# Email fields worth showing the LLM, in display order. 'Unknown ...' placeholders are dropped.
+PROMPT_EMAIL_FIELDS = [
+    ('subject', 'Subject'),
+    ('sender', 'From'),
+    ('recipient', 'To'),
+    ('date', 'Date'),
+]
+
+# Phrases that mark the reservation details we want the LLM to see.
+RELEVANT_PATTERNS = [
+    r'confirmation\s*(?:number|no\.?|#|code)',
+    r'(?:reservation|booking|itinerary)\s*(?:number|no\.?|#|code|id|reference)',
+    r'check[\s-]?in', r'check[\s-]?out', r'arriv(?:al|e|ing)', r'depart(?:ure|ing)?',
+    r'\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b',
+    r'\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\b',
+    r'\b\d{1,4}[/-]\d{1,2}[/-]\d{2,4}\b',
+    r'\b(?:room|suite|king|queen|double|twin|bed|villa|view)\b',
+    r'[$€£¥]\s?\d', r'\b(?:usd|eur|gbp|total|rate|per night|taxes|deposit|amount)\b',
+    r'\b(?:guests?|adults?|child(?:ren)?|infants?|nights?)\b',
+    r'\b(?:member|membership|loyalty|bonvoy|honors|world of hyatt|elite|platinum|gold|points)\b',
+    r'\b(?:visa|mastercard|amex|american express|card ending|paid|payment)\b',
+    r'\b(?:hotel|resort|inn|lodge)\b',
+]
+_RELEVANT_RE = re.compile('|'.join(RELEVANT_PATTERNS), re.IGNORECASE)
+
+# Phrases that mark legal / marketing boilerplate.
+BOILERPLATE_PATTERNS = [
+    r'unsubscribe', r'privacy (?:policy|statement|notice)', r'terms (?:and|&) conditions', r'terms of (?:use|service)',
+    r'all rights reserved', r'©|&copy;|\(c\) \d{4}', r'view (?:this email )?in (?:your )?browser',
+    r'this (?:e-?mail|message) was sent to', r'do not reply', r'no-?reply', r'manage (?:your )?(?:email )?preferences',
+    r'download (?:our|the) app', r'follow us', r'add us to your address book', r'you are receiving this',
+    r'if you (?:no longer|do not) wish', r'confidential(?:ity)? notice', r'intended (?:only )?for the (?:named )?recipient',
+]
+_BOILERPLATE_RE = re.compile('|'.join(BOILERPLATE_PATTERNS), re.IGNORECASE)
+
+_SEGMENT_SPLIT_RE = re.compile(r'(?<=[.!?|])\s+|\s{2,}|\n+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def count_tokens(text):
+    """Token count with a local tokenizer (tiktoken when installed, else a ~4 chars / token estimate)."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ''
+    if _ENCODING is not None:
+        tokens = _ENCODING.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _ENCODING.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+def compact_body(body, max_tokens):
+    """Shrink an email body to max_tokens, keeping the reservation relevant region.
+
+    The body is split into segments (sentences / visual blocks). Boilerplate segments are
+    dropped, then segments matching reservation details (confirmation number, dates, room,
+    price, ...) are kept together with their immediate neighbours for context. If budget remains,
+    the remaining segments are added in document order. The result keeps the original order.
+    """
+    body = _WHITESPACE_RE.sub(' ', body or '').strip()
+    if count_tokens(body) <= max_tokens:
+        return body
+
+    segments = [segment.strip() for segment in _SEGMENT_SPLIT_RE.split(body)]
+    segments = [segment for segment in segments if segment and not _BOILERPLATE_RE.search(segment)]
+
+    relevant = [i for i, segment in enumerate(segments) if _RELEVANT_RE.search(segment)]
+    priority = []
+    for i in relevant:
+        priority.extend(j for j in (i, i - 1, i + 1) if 0 <= j < len(segments))
+    priority.extend(range(len(segments)))
+
+    selected = set()
+    used_tokens = 0
+    for i in dict.fromkeys(priority):
+        segment_tokens = count_tokens(segments[i]) + 1
+        if used_tokens + segment_tokens > max_tokens:
+            continue
+        selected.add(i)
+        used_tokens += segment_tokens
+
+    compacted = ' '.join(segments[i] for i in sorted(selected))
+    if not compacted and segments:
+        # Every segment alone is over budget (e.g. one huge unpunctuated block): hard truncate.
+        compacted = truncate_to_tokens(segments[relevant[0] if relevant else 0], max_tokens)
+    return compacted
+
+def compact_email_for_prompt(email_metadata, max_tokens):
+    """Render an email as compact 'Field: value' lines fitting max_tokens, body compacted last."""
+    lines = []
+    for key, label in PROMPT_EMAIL_FIELDS:
+        value = email_metadata.get(key)
+        if value and not str(value).startswith('Unknown'):
+            lines.append(f"{label}: {value}")
+    header_text = '\n'.join(lines)
+
+    body = email_metadata.get('body')
+    if not body or body == "Unknown body":
+        return truncate_to_tokens(header_text, max_tokens)
+
+    body_budget = max_tokens - count_tokens(header_text) - count_tokens("\nBody: ")
+    if body_budget <= 0:
+        return truncate_to_tokens(header_text, max_tokens)
+    return f"{header_text}\nBody: {compact_body(body, body_budget)}"
+
+def fit_prompt(template, email_metadata, max_tokens, placeholder='{email}'):
+    """Fill `placeholder` in template with the compacted email so the whole prompt fits max_tokens."""
+    instructions_tokens = count_tokens(template.replace(placeholder, ''))
+    email_text = compact_email_for_prompt(email_metadata, max(64, max_tokens - instructions_tokens))
+    return template.replace(placeholder, email_text)
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    The bucket holds up to `capacity` tokens and refills at `refill_per_second`. Callers reserve
+    tokens up front and get back how long they must wait before using them; the balance may go
+    negative, which queues later callers behind earlier ones instead of letting them race.
+    Works for both threads (time.sleep the returned delay) and asyncio (await asyncio.sleep).
+    """
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount_per_minute):
+        return cls(amount_per_minute, amount_per_minute / 60.0)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def reserve(self, amount=1.0):
+        """Take `amount` tokens and return the number of seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Never ask for more than the bucket can ever hold, or the caller would wait forever.
+            self._tokens -= min(float(amount), self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def set_rate(self, refill_per_second):
+        """Change the refill rate from now on.
+
+        Tokens accrued until now are counted at the old rate first, so the change isn't
+        applied retroactively to the time since the last refill.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.refill_per_second = float(refill_per_second)
+
+    def acquire(self, amount=1.0):
+        """Blocking version of reserve() for threads."""
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
@@ -0,0 +1,160 @@
+import os
+import json
+import datetime
+from collections import Counter, defaultdict
+
+from key_insights_schema import KEY_INSIGHTS_FIELDS
+
+# Columns of the table: the email ID followed by the key insights schema fields.
+RESERVATION_COLUMNS = ['id'] + list(KEY_INSIGHTS_FIELDS)
+
+# Reservations in the same city at most this many days apart (check-out to next check-in) are counted as one trip.
+TRIP_GAP_DAYS = 1
+
+
+class ReservationTable:
+    """Columnar table of structured hotel reservations (one list per column).
+
+    Duplicate emails for the same reservation (confirmation, modification, reminder) are
+    collapsed on (hotel, check-in, check-out). Aggregations run over whole columns locally, so
+    counting trips, nights and spend no longer costs an LLM call.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = {name: list((columns or {}).get(name, [])) for name in RESERVATION_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @classmethod
+    def from_key_insights(cls, hotel_reservation_key_insights):
+        """Build the table from key insights stage records ({..., 'key_insights': dict})."""
+        table = cls()
+        seen = set()
+        for record in hotel_reservation_key_insights:
+            key_insights = record.get('key_insights')
+            if not isinstance(key_insights, dict):
+                continue  # Free-text key insights from an older run
+            reservation_key = (
+                (key_insights.get('hotel') or '').lower(),
+                key_insights.get('check_in'),
+                key_insights.get('check_out'),
+            )
+            if reservation_key[1] and reservation_key in seen:
+                continue
+            seen.add(reservation_key)
+            table.columns['id'].append(record['id'])
+            for name in KEY_INSIGHTS_FIELDS:
+                table.columns[name].append(key_insights.get(name))
+        return table
+
+    def save(self, file_path):
+        dirname = os.path.dirname(file_path)
+        if len(dirname.strip()) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_file = f"{file_path}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'num_rows': len(self), 'columns': self.columns}, f)
+        os.replace(tmp_file, file_path)
+        print(f"Saved {len(self)} reservations to {file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r') as f:
+            return cls(json.load(f)['columns'])
+
+    def rows(self):
+        """Return the table as a list of compact row dicts (None fields omitted)."""
+        return [
+            {name: values[i] for name, values in self.columns.items() if values[i] is not None}
+            for i in range(len(self))
+        ]
+
+    def nights(self):
+        """Column of nights per reservation (None when a date is missing)."""
+        return [
+            (datetime.date.fromisoformat(check_out) - datetime.date.fromisoformat(check_in)).days
+            if check_in and check_out else None
+            for check_in, check_out in zip(self.columns['check_in'], self.columns['check_out'])
+        ]
+
+    def _destinations(self):
+        return [
+            city or hotel or 'Unknown'
+            for city, hotel in zip(self.columns['city'], self.columns['hotel'])
+        ]
+
+    def trips_by_destination(self):
+        """Group reservations into trips: same destination, stays at most TRIP_GAP_DAYS apart.
+
+        Returns:
+            Dict destination -> list of trips, each trip a dict with check_in, check_out and row indices.
+        """
+        stays_by_destination = defaultdict(list)
+        for i, (destination, check_in) in enumerate(zip(self._destinations(), self.columns['check_in'])):
+            stays_by_destination[destination].append((check_in or '', i))
+
+        trips_by_destination = {}
+        for destination, stays in stays_by_destination.items():
+            trips = []
+            for check_in, i in sorted(stays):
+                check_out = self.columns['check_out'][i] or check_in
+                last = trips[-1] if trips else None
+                if (last and check_in and last['check_out']
+                        and (datetime.date.fromisoformat(check_in) - datetime.date.fromisoformat(last['check_out'])).days <= TRIP_GAP_DAYS):
+                    last['check_out'] = max(last['check_out'], check_out)
+                    last['rows'].append(i)
+                else:
+                    trips.append({'check_in': check_in or None, 'check_out': check_out or None, 'rows': [i]})
+            trips_by_destination[destination] = trips
+        return trips_by_destination
+
+    def summary(self, top_n=15):
+        """Compact aggregate of the reservations, small enough to send to an LLM instead of the emails.
+
+        Args:
+            top_n: Number of destinations (by nights, then trips) and values per category to keep.
+        """
+        nights = self.nights()
+        destinations = self._destinations()
+        trips_by_destination = self.trips_by_destination()
+
+        by_destination = {}
+        for destination, trips in trips_by_destination.items():
+            rows = [i for trip in trips for i in trip['rows']]
+            spend = Counter()
+            for i in rows:
+                if self.columns['total_price'][i] is not None:
+                    spend[self.columns['currency'][i] or 'Unknown currency'] += self.columns['total_price'][i]
+            guests = [self.columns['guests'][i] for i in rows if self.columns['guests'][i]]
+            by_destination[destination] = {
+                'country': next((self.columns['country'][i] for i in rows if self.columns['country'][i]), None),
+                'trips': len(trips),
+                'reservations': len(rows),
+                'nights': sum(nights[i] or 0 for i in rows),
+                'spend': {currency: round(amount, 2) for currency, amount in spend.items()},
+                'avg_guests': round(sum(guests) / len(guests), 1) if guests else None,
+                'months': sorted({trip['check_in'][5:7] for trip in trips if trip['check_in']}),
+                'hotels': [hotel for hotel, _ in Counter(self.columns['hotel'][i] for i in rows if self.columns['hotel'][i]).most_common(3)],
+                'room_types': [room for room, _ in Counter(self.columns['room_type'][i] for i in rows if self.columns['room_type'][i]).most_common(3)],
+            }
+        top_destinations = sorted(by_destination, key=lambda d: (by_destination[d]['nights'], by_destination[d]['trips']), reverse=True)[:top_n]
+
+        def top_values(column):
+            return dict(Counter(value for value in self.columns[column] if value).most_common(top_n))
+
+        total_spend = Counter()
+        for amount, currency in zip(self.columns['total_price'], self.columns['currency']):
+            if amount is not None:
+                total_spend[currency or 'Unknown currency'] += amount
+        return {
+            'reservations': len(self),
+            'trips': sum(len(trips) for trips in trips_by_destination.values()),
+            'nights': sum(n or 0 for n in nights),
+            'destinations': len(set(destinations)),
+            'total_spend': {currency: round(amount, 2) for currency, amount in total_spend.items()},
+            'by_destination': {destination: by_destination[destination] for destination in top_destinations},
+            'loyalty_tiers': top_values('loyalty_tier'),
+            'payment_methods': top_values('payment_method'),
+            'hotels': top_values('hotel'),
+        }
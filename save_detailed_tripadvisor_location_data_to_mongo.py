@@ -16,6 +16,8 @@ import argparse
 import time
 from dotenv import load_dotenv
 
+from hotel_collection_stats import mark_collection_ingested
+
 parser = argparse.ArgumentParser(description='Get detailed location data from TripAdvisor API files and load it into MongoDB.')
 parser.add_argument('--type', choices=['hotel_review', 'restaurant_review'], required=True,
                     help='Type of location IDs to load (exactly one)')
@@ -117,4 +119,6 @@ for location_id in location_ids:
   )
   print(f"Result for location_id {location_id}: {result}\n")
 
+# Lets running hotel search services drop their cached collection stats
+mark_collection_ingested(db, collection_name)
 client.close()
@@ -1,21 +1,17 @@
 import os
-import pickle
-import base64
 import json
-import re
 import datetime
-from html import unescape
+import argparse
+import random
 from dotenv import load_dotenv
 from threading import Lock
 import concurrent.futures
 
+import math
 import time
-import tempfile
 from typing import List, Dict, Any, Optional
+from email.utils import parsedate_to_datetime
 
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from googleapiclient.http import HttpError
 
 from langchain_openai import ChatOpenAI
@@ -23,6 +19,30 @@ from langchain_core.prompts import ChatPromptTemplate
 
 from groq import Groq
 
+from prompt_compactor import fit_prompt
+from email_preclassifier import EmailPreclassifier
+from email_body_extractor import extract_body_text, extract_body_texts, select_text_parts, iter_parts
+from concurrency_controller import AIMDConcurrencyController
+from mailbox_context import MailboxContext, current_mailbox, set_default_mailbox, bind_mailbox
+from llm_cache import get_llm_cache, invoke_chain_cached, print_llm_cache_stats
+from groq_async_inference import GROQ_SAMPLING_PARAMS, reserve_groq_quota
+from groq_batch_engine import run_groq_batch
+from llm_router import LLMRouter, LLM_ROUTER_MODES
+from email_pipeline import PipelineStage, run_streaming_pipeline
+from stage_journal import IncompleteStageError, StageJournal, run_journaled_stage
+from key_insights_schema import KEY_INSIGHTS_JSON_EXAMPLE, parse_key_insights, key_insights_repair_prompt
+from reservation_table import ReservationTable
+from email_dedup import collapse_duplicate_emails, MAX_DEDUP_TEXT_CHARS
+from gmail_query_shards import build_query_shards, or_query, DEFAULT_SHARD_DAYS
+from pipeline_metrics import metrics
+from mailbox_sync import (
+    load_sync_state,
+    save_sync_checkpoint,
+    get_mailbox_profile,
+    list_added_message_ids,
+    sync_search_start,
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -31,7 +51,21 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 CLIENT_ID = os.getenv('GOOGLE_CLOUD_GMAIL_CLIENT_ID')
 CLIENT_SECRET = os.getenv('GOOGLE_CLOUD_GMAIL_CLIENT_SECRET')
 TOKEN_FILE = 'token.pickle'
+EMAIL_DATA_DIR = './email_data/v0'
 MAX_CONCURRENCY = 10
+GMAIL_BATCH_SIZE = 100  # Gmail batch endpoint accepts at most 100 sub-requests per multipart call
+GMAIL_BATCH_MAX_RETRIES = 5
+GMAIL_BACKOFF_BASE_SECONDS = 1.0
+GMAIL_BACKOFF_MAX_SECONDS = 32.0
+GMAIL_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+GMAIL_LIST_MAX_WORKERS = 16  # search shards listed at the same time
+
+# Adaptive (AIMD) limit on in-flight Groq requests, shared by every inference call in the process.
+# Gmail limits are per mailbox (Gmail quotas are per user), see MailboxContext.
+groq_concurrency = AIMDConcurrencyController('groq', initial_limit=MAX_CONCURRENCY, max_limit=64, latency_threshold=30.0)
+
+# Picks real-time vs Groq Batch API for each LLM stage, configured from the command line in main().
+llm_router = LLMRouter()
 
 def load_jsonl(file_path):
     with open(file_path, 'r') as f:
@@ -50,53 +84,17 @@ def save_to_jsonl(file_path, a_list):
 
     print(f"Saved {len(a_list)} records to {file_path}")
 
+# The mailbox of token.pickle, used unless another one is selected with mailbox_context.use_mailbox().
+default_mailbox = MailboxContext('default', TOKEN_FILE, EMAIL_DATA_DIR, CLIENT_ID, CLIENT_SECRET, SCOPES)
+set_default_mailbox(default_mailbox)
+
 def get_gmail_service():
-    """Get authenticated Gmail service."""
-    creds = None
-    
-    # Check if token file exists
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    def get_new_credentials():
-        # Create flow instance with client ID and secret
-        flow = InstalledAppFlow.from_client_config(
-            {
-                "installed": {
-                    "client_id": CLIENT_ID,
-                    "client_secret": CLIENT_SECRET,
-                    "redirect_uris": ["http://localhost", "urn:ietf:wg:oauth:2.0:oob"],
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token"
-                }
-            },
-            SCOPES
-        )
-        # Open browser for user authentication
-        creds = flow.run_local_server(port=8080)
-        return creds
+    """Get authenticated Gmail service of the current mailbox for the calling thread.
 
-    
-    # If credentials don't exist or are invalid, get new ones
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e:
-                print(f"Error refreshing credentials (asking user to re-authenticate): {e}")
-                creds = get_new_credentials()
-        else:
-            creds = get_new_credentials()
-        
-        print(f"creds: {creds}")
-        
-        # Save credentials for next run
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    # Build and return Gmail service
-    return build('gmail', 'v1', credentials=creds)
+    Clients come from the mailbox's pool: one client per thread, one set of credentials refreshed
+    under a lock, and a discovery document fetched only once per mailbox.
+    """
+    return current_mailbox().get_gmail_service()
 
 def search_emails(service, query, max_results=500):
     """Search for emails matching the query.
@@ -114,15 +112,12 @@ def search_emails(service, query, max_results=500):
         messages = []
         next_page_token = None
         
+        mailbox = current_mailbox()
         # Keep fetching pages until all results are retrieved or max_results is reached
         while True:
-            # Request a page of results
-            result = service.users().messages().list(
-                userId='me',
-                q=query,
-                pageToken=next_page_token,
-                maxResults=min(max_results - len(messages), 100)  # Gmail API allows max 100 per request
-            ).execute()
+            # Request a page of results (paced by the mailbox's quota, retried on throttling)
+            result = list_messages_page(mailbox, service, query, next_page_token,
+                                        min(max_results - len(messages), 100))  # Gmail API allows max 100 per request
             
             # Get messages from this page
             page_messages = result.get('messages', [])
@@ -149,48 +144,329 @@ def search_emails(service, query, max_results=500):
         print(f"An error occurred: {error}")
         return []
 
-def get_email_metadatas_batch(msg_ids):
-    """Get email metadata for multiple message IDs in a batch request."""
+def list_messages_page(mailbox, service, query, page_token=None, page_size=100, max_retries=GMAIL_BATCH_MAX_RETRIES):
+    """One messages().list() call paced by the mailbox's quota and concurrency limits, retried on throttling / 5xx."""
+    for attempt in range(max_retries + 1):
+        mailbox.gmail_quota.acquire('messages.list')
+        with mailbox.gmail_concurrency.slot() as slot:
+            try:
+                with metrics.timed('gmail_list'):
+                    return service.users().messages().list(
+                        userId='me',
+                        q=query,
+                        pageToken=page_token,
+                        maxResults=page_size
+                    ).execute()
+            except HttpError as error:
+                if not is_retryable_gmail_error(error) or attempt == max_retries:
+                    raise
+                record_gmail_throttling(mailbox, error)
+                slot.mark_throttled()
+        metrics.increment('gmail_retries')
+        time.sleep(random.uniform(0, min(GMAIL_BACKOFF_MAX_SECONDS, GMAIL_BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+def search_emails_sharded(keywords, max_results=500, shard_days=DEFAULT_SHARD_DAYS, num_keyword_groups=1, max_workers=GMAIL_LIST_MAX_WORKERS, since_epoch_seconds=None):
+    """Search for emails matching any of the keyword phrases, listing date / keyword shards concurrently.
+
+    Paging through one query is sequential (each page needs the previous page's token), and Gmail
+    is slow to evaluate the OR of many phrases. Instead the search is cut into after:/before:
+    windows of shard_days (times num_keyword_groups groups of phrases) that are listed in
+    parallel. A bounded window whose first page isn't the last one is split into about a page worth
+    of sub-windows each (by Gmail's result size estimate) rather than paged through, so busy
+    periods end up in many small shards listed at once. Message IDs of all
+    shards are merged newest window first and deduplicated.
+
+    Args:
+        keywords: Phrases to search for, OR-ed together.
+        max_results: Maximum number of results to return (default 500)
+        shard_days: Length of the initial date windows.
+        num_keyword_groups: Number of groups the phrases are split into, each searched on its own.
+        max_workers: Number of shards listed at the same time.
+        since_epoch_seconds: Only list messages dated from this time on (all time when None).
+
+    Returns:
+        List of messages (dicts with 'id' and 'threadId') that match the criteria
+    """
+    mailbox = current_mailbox()
+    shards = build_query_shards(keywords, shard_days=shard_days, num_keyword_groups=num_keyword_groups, start_time=since_epoch_seconds)
+    print(f"Listing {len(shards)} search shards ({num_keyword_groups} keyword groups, {shard_days} day windows)...")
+
+    def list_shard(shard):
+        """Returns (messages, None), or (None, sub-shards) when the shard should be split instead."""
+        service = mailbox.get_gmail_service()
+        messages = []
+        page_token = None
+        while True:
+            result = list_messages_page(mailbox, service, shard.query(), page_token, min(max_results - len(messages), 100))
+            messages.extend(result.get('messages', []))
+            page_token = result.get('nextPageToken')
+            if not page_token or len(messages) >= max_results:
+                return messages, None
+            if len(messages) <= 100 and shard.can_split():
+                # Aim for sub-windows of about a page each, going by Gmail's (rough) estimate of the matches.
+                return None, shard.split(math.ceil(result.get('resultSizeEstimate', 0) / 100))
+
+    shard_messages = []
+    num_listed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(list_shard, shard): shard for shard in shards}
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                shard = futures.pop(future)
+                messages, sub_shards = future.result()
+                if sub_shards:
+                    futures.update({executor.submit(list_shard, sub_shard): sub_shard for sub_shard in sub_shards})
+                    continue
+                num_listed += 1
+                if messages:
+                    shard_messages.append((shard, messages))
+                    print(f"Retrieved {len(messages)} emails from {shard.describe()} ({num_listed} shards listed, {len(futures)} pending)...")
+
     results = []
+    seen_ids = set()
+    for shard, messages in sorted(shard_messages, key=lambda item: item[0].sort_key()):
+        for message in messages:
+            if message['id'] not in seen_ids:
+                seen_ids.add(message['id'])
+                results.append(message)
+    print(f"Listed {num_listed} shards: {len(results)} distinct emails.")
+    if len(results) > max_results:
+        print(f"Reached maximum of {max_results} results")
+    return results[:max_results]
+
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date', 'Reply-To', 'CC', 'BCC', 'In-Reply-To']
+
+def extract_email_metadata(msg_id, response):
+    """Extract the header fields we keep for an email from a Gmail messages().get() response."""
+    headers = response['payload']['headers']
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+    recipient = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
+    reply_to = next((h['value'] for h in headers if h['name'] == 'Reply-To'), 'Unknown Reply-To')
+    cc = next((h['value'] for h in headers if h['name'] == 'CC'), 'Unknown CC')
+    bcc = next((h['value'] for h in headers if h['name'] == 'BCC'), 'Unknown BCC')
+    in_reply_to = next((h['value'] for h in headers if h['name'] == 'In-Reply-To'), 'Unknown In-Reply-To')
+
+    return {
+        'id': msg_id,
+        'subject': subject,
+        'date': date,
+        'sender': sender,
+        'recipient': recipient,
+        'reply_to': reply_to,
+        'cc': cc,
+        'bcc': bcc,
+        'in_reply_to': in_reply_to,
+        'snippet': response.get('snippet', ''),
+    }
+
+def extract_full_email(msg_id, response):
+    """Extract the header fields and decoded text body from a format='full' Gmail response."""
+    body = extract_body_text(response['payload'])
+    body = body if body else "Unknown body"
+    return {
+        **extract_email_metadata(msg_id, response),
+        'body': body,
+    }
+
+def extract_full_emails(msg_ids_and_responses):
+    """Like extract_full_email for a whole batch, decoding bodies on a process pool when it is large."""
+    body_texts = extract_body_texts([response['payload'] for _, response in msg_ids_and_responses])
+    return [
+        {
+            **extract_email_metadata(msg_id, response),
+            'body': body if body else "Unknown body",
+        }
+        for (msg_id, response), body in zip(msg_ids_and_responses, body_texts)
+    ]
+
+def is_rate_limited_gmail_error(error):
+    status = getattr(error.resp, 'status', None)
+    # Gmail reports per-user rate limits as 403s with a rateLimitExceeded / userRateLimitExceeded reason.
+    return status == 429 or (status == 403 and 'ratelimitexceeded' in str(error).lower())
+
+def is_retryable_gmail_error(error):
+    """Whether a Gmail HttpError is a throttling or transient server error worth retrying."""
+    return getattr(error.resp, 'status', None) in GMAIL_RETRYABLE_STATUSES or is_rate_limited_gmail_error(error)
+
+def record_gmail_throttling(mailbox, error, num_requests=1):
+    """Slow down the mailbox's quota scheduler on a rate limited response and count it in the metrics."""
+    if is_rate_limited_gmail_error(error):
+        mailbox.gmail_quota.on_throttled()
+        metrics.increment('gmail_rate_limited', num_requests)
+
+def plan_gmail_calls(mailbox, method, count):
+    """Announce Gmail calls to the mailbox's quota scheduler, returns (and prints) their projected completion time."""
+    completion_time = mailbox.gmail_quota.plan(method, count)
+    print(f"Queued {count} Gmail {method} calls, projected to complete in {completion_time - time.time():.0f}s "
+          f"at {mailbox.gmail_quota.units_per_second:.0f} quota units/s.")
+    return completion_time
+
+def fetch_emails_with_batch_api(msg_ids, build_request, parse_response, batch_size=GMAIL_BATCH_SIZE, max_retries=GMAIL_BATCH_MAX_RETRIES, on_results=None, quota_method='messages.get', on_failures=None):
+    """Fetch messages through the Gmail batch endpoint.
+
+    Each multipart call carries up to batch_size sub-requests, and several calls run at once
+    under the mailbox's adaptive gmail_batch_concurrency limit, paced by the quota units of their
+    sub-requests (see GmailQuotaScheduler). Sub-requests that fail with a retryable
+    error (429, 5xx, rate limit 403s) go to a retry queue which is replayed with jittered
+    exponential backoff, other failures are logged and dropped.
+
+    Args:
+        msg_ids: Gmail message IDs to fetch.
+        build_request: Function (service, msg_id) -> HttpRequest for a single message.
+        parse_response: Function (msg_id, response) -> record for a single message.
+        batch_size: Maximum number of sub-requests per batch call (Gmail allows at most 100).
+        max_retries: Number of times the retry queue is replayed before giving up.
+        on_results: Optional function called with the list of parsed records of each batch call
+            as soon as it completes (e.g. to journal them).
+        quota_method: Gmail method of the sub-requests, for their quota cost.
+        on_failures: Optional function called with the IDs of the messages of each batch call
+            that failed for good (non-retryable error or unparsable response), which retrying
+            wouldn't fix.
+
+    Returns:
+        List of parsed records in the same order as msg_ids (failed messages are omitted).
+    """
+    batch_size = max(1, min(batch_size, GMAIL_BATCH_SIZE))
+    msg_ids = list(dict.fromkeys(msg_ids))  # Sub-request IDs must be unique within a batch
+    mailbox = current_mailbox()  # Captured here, the chunks run on worker threads
+    plan_gmail_calls(mailbox, quota_method, len(msg_ids))
+    results = {}
     results_lock = Lock()
-    
-    def fetch_single_message(msg_id, idx, len_emails):
-        """Process a single message and return its metadata."""
-        try:
-            service = get_gmail_service()
+    pending = msg_ids
+    attempt = 0
+
+    while pending:
+        retry_queue = []
+
+        def execute_chunk(chunk):
+            chunk_results = {}
+            chunk_retries = []
+            chunk_failures = []
+
+            def handle_response(request_id, response, exception):
+                if exception is None:
+                    try:
+                        chunk_results[request_id] = parse_response(request_id, response)
+                    except Exception as exc:
+                        print(f"Error parsing message {request_id}: {exc}")
+                        chunk_failures.append(request_id)
+                elif isinstance(exception, HttpError) and is_retryable_gmail_error(exception):
+                    record_gmail_throttling(mailbox, exception)
+                    chunk_retries.append(request_id)
+                else:
+                    print(f"Error fetching message {request_id}: {exception}")
+                    chunk_failures.append(request_id)
+
+            # Wait for quota before taking a slot, so the wait doesn't count as request latency.
+            mailbox.gmail_quota.acquire(quota_method, len(chunk))
+            with mailbox.gmail_batch_concurrency.slot() as slot:
+                service = mailbox.get_gmail_service()
+                batch = service.new_batch_http_request(callback=handle_response)
+                for msg_id in chunk:
+                    batch.add(build_request(service, msg_id), request_id=msg_id)
+                try:
+                    with metrics.timed('gmail_batch'):
+                        batch.execute()
+                except HttpError as error:
+                    # The whole multipart call failed, none of its callbacks ran.
+                    if is_retryable_gmail_error(error):
+                        record_gmail_throttling(mailbox, error, len(chunk))
+                        chunk_retries = list(chunk)
+                    else:
+                        print(f"Error executing batch of {len(chunk)} messages: {error}")
+                if chunk_retries:
+                    metrics.increment('gmail_retries', len(chunk_retries))
+                    slot.mark_throttled()
+
+            with results_lock:
+                results.update(chunk_results)
+                retry_queue.extend(chunk_retries)
+                print(f"Fetched {len(results)} / {len(msg_ids)} emails ({len(retry_queue)} queued for retry)...")
+            if on_results and chunk_results:
+                on_results(list(chunk_results.values()))
+            if on_failures and chunk_failures:
+                on_failures(chunk_failures)
+
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=mailbox.gmail_batch_concurrency.max_limit) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(execute_chunk, chunk) for chunk in chunks]):
+                try:
+                    future.result()
+                except Exception as exc:
+                    print(f"Batch generated an exception: {exc}")
+
+        if not retry_queue:
+            break
+        if attempt >= max_retries:
+            print(f"Giving up on {len(retry_queue)} messages after {max_retries} retries: {retry_queue[:10]}...")
+            break
 
-            response = service.users().messages().get(
+        delay = min(GMAIL_BACKOFF_MAX_SECONDS, GMAIL_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        attempt += 1
+        print(f"Retrying {len(retry_queue)} messages in {delay:.1f}s (attempt {attempt} / {max_retries})...")
+        time.sleep(delay)
+        pending = retry_queue
+
+    return [results[msg_id] for msg_id in msg_ids if msg_id in results]
+
+def get_email_metadatas_batch(msg_ids, use_batch_api=True, on_results=None, on_failures=None):
+    """Get email metadata for multiple message IDs.
+
+    Uses the Gmail batch endpoint by default, set use_batch_api=False to fall back to one
+    messages().get() call per message on a thread pool. on_results, if given, is called with
+    each group of records as soon as they are fetched, on_failures with the IDs of messages that
+    can't be fetched (batch endpoint only, see fetch_emails_with_batch_api).
+    """
+    if use_batch_api:
+        return fetch_emails_with_batch_api(
+            msg_ids,
+            build_request=lambda service, msg_id: service.users().messages().get(
                 userId='me',
                 id=msg_id,
                 format='metadata',
-                metadataHeaders=['Subject', 'From', 'To', 'Date', 'Reply-To', 'CC', 'BCC', 'In-Reply-To']
-            ).execute()
+                metadataHeaders=METADATA_HEADERS
+            ),
+            parse_response=extract_email_metadata,
+            on_results=on_results,
+            on_failures=on_failures,
+        )
+
+    results = []
+    results_lock = Lock()
+    mailbox = current_mailbox()
+    plan_gmail_calls(mailbox, 'messages.get', len(msg_ids))
+    
+    def fetch_single_message(msg_id, idx, len_emails):
+        """Process a single message and return its metadata."""
+        try:
+            service = mailbox.get_gmail_service()
+
+            mailbox.gmail_quota.acquire('messages.get')
+            with mailbox.gmail_concurrency.slot() as slot:
+                try:
+                    with metrics.timed('gmail'):
+                        response = service.users().messages().get(
+                            userId='me',
+                            id=msg_id,
+                            format='metadata',
+                            metadataHeaders=METADATA_HEADERS
+                        ).execute()
+                except HttpError as error:
+                    if is_retryable_gmail_error(error):
+                        record_gmail_throttling(mailbox, error)
+                        slot.mark_throttled()
+                    raise
         
-            # Process the response the same way as the individual method
-            headers = response['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            recipient = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
-            reply_to = next((h['value'] for h in headers if h['name'] == 'Reply-To'), 'Unknown Reply-To')
-            cc = next((h['value'] for h in headers if h['name'] == 'CC'), 'Unknown CC')
-            bcc = next((h['value'] for h in headers if h['name'] == 'BCC'), 'Unknown BCC')
-            in_reply_to = next((h['value'] for h in headers if h['name'] == 'In-Reply-To'), 'Unknown In-Reply-To')
-            
-            email_metadata = {
-                'id': msg_id,
-                'subject': subject,
-                'date': date,
-                'sender': sender,
-                'recipient': recipient,
-                'reply_to': reply_to,
-                'cc': cc,
-                'bcc': bcc,
-                'in_reply_to': in_reply_to,
-            }
+            email_metadata = extract_email_metadata(msg_id, response)
 
             with results_lock:
                 results.append(email_metadata)
+            if on_results:
+                on_results([email_metadata])
             
             if (idx + 1) % 10 == 0:
                 print(f"Fetched {idx+1} / {len_emails} email metadatas...")
@@ -204,7 +480,7 @@ def get_email_metadatas_batch(msg_ids):
     # results = [fetch_single_message(msg_id, idx) for idx, msg_id in enumerate(msg_ids)]
 
     # Create a thread pool with limited concurrency
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=mailbox.gmail_concurrency.max_limit) as executor:
         # Submit all tasks to the executor
         len_emails = len(msg_ids)
         futures = {executor.submit(fetch_single_message, msg_id, idx, len_emails): msg_id for idx, msg_id in enumerate(msg_ids)}
@@ -220,72 +496,51 @@ def get_email_metadatas_batch(msg_ids):
     
     return results
 
-def get_full_email_batch(msg_ids):
-    """Get full email for multiple message IDs in a batch request."""
+def get_full_email_batch(msg_ids, use_batch_api=True):
+    """Get full email for multiple message IDs.
+
+    Uses the Gmail batch endpoint by default, set use_batch_api=False to fall back to one
+    messages().get() call per message on a thread pool.
+    """
+    if use_batch_api:
+        responses = fetch_emails_with_batch_api(
+            msg_ids,
+            build_request=lambda service, msg_id: service.users().messages().get(
+                userId='me',
+                id=msg_id,
+                format='full'
+            ),
+            # Keep the raw responses, bodies are decoded afterwards in one (process pool) pass.
+            parse_response=lambda msg_id, response: (msg_id, response),
+        )
+        return extract_full_emails(responses)
+
     results = []
     results_lock = Lock()
+    mailbox = current_mailbox()
+    plan_gmail_calls(mailbox, 'messages.get', len(msg_ids))
     
     def fetch_single_full_message(msg_id, idx):
         """Process a single message and return its metadata."""
         try:
-            service = get_gmail_service()
-
-            response = service.users().messages().get(
-                userId='me',
-                id=msg_id,
-                format='full'
-            ).execute()
+            service = mailbox.get_gmail_service()
+
+            mailbox.gmail_quota.acquire('messages.get')
+            with mailbox.gmail_concurrency.slot() as slot:
+                try:
+                    with metrics.timed('gmail'):
+                        response = service.users().messages().get(
+                            userId='me',
+                            id=msg_id,
+                            format='full'
+                        ).execute()
+                except HttpError as error:
+                    if is_retryable_gmail_error(error):
+                        record_gmail_throttling(mailbox, error)
+                        slot.mark_throttled()
+                    raise
         
-            # Process the response the same way as the individual method
-            headers = response['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            recipient = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown Recipient')
-            reply_to = next((h['value'] for h in headers if h['name'] == 'Reply-To'), 'Unknown Reply-To')
-            cc = next((h['value'] for h in headers if h['name'] == 'CC'), 'Unknown CC')
-            bcc = next((h['value'] for h in headers if h['name'] == 'BCC'), 'Unknown BCC')
-            in_reply_to = next((h['value'] for h in headers if h['name'] == 'In-Reply-To'), 'Unknown In-Reply-To')
-
-            def extract_text_from_html(html):
-                """Extract plain text from HTML content."""
-                # Remove HTML tags
-                text = re.sub(r'<[^>]+>', ' ', html)
-                # Decode HTML entities
-                text = unescape(text)
-                # Replace multiple whitespace with single space
-                text = re.sub(r'\s+', ' ', text)
-                # Remove leading/trailing whitespace
-                text = text.strip()
-                return text
-
-            def get_text_from_part(part):
-                """Recursively extract text from email parts."""
-                if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-                    return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                if part.get('mimeType') == 'text/html' and 'data' in part.get('body', {}):
-                    html = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    return extract_text_from_html(html)
-                if 'parts' in part:  # Check for nested parts
-                    subpart_texts = [get_text_from_part(subpart) for subpart in part['parts']]
-                    subpart_texts = [subpart_text for subpart_text in subpart_texts if subpart_text is not None]
-                    return ' '.join(subpart_texts)
-
-            body = get_text_from_part(response['payload'])
-            body = body if body else "Unknown body"
-            
-            email_metadata = {
-                'id': msg_id,
-                'subject': subject,
-                'date': date,
-                'sender': sender,
-                'recipient': recipient,
-                'reply_to': reply_to,
-                'cc': cc,
-                'bcc': bcc,
-                'in_reply_to': in_reply_to,
-                'body': body,
-            }
+            email_metadata = extract_full_email(msg_id, response)
 
             with results_lock:
                 results.append(email_metadata)
@@ -302,7 +557,7 @@ def get_full_email_batch(msg_ids):
     # results = [fetch_single_full_message(msg_id, idx) for idx, msg_id in enumerate(msg_ids[:10])]
 
     # Create a thread pool with limited concurrency
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=mailbox.gmail_concurrency.max_limit) as executor:
         # Submit all tasks to the executor
         futures = {executor.submit(fetch_single_full_message, msg_id, idx): msg_id for idx, msg_id in enumerate(msg_ids)}
         
@@ -317,6 +572,103 @@ def get_full_email_batch(msg_ids):
     
     return results
 
+def _text_fetch_fields(depth):
+    part_fields = 'partId,mimeType,filename,body(size,attachmentId,data)'
+    fields = part_fields
+    for _ in range(depth):
+        fields = f"{part_fields},parts({fields})"
+    return f"id,sizeEstimate,payload({fields})"
+
+# Field mask for the text-only full fetch: the MIME tree without any headers (we already have
+# them from the metadata stage), snippet or labels. Nested up to 6 levels of multipart.
+GMAIL_TEXT_FETCH_FIELDS = _text_fetch_fields(depth=6)
+MAX_TEXT_PART_BYTES = 2 * 1024 * 1024
+
+def get_text_email_batch(email_metadatas, max_text_part_bytes=MAX_TEXT_PART_BYTES, on_failures=None):
+    """Fetch the bodies for emails whose metadata we already have, downloading only text parts.
+
+    The message fetch uses a field mask that drops every header and keeps just the MIME
+    structure: part types, sizes, attachment IDs and inline data. Gmail returns non-attachment
+    parts inline, so small text bodies come back in that single request. Text parts Gmail moved
+    behind an attachment ID are fetched with attachments().get() if they are at most
+    max_text_part_bytes, and binary attachments (images, PDFs, ...) are never downloaded.
+
+    Args:
+        email_metadatas: Stage 1 metadata records, merged into the returned records.
+        max_text_part_bytes: Text parts larger than this are skipped.
+        on_failures: Optional function called with the IDs of messages that can't be fetched,
+            see fetch_emails_with_batch_api.
+
+    Returns:
+        List of metadata records with 'body' and 'fetch_stats' (bytes_transferred, bytes_skipped
+        and the message size_estimate) added.
+    """
+    metadata_by_id = {email_metadata['id']: email_metadata for email_metadata in email_metadatas}
+    responses = fetch_emails_with_batch_api(
+        list(metadata_by_id),
+        build_request=lambda service, msg_id: service.users().messages().get(
+            userId='me',
+            id=msg_id,
+            format='full',
+            fields=GMAIL_TEXT_FETCH_FIELDS
+        ),
+        parse_response=lambda msg_id, response: (msg_id, response),
+        on_failures=on_failures,
+    )
+
+    fetch_stats = {}
+    attachment_requests = {}
+    for msg_id, response in responses:
+        stats = {
+            'bytes_transferred': len(json.dumps(response)),
+            'bytes_skipped': 0,
+            'size_estimate': response.get('sizeEstimate', 0),
+        }
+        selected_parts = {id(part) for part in select_text_parts(response['payload'])}
+        for idx, part in enumerate(iter_parts(response['payload'])):
+            body = part.get('body', {})
+            if body.get('data') or not body.get('attachmentId'):
+                continue
+            if id(part) in selected_parts and body.get('size', 0) <= max_text_part_bytes:
+                attachment_requests[f"{msg_id}.{idx}"] = (msg_id, part)
+            else:
+                stats['bytes_skipped'] += body.get('size', 0)
+        fetch_stats[msg_id] = stats
+
+    if attachment_requests:
+        print(f"Fetching {len(attachment_requests)} text parts stored as attachments...")
+        attachments = fetch_emails_with_batch_api(
+            list(attachment_requests),
+            build_request=lambda service, request_id: service.users().messages().attachments().get(
+                userId='me',
+                messageId=attachment_requests[request_id][0],
+                id=attachment_requests[request_id][1]['body']['attachmentId']
+            ),
+            parse_response=lambda request_id, response: (request_id, response),
+            quota_method='messages.attachments.get',
+        )
+        for request_id, attachment in attachments:
+            msg_id, part = attachment_requests[request_id]
+            part['body']['data'] = attachment.get('data', '')
+            fetch_stats[msg_id]['bytes_transferred'] += len(attachment.get('data', ''))
+
+    body_texts = extract_body_texts([response['payload'] for _, response in responses])
+    results = [
+        {
+            **metadata_by_id[msg_id],
+            'body': body if body else "Unknown body",
+            'fetch_stats': fetch_stats[msg_id],
+        }
+        for (msg_id, _), body in zip(responses, body_texts)
+    ]
+
+    bytes_transferred = sum(stats['bytes_transferred'] for stats in fetch_stats.values())
+    size_estimate = sum(stats['size_estimate'] for stats in fetch_stats.values())
+    bytes_skipped = sum(stats['bytes_skipped'] for stats in fetch_stats.values())
+    print(f"Transferred {bytes_transferred / 1024:.0f} KB for {len(results)} emails totaling {size_estimate / 1024:.0f} KB "
+          f"({bytes_skipped / 1024:.0f} KB of attachments skipped).")
+    return results
+
 def generate_trip_insights(trip_message_datas, openai_api_key, existing_trip_insights = "") -> str:
     """
     Returns a list of trip information JSON objects.
@@ -334,7 +686,7 @@ def generate_trip_insights(trip_message_datas, openai_api_key, existing_trip_ins
         
         # Define a prompt template for hotel characteristics
         template = """
-        Based on the following hotel reservation email messages and the existing trip insights, please analyze the typical patterns of
+        Based on the following hotel reservation email messages (or aggregated reservations) and the existing trip insights, please analyze the typical patterns of
         the user's travel preferences and generate a list of types of trips that the user has taken. For each type of trip, include the
         following key information:
         - destination
@@ -378,14 +730,12 @@ def generate_trip_insights(trip_message_datas, openai_api_key, existing_trip_ins
         prompt = ChatPromptTemplate.from_template(template)
         
         # Generate the response
-        chain = prompt | llm
-        response = chain.invoke({
+        response_content = invoke_chain_cached(prompt, llm, llm_model, {
             "existing_trip_insights": existing_trip_insights,
             "trip_message_datas": trip_message_datas
         })
 
         # Extract JSON from the response
-        response_content = response.content
         if not response_content:
             print(f"LLM did not return a response to generate trip insights")
             return None
@@ -397,6 +747,104 @@ def generate_trip_insights(trip_message_datas, openai_api_key, existing_trip_ins
         print("To install required packages: pip install langchain langchain-openai")
         return None
 
+def merge_trip_insights(trip_insights_list, openai_api_key) -> str:
+    """
+    Merges several independently generated trip insights lists into a single list of up to 10 trip types.
+    """
+
+    if not openai_api_key:
+        print("Warning: OPENAI_API_KEY environment variable not set. Skipping LLM keyword extraction.")
+        return None
+
+    try:
+        llm_model = "o4-mini"
+
+        # Initialize the LLM with the API key explicitly
+        llm = ChatOpenAI(model=llm_model, openai_api_key=openai_api_key)
+
+        template = """
+        Below are several lists of trip types, each generated from a different set of the same user's hotel reservation emails.
+        Merge them into a single list of types of trips the user has taken. Merge trip types that describe the same kind of trip
+        (same destination or region, time of year, guests and purpose), keeping the same key information for each trip type:
+        destination, time of year, length of the trip, number and type of guests, number of times the user did a similar trip,
+        likely purpose, total budget with $ signs, preferred hotels, hotel chains, hotel characteristics, room types, amenities,
+        activities, dining experiences, payment methods, key details from each trip and any other information that would be
+        helpful for a travel planner to know.
+
+        When merging trip types, add up the number of trips and the total number of days of all trips in that trip type, and keep
+        the specifics (hotel names, room types, ...) of both sides. Rank your trip types with a higher total number of days and total
+        number of trips higher in your list. Keep the number of trip types below or equal to 10.
+
+        Return just the merged list of the types of trips and their key information.
+
+        Here are the trip insights lists to merge:
+        {trip_insights_list}
+        """
+
+        prompt = ChatPromptTemplate.from_template(template)
+
+        trip_insights_text = "\n\n".join(
+            f"Trip insights list {i + 1}:\n{trip_insights}"
+            for i, trip_insights in enumerate(trip_insights_list)
+        )
+        response_content = invoke_chain_cached(prompt, llm, llm_model, {
+            "trip_insights_list": trip_insights_text
+        })
+
+        if not response_content:
+            print(f"LLM did not return a response to merge trip insights")
+            return None
+
+        return response_content
+
+    except ImportError:
+        print("Warning: LangChain or OpenAI packages not installed. Skipping keyword generation.")
+        print("To install required packages: pip install langchain langchain-openai")
+        return None
+
+def generate_trip_insights_tree(trip_message_datas, openai_api_key, batch_size, merge_fan_in=2, max_workers=8) -> str:
+    """
+    Map-reduce version of the batched generate_trip_insights fold.
+
+    Leaf batches of batch_size emails are summarized concurrently, then the partial trip insights are merged
+    merge_fan_in at a time, level by level, until one list remains. Calls within a level run concurrently, so
+    latency grows with log(number of batches) instead of linearly.
+
+    Args:
+        trip_message_datas: Hotel reservation key insights (without bodies).
+        openai_api_key: OpenAI API key.
+        batch_size: Number of emails per leaf batch.
+        merge_fan_in: Number of partial trip insights merged per call.
+        max_workers: Maximum number of concurrent OpenAI calls.
+
+    Returns:
+        The trip insights text, or None if every leaf failed.
+    """
+    batches = [trip_message_datas[i:i + batch_size] for i in range(0, len(trip_message_datas), batch_size)]
+    if not batches:
+        return ""
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        print(f"Summarizing {len(batches)} batches of up to {batch_size} emails concurrently...")
+        partial_insights = list(executor.map(lambda batch: generate_trip_insights(batch, openai_api_key), batches))
+        partial_insights = [trip_insights for trip_insights in partial_insights if trip_insights]
+
+        level = 1
+        while len(partial_insights) > 1:
+            groups = [partial_insights[i:i + merge_fan_in] for i in range(0, len(partial_insights), merge_fan_in)]
+            print(f"Merge level {level}: merging {len(partial_insights)} partial trip insights into {len(groups)}...")
+
+            def merge_group(group):
+                if len(group) == 1:
+                    return group[0]
+                # Keep the inputs if the merge fails, rather than losing a whole subtree.
+                return merge_trip_insights(group, openai_api_key) or "\n\n".join(group)
+
+            partial_insights = list(executor.map(merge_group, groups))
+            level += 1
+
+    return partial_insights[0] if partial_insights else None
+
 def generate_trips_metadatas(trip_message_datas, trip_insights, num_trips, openai_api_key) -> str:
     """
     Returns a list of trip information JSON objects.
@@ -466,15 +914,13 @@ def generate_trips_metadatas(trip_message_datas, trip_insights, num_trips, opena
         prompt = ChatPromptTemplate.from_template(template)
         
         # Generate the response
-        chain = prompt | llm
-        response = chain.invoke({
+        response_content = invoke_chain_cached(prompt, llm, llm_model, {
             "trip_message_datas": trip_message_datas,
             "trip_insights": trip_insights,
             "num_trips": num_trips
         })
 
         # Extract JSON from the response
-        response_content = response.content
         if not response_content:
             print(f"LLM did not return a response to generate trip metadata")
             return None
@@ -494,23 +940,32 @@ def generate_trips_metadatas(trip_message_datas, trip_insights, num_trips, opena
         print("To install required packages: pip install langchain langchain-openai")
         return None
 
-def run_groq_inference(prompt, model):
-    groq_client = Groq()
-    completion = groq_client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt
-            },
-        ],
-        temperature=0.6,
-        max_completion_tokens=128,
-        top_p=1.0,
-        stream=False,
-        stop=None,
-    )
-    return completion.choices[0].message.content
+def run_groq_inference(prompt, model, sampling_params=None):
+    sampling_params = sampling_params or GROQ_SAMPLING_PARAMS
+
+    def create_completion():
+        # Paced by the model's rate limit buckets, shared with the async engine.
+        delay = reserve_groq_quota(model, prompt, sampling_params)
+        if delay > 0:
+            time.sleep(delay)
+        groq_client = Groq()
+        with metrics.timed('groq'):
+            completion = groq_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    },
+                ],
+                stream=False,
+                **sampling_params,
+            )
+        if completion.usage:
+            metrics.record_tokens(model, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+        return completion.choices[0].message.content
+
+    return get_llm_cache().get_or_compute(model, prompt, sampling_params, create_completion)
 
 def get_all_email_data_groq(
     prompts: Dict[str, str],
@@ -531,275 +986,726 @@ def batch_llm_calls(
     prompts: Dict[str, str],
     model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
     system_message: Optional[str] = None,
-    poll_interval: int = 5,
+    job_name: str = "default",
     additional_params: Optional[Dict[str, Any]] = None
 ) -> Dict[str, str]:
     """
-    Process a batch of prompts using Groq's Batch API and return results as a list.
-    
+    Process a batch of prompts using Groq's Batch API (see GroqBatchEngine) and return the results.
+
+    Batch IDs are persisted under job_name, so calling this again after a crash reattaches to the
+    running batches. Prompts that still fail after re-queuing are logged and left out.
+
     Args:
-        prompts: List of prompts/questions to send to the LLM
+        prompts: Dict of prompt ID -> prompt to send to the LLM
         model: The model to use (default: "meta-llama/llama-4-scout-17b-16e-instruct")
         system_message: Optional system message to prepend to each prompt
-        poll_interval: How often to check status (in seconds) when waiting
+        job_name: Name the batch IDs are persisted under, use one per stage
         additional_params: Optional additional parameters for each request
-        
+
     Returns:
-        List of completion strings in the same order as the input prompts
+        Dict of prompt ID -> completion string
     """
-    # Initialize Groq client
-    client = Groq()
-    
-    # Validate inputs
     if not prompts:
         raise ValueError("Must provide a list of prompts to create a new batch job")
-    
-    # Create temporary JSONL batch file
-    with tempfile.NamedTemporaryFile(mode='w+', suffix='.jsonl', delete=False) as temp_file:
-        temp_filename = temp_file.name
-        
-        for prompt_id, prompt in prompts.items():
-            # Prepare messages for this prompt
-            messages = []
-            if system_message:
-                messages.append({"role": "system", "content": system_message})
-            messages.append({"role": "user", "content": prompt})
-            
-            # Create request body with model and messages
-            body = {
-                "model": model,
-                "messages": messages
-            }
-            
-            # Add any additional parameters
-            if additional_params:
-                body.update(additional_params)
-            
-            # Create the full request with an auto-generated ID
-            request = {
-                "custom_id": prompt_id,
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": body
-            }
-            
-            # Write the request as a single line in JSONL format
-            temp_file.write(json.dumps(request) + "\n")
-    
-    try:
-        # Upload the temporary file
-        with open(temp_filename, "rb") as f:
-            file_response = client.files.create(
-                file=f,
-                purpose="batch"
-            )
-        
-        # Create the batch job
-        batch_response = client.batches.create(
-            completion_window="24h",
-            endpoint="/v1/chat/completions",
-            input_file_id=file_response.id
+
+    results, errors = run_groq_batch(
+        prompts,
+        model=model,
+        job_name=job_name,
+        sampling_params={**GROQ_SAMPLING_PARAMS, **(additional_params or {})},
+        system_message=system_message,
+    )
+    report_stage_errors(f"{job_name}_batch", errors, retried=False)
+    return results
+
+PROFILE_DIR = f'{EMAIL_DATA_DIR}/profiles'
+# Files in each mailbox's data directory (EMAIL_DATA_DIR for the default mailbox), next to its stages.sqlite3 stage store.
+SYNC_STATE_FILE_NAME = 'sync_state.json'
+HOTEL_RESERVATIONS_TABLE_FILE_NAME = 'hotel_reservations_table.json'
+FULL_FETCH_JOURNAL_CHUNK_SIZE = 200
+
+# Stages of the email pipeline, stored in the stage store under these names.
+HOTEL_RESERVATION_EMAILS_STAGE = 'hotel_reservation_emails'
+HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE = 'hotel_reservation_emails_classification'
+FULL_HOTEL_RESERVATION_EMAILS_STAGE = 'full_hotel_reservation_emails'
+FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE = 'full_hotel_reservation_emails_body_checked'
+HOTEL_RESERVATION_KEY_INSIGHTS_STAGE = 'hotel_reservation_key_insights'
+
+STAGES = [
+    HOTEL_RESERVATION_EMAILS_STAGE,
+    HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE,
+    FULL_HOTEL_RESERVATION_EMAILS_STAGE,
+    FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE,
+    HOTEL_RESERVATION_KEY_INSIGHTS_STAGE,
+]
+
+def stage_exists(stage):
+    """True if the stage completed, importing its JSONL file from earlier versions into the store if there is one."""
+    mailbox = current_mailbox()
+    if mailbox.stage_store.is_complete(stage):
+        return True
+    legacy_file = mailbox.path(f'{stage}.jsonl')
+    if os.path.exists(legacy_file):
+        mailbox.stage_store.import_jsonl(stage, legacy_file)
+        return True
+    return False
+
+def load_stage(stage, with_bodies=False):
+    """Load a stage's records, with their bodies only when a following stage needs them."""
+    records = list(current_mailbox().stage_store.iter_records(stage, with_bodies=with_bodies))
+    print(f"Loaded {len(records)} records from stage {stage}.")
+    return records
+
+def append_to_jsonl(file_path, a_list):
+    """Append records to a JSONL file, creating it if needed."""
+    dirname = os.path.dirname(file_path)
+    if len(dirname.strip()) > 0:
+        os.makedirs(dirname, exist_ok=True)
+
+    with open(file_path, 'a') as f:
+        for item in a_list:
+            f.write(json.dumps(item) + '\n')
+
+    print(f"Appended {len(a_list)} records to {file_path}")
+
+def load_hotel_reservation_keywords():
+    return load_jsonl('hotel_reservation_search_keywords.jsonl')
+
+def build_hotel_reservation_query():
+    """Build the Gmail search query OR-ing every hotel reservation keyword phrase."""
+    return or_query(load_hotel_reservation_keywords())
+
+def list_hotel_reservation_messages(args, max_results=5000, since_epoch_seconds=None):
+    """List the messages matching the hotel reservation query, sharded (see search_emails_sharded) unless --list-shard-days is 0.
+
+    With since_epoch_seconds only messages dated from then on are listed (an incremental sync).
+    """
+    if args.list_shard_days > 0:
+        return search_emails_sharded(load_hotel_reservation_keywords(), max_results=max_results, shard_days=args.list_shard_days,
+                                     num_keyword_groups=args.keyword_shards, since_epoch_seconds=since_epoch_seconds)
+    query = build_hotel_reservation_query()
+    if since_epoch_seconds is not None:
+        query = f"({query}) after:{since_epoch_seconds}"
+    return search_emails(get_gmail_service(), query, max_results=max_results)
+
+def is_reply_email(email_metadata):
+    return "Unknown" not in email_metadata['in_reply_to']
+
+def fetch_hotel_reservation_email_metadatas(msg_ids, journal=None):
+    """Stage 1: fetch email metadatas and drop replies to other emails in the same thread."""
+    def journal_results(email_metadatas):
+        journal.record_many([
+            (email_metadata['id'], None if is_reply_email(email_metadata) else email_metadata)
+            for email_metadata in email_metadatas
+        ])
+
+    def journal_failures(failed_ids):
+        # Messages Gmail won't return (e.g. deleted since the search) are dropped, not retried forever.
+        journal.record_many([(msg_id, None) for msg_id in failed_ids])
+
+    email_metadatas = get_email_metadatas_batch(
+        msg_ids,
+        on_results=journal_results if journal else None,
+        on_failures=journal_failures if journal else None,
+    )
+    print(f"Retrieved {len(email_metadatas)} email metadatas before filtering.")
+
+    email_metadatas = [email_metadata for email_metadata in email_metadatas if not is_reply_email(email_metadata)]
+    print(f"Filtered down to {len(email_metadatas)} by removing emails that are replies to another email in the same thread.")
+    return email_metadatas
+
+CLASSIFICATION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+KEY_INSIGHTS_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+
+# Token budgets (measured with prompt_compactor.count_tokens) for the prompts that include email bodies.
+BODY_CHECK_PROMPT_TOKEN_BUDGET = int(os.getenv('BODY_CHECK_PROMPT_TOKEN_BUDGET', '800'))
+KEY_INSIGHTS_PROMPT_TOKEN_BUDGET = int(os.getenv('KEY_INSIGHTS_PROMPT_TOKEN_BUDGET', '1600'))
+
+# Fields added for deduplication, not shown to the metadata classifier.
+DEDUP_FIELDS = ('snippet', 'duplicate_ids')
+
+def metadata_classification_prompt(email_metadata):
+    email_metadata = {key: value for key, value in email_metadata.items() if key not in DEDUP_FIELDS}
+    return f"Here is metadata for an email, is it a hotel reservation confirmation? Just answer True or False and nothing else. Metadata: {email_metadata}"
+
+def body_check_prompt(email_metadata):
+    return fit_prompt(
+        "Here is data for an email, is it a hotel reservation confirmation? Make sure to only keep hotel reservations (and filter out restaurant reservations and other travel related emails). Just answer True or False and nothing else. Email:\n{email}",
+        email_metadata,
+        BODY_CHECK_PROMPT_TOKEN_BUDGET,
+    )
+
+# JSON mode, deterministic, and enough completion tokens for the whole object.
+KEY_INSIGHTS_SAMPLING_PARAMS = {
+    **GROQ_SAMPLING_PARAMS,
+    "temperature": 0.0,
+    "max_completion_tokens": 384,
+    "response_format": {"type": "json_object"},
+}
+
+def key_insights_prompt(email_metadata):
+    return fit_prompt(
+        f"""
+        Here is data for a hotel reservation email. Extract the reservation as a single JSON object with exactly these fields:
+        - hotel: hotel name
+        - city: city of the hotel
+        - country: country of the hotel
+        - check_in, check_out: dates as YYYY-MM-DD
+        - guests: total number of guests (integer)
+        - total_price: total price of the stay (number, no currency symbol)
+        - currency: ISO currency code, e.g. USD, EUR
+        - loyalty_tier: loyalty program and membership level of the guest, e.g. "Marriott Bonvoy Platinum"
+        - payment_method: e.g. credit card, debit card, points, promotion
+        - room_type: type of room or suite, beds and view
+
+        Use null for anything the email doesn't say. Return just the JSON object, e.g.:
+        {KEY_INSIGHTS_JSON_EXAMPLE}
+
+        Email data:
+        {{email}}
+        """,
+        email_metadata,
+        KEY_INSIGHTS_PROMPT_TOKEN_BUDGET,
+    )
+
+def journal_classification(journal, emails_by_id):
+    """on_result callback journaling a True / False classification answer for an email."""
+    def on_result(prompt_id, response):
+        journal.record(prompt_id, emails_by_id[prompt_id] if response == "True" else None)
+    return on_result
+
+def report_stage_errors(stage_name, errors, retried=True):
+    """Log prompts that still failed after retries, so they aren't mistaken for a False answer.
+
+    Their emails aren't journaled, so the stage isn't saved and the next run retries them (see
+    stage_journal.IncompleteStageError), unless retried is False: the stage dropped them for good.
+    """
+    if not errors:
+        return
+    if retried:
+        print(f"{len(errors)} emails failed in the {stage_name} stage after retries, they are retried on the next run.")
+    else:
+        print(f"{len(errors)} emails failed in the {stage_name} stage and were left out (not counted as False).")
+    append_to_jsonl(current_mailbox().path(f'{stage_name}_errors.jsonl'), [
+        {'id': prompt_id, 'error': error, 'failed_at': int(time.time())}
+        for prompt_id, error in errors.items()
+    ])
+
+_email_preclassifier = None
+
+def get_email_preclassifier():
+    global _email_preclassifier
+    if _email_preclassifier is None:
+        _email_preclassifier = EmailPreclassifier()
+    return _email_preclassifier
+
+def preclassify_email_metadatas(email_metadatas):
+    """Split emails into (locally decided {id: True/False}, ambiguous emails that need the LLM)."""
+    preclassifier = get_email_preclassifier()
+    decisions = {}
+    ambiguous = []
+    for email_metadata in email_metadatas:
+        decision, _ = preclassifier.classify(email_metadata)
+        if decision is None:
+            ambiguous.append(email_metadata)
+        else:
+            decisions[email_metadata['id']] = decision
+    return decisions, ambiguous
+
+def classify_hotel_reservation_metadatas(email_metadatas, journal=None):
+    """Stage 2: keep the emails whose metadata looks like a hotel reservation confirmation.
+
+    Obvious cases are decided by the local pre-classifier, only ambiguous emails cost a Groq call.
+    """
+    email_metadatas_by_id = {email_metadata['id']: email_metadata for email_metadata in email_metadatas}
+    local_decisions, ambiguous_email_metadatas = preclassify_email_metadatas(email_metadatas)
+    if journal:
+        journal.record_many([
+            (msg_id, email_metadatas_by_id[msg_id] if decision else None)
+            for msg_id, decision in local_decisions.items()
+        ])
+    print(f"Decided {len(local_decisions)} / {len(email_metadatas)} emails locally, classifying {len(ambiguous_email_metadatas)} with the LLM.")
+    prompts = {
+        email_metadata['id']: metadata_classification_prompt(email_metadata)
+        for email_metadata in ambiguous_email_metadatas
+    }
+    batch_hotel_reservation_classification, errors = llm_router.run(
+        current_mailbox().qualified_name('metadata_classification'),
+        prompts,
+        model=CLASSIFICATION_MODEL,
+        concurrency_controller=groq_concurrency,
+        on_result=journal_classification(journal, email_metadatas_by_id) if journal else None,
+    )
+    report_stage_errors('metadata_classification', errors)
+    return [
+        email_metadata
+        for email_metadata in email_metadatas
+        if local_decisions.get(email_metadata['id'])
+        or "True" == batch_hotel_reservation_classification.get(email_metadata['id'], 'False')
+    ]
+
+def fetch_full_hotel_reservation_emails(hotel_reservation_emails, journal=None):
+    """Stage 3: add decoded bodies to the stage 1 metadata, downloading only text parts."""
+    if not journal:
+        return get_text_email_batch(hotel_reservation_emails)
+
+    def journal_failures(failed_ids):
+        journal.record_many([(msg_id, None) for msg_id in failed_ids])
+
+    # Fetch in chunks so finished emails reach the journal well before the end of the stage.
+    full_hotel_reservation_emails = []
+    for i in range(0, len(hotel_reservation_emails), FULL_FETCH_JOURNAL_CHUNK_SIZE):
+        chunk_results = get_text_email_batch(hotel_reservation_emails[i:i + FULL_FETCH_JOURNAL_CHUNK_SIZE], on_failures=journal_failures)
+        journal.record_many([(email['id'], email) for email in chunk_results])
+        full_hotel_reservation_emails.extend(chunk_results)
+    return full_hotel_reservation_emails
+
+def body_check_hotel_reservation_emails(full_hotel_reservation_emails, journal=None):
+    """Stage 4: keep the emails whose full content is a hotel (not restaurant, flight, ...) reservation."""
+    prompts = {
+        email_metadata['id']: body_check_prompt(email_metadata)
+        for email_metadata in full_hotel_reservation_emails
+    }
+    batch_hotel_reservation_classification_full_email, errors = llm_router.run(
+        current_mailbox().qualified_name('body_check'),
+        prompts,
+        model=CLASSIFICATION_MODEL,
+        concurrency_controller=groq_concurrency,
+        on_result=journal_classification(journal, {email['id']: email for email in full_hotel_reservation_emails}) if journal else None,
+    )
+    report_stage_errors('body_check', errors)
+    return [
+        email_metadata
+        for email_metadata in full_hotel_reservation_emails
+        if "True" == batch_hotel_reservation_classification_full_email.get(email_metadata['id'], 'False')
+    ]
+
+def extract_hotel_reservation_key_insights(body_checked_filtered_hotel_reservation_emails, journal=None):
+    """Stage 5: extract key insights (hotel, dates, guests, price, ...) from each reservation email."""
+    emails_by_id = {email['id']: email for email in body_checked_filtered_hotel_reservation_emails}
+
+    def journal_key_insights(prompt_id, response):
+        # Malformed answers aren't journaled, they are repaired below (or redone after a crash).
+        key_insights, _ = parse_key_insights(response)
+        if key_insights is not None:
+            journal.record(prompt_id, {**emails_by_id[prompt_id], 'key_insights': key_insights})
+
+    prompts = {
+        email_metadata['id']: key_insights_prompt(email_metadata)
+        for email_metadata in body_checked_filtered_hotel_reservation_emails
+    }
+    batch_hotel_reservation_key_insights, errors = llm_router.run(
+        current_mailbox().qualified_name('key_insights'),
+        prompts,
+        model=KEY_INSIGHTS_MODEL,
+        concurrency_controller=groq_concurrency,
+        on_result=journal_key_insights if journal else None,
+        sampling_params=KEY_INSIGHTS_SAMPLING_PARAMS,
+    )
+    report_stage_errors('key_insights', errors)
+
+    key_insights_by_id = {}
+    malformed = {}
+    for msg_id, response in batch_hotel_reservation_key_insights.items():
+        key_insights, error = parse_key_insights(response)
+        if key_insights is None:
+            malformed[msg_id] = (response, error)
+        else:
+            key_insights_by_id[msg_id] = key_insights
+
+    if malformed:
+        # Answers the local JSON repair couldn't fix get one more pass through the LLM.
+        print(f"Repairing {len(malformed)} malformed key insights with the LLM...")
+        repaired, repair_errors = llm_router.run(
+            current_mailbox().qualified_name('key_insights_repair'),
+            {msg_id: key_insights_repair_prompt(response, error) for msg_id, (response, error) in malformed.items()},
+            model=KEY_INSIGHTS_MODEL,
+            concurrency_controller=groq_concurrency,
+            on_result=journal_key_insights if journal else None,
+            sampling_params=KEY_INSIGHTS_SAMPLING_PARAMS,
         )
-        batch_id = batch_response.id
-        print(f"Batch job created with ID: {batch_id}")
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
-    
-    # Wait for the job to complete
-    print(f"Waiting for batch job {batch_id} to complete...")
-    while True:
-        response = client.batches.retrieve(batch_id)
-        status = response.status
-        print(f"Batch job status: {status}.")
-        
-        if status in ["completed", "expired", "cancelled"]:
-            break
+        report_stage_errors('key_insights_repair', repair_errors)
+        invalid = {}
+        for msg_id, (_, error) in malformed.items():
+            key_insights, repair_error = parse_key_insights(repaired.get(msg_id))
+            if msg_id in repair_errors:
+                # The repair call itself failed, not journaled so the next run retries it.
+                continue
+            elif key_insights is None:
+                invalid[msg_id] = repair_error or error
+                if journal:
+                    # Still no usable answer after the repair pass: the email is dropped for good.
+                    journal.record(msg_id, None)
+            else:
+                key_insights_by_id[msg_id] = key_insights
+        report_stage_errors('key_insights_invalid', invalid, retried=False)
+
+    return [
+        {
+            **email_metadata,
+            'key_insights': key_insights_by_id[email_metadata['id']]
+        }
+        for email_metadata in body_checked_filtered_hotel_reservation_emails
+        if email_metadata['id'] in key_insights_by_id
+    ]
 
-        time.sleep(poll_interval)
-    
-    # Process results
-    batch_results = response.to_dict()
-    output_file_id = batch_results["output_file_id"]
-    actual_responses_obj = client.files.content(output_file_id)
-    actual_responses_obj.write_to_file("temp_batch_results.jsonl")
-    with open('temp_batch_results.jsonl', 'r', encoding='utf-8') as f:
-        raw_results = [json.loads(line) for line in f if line.strip()]
-    os.remove("temp_batch_results.jsonl")
-
-    results = {
-        result["custom_id"]: result["response"]["body"]["choices"][0]["message"]["content"]
-        for result in raw_results
+# Emails handed to each LLM stage call of the streaming pipeline: enough for the async engine to
+# keep many requests in flight, small enough that results start flowing to the next stage quickly.
+STREAMING_LLM_BATCH_SIZE = 50
+STREAMING_LLM_WORKERS = 4
+
+def journaled_pipeline_stage(stage, stage_fn, workers=1, batch_size=1):
+    """PipelineStage running stage_fn(records, journal=...) on the stage's journal, like run_stage_with_journal.
+
+    Inputs journaled by an interrupted run aren't processed again: their journaled outputs go
+    straight on to the next stage.
+
+    Returns:
+        Tuple (PipelineStage, StageJournal, list the IDs of the stage's inputs are added to).
+    """
+    journal = StageJournal(current_mailbox().path(f'{stage}.journal'))
+    completed = journal.index()
+    input_ids = []
+
+    def process_batch(items):
+        # The metadata stage gets message IDs, the other stages get records.
+        item_ids = [item if isinstance(item, str) else item['id'] for item in items]
+        input_ids.extend(item_ids)
+        pending = [item for item, item_id in zip(items, item_ids) if item_id not in completed]
+        outputs = list(journal.iter_outputs(item_ids, completed))
+        if pending:
+            outputs.extend(stage_fn(pending, journal=journal))
+        return outputs
+
+    return PipelineStage(stage, bind_mailbox(process_batch), workers=workers, batch_size=batch_size), journal, input_ids
+
+def run_journaled_streaming_stages(source_items, stage_specs, msg_ids):
+    """Stream source_items through journaled stages and save every stage once they all finished.
+
+    Args:
+        source_items: Inputs of the first stage.
+        stage_specs: List of (stage, stage_fn, workers, batch_size), see journaled_pipeline_stage.
+        msg_ids: All the scanned message IDs, the order stage outputs are saved in.
+
+    Returns:
+        Dict of stage -> number of saved outputs.
+
+    Raises:
+        StreamingPipelineError: If some batches failed. No stage is saved then, the journals keep
+            the finished records so the next run resumes from them.
+        IncompleteStageError: If some inputs weren't journaled (e.g. LLM calls that still failed
+            after retries), same as StreamingPipelineError.
+    """
+    stage_store = current_mailbox().stage_store
+    pipeline_stages = []
+    journals = {}
+    stage_input_ids = {}
+    for stage, stage_fn, workers, batch_size in stage_specs:
+        pipeline_stage, journals[stage], stage_input_ids[stage] = journaled_pipeline_stage(stage, stage_fn, workers, batch_size)
+        pipeline_stages.append(pipeline_stage)
+    try:
+        run_streaming_pipeline(source_items, pipeline_stages)
+    finally:
+        for journal in journals.values():
+            journal.close()
+
+    offsets = {}
+    for stage, journal in journals.items():
+        offsets[stage] = journal.index()
+        unfinished_ids = journal.unfinished(stage_input_ids[stage], offsets[stage])
+        if unfinished_ids:
+            raise IncompleteStageError(journal.journal_path, unfinished_ids)
+    return {
+        stage: journal.compact(lambda outputs, stage=stage: stage_store.replace(stage, outputs), msg_ids, offsets[stage])
+        for stage, journal in journals.items()
     }
 
-    return results
+def run_streaming_hotel_reservation_stages(msg_ids):
+    """Run the five email stages as two streaming pipelines instead of one stage after another.
 
-def run_groq_inference_batch_with_pool(
-    prompts_dict,
-    max_workers=10,
-    model="meta-llama/llama-4-scout-17b-16e-instruct",
-    ):
-    """Process multiple prompts with Groq API using a thread pool."""
-    results = {}
-    results_lock = Lock() # To safely update the shared results dictionary
-    completed_count = 0
-    total_prompts = len(prompts_dict)
+    Stages are connected by bounded queues: an email is classified as soon as its metadata
+    arrives, fetched in full as soon as it is classified True, and so on, so Gmail and Groq
+    latency overlap. Each stage runs the same stage function as the batch path on every batch it
+    gets, so LLM calls go through the router with rate limiting and retries, and finished records
+    are journaled. The pipeline is split after the full fetch, where duplicate emails are
+    collapsed on their bodies across the whole mailbox before the body check.
 
-    def process_single_prompt(prompt_id, prompt_text):
-        nonlocal completed_count
+    Returns:
+        Dict of stage -> number of records saved for that stage (same records as the batch stages).
+    """
+    outputs = run_journaled_streaming_stages(msg_ids, [
+        (HOTEL_RESERVATION_EMAILS_STAGE, fetch_hotel_reservation_email_metadatas, 2, GMAIL_BATCH_SIZE),
+        (HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE, classify_hotel_reservation_metadatas, STREAMING_LLM_WORKERS, STREAMING_LLM_BATCH_SIZE),
+        (FULL_HOTEL_RESERVATION_EMAILS_STAGE, fetch_full_hotel_reservation_emails, 2, 20),
+    ], msg_ids)
+    # Duplicates are collapsed on the bodies, which carry the confirmation numbers and dates.
+    outputs.update(run_journaled_streaming_stages(iter_collapsed_stage_records(FULL_HOTEL_RESERVATION_EMAILS_STAGE), [
+        (FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE, body_check_hotel_reservation_emails, STREAMING_LLM_WORKERS, STREAMING_LLM_BATCH_SIZE),
+        (HOTEL_RESERVATION_KEY_INSIGHTS_STAGE, extract_hotel_reservation_key_insights, STREAMING_LLM_WORKERS, STREAMING_LLM_BATCH_SIZE),
+    ], msg_ids))
+    return outputs
+
+def newest_email_timestamp(stage):
+    """Epoch seconds of the most recent Date header among a stage's records, 0 when none can be parsed."""
+    newest = 0
+    for email_metadata in current_mailbox().stage_store.iter_records(stage):
         try:
-            response = run_groq_inference(prompt_text, model=model) # Your existing inference function
-            with results_lock:
-                results[prompt_id] = response
-                completed_count += 1
-                print(f"Completed {completed_count} / {total_prompts} prompts (ID: {prompt_id}).")
-            return prompt_id, response
-        except Exception as e:
-            with results_lock:
-                results[prompt_id] = f"ERROR: {str(e)}"
-                completed_count += 1
-                print(f"Error processing prompt ID {prompt_id}: {e}. Completed {completed_count} / {total_prompts}.")
-            return prompt_id, f"ERROR: {str(e)}"
+            newest = max(newest, parsedate_to_datetime(email_metadata.get('date')).timestamp())
+        except (TypeError, ValueError, IndexError):
+            continue
+    return int(newest)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit tasks: executor.submit(function, arg1, arg2, ...)
-        future_to_prompt_id = {executor.submit(process_single_prompt, pid, ptext): pid for pid, ptext in prompts_dict.items()}
+def sync_new_hotel_reservation_emails(args):
+    """Incrementally sync the mailbox from its last historyId checkpoint.
 
-        for future in concurrent.futures.as_completed(future_to_prompt_id):
-            prompt_id_completed = future_to_prompt_id[future]
-            try:
-                # You can get the result of the task if needed, 
-                # but it's already stored in the `results` dict by the worker function.
-                # This also re-raises any exception that occurred during the task.
-                future.result() 
-            except Exception as exc:
-                # This exception should ideally already be caught and logged by process_single_prompt
-                # But it's good practice to handle it here as well.
-                print(f'Prompt ID {prompt_id_completed} generated an exception in future: {exc}')
-                # Ensure error is stored if not already
-                with results_lock:
-                    if prompt_id_completed not in results:
-                         results[prompt_id_completed] = f"ERROR: {str(exc)}"
+    Only messages added since the checkpoint that also match the hotel reservation query are pushed
+    through the classification, full fetch, body check and key insight stages, and the results are
+    appended to the existing stages, in one transaction once every stage succeeded, so an
+    interrupted sync is simply redone on the next run. A mailbox scanned before checkpoints
+    existed has none yet: its first sync searches from the newest scanned email and saves one.
 
-    return results
+    Returns:
+        True if the incremental sync ran, False if the stages must be run first (incomplete stages).
+    """
+    stage_store = current_mailbox().stage_store
+    sync_state_file = current_mailbox().path(SYNC_STATE_FILE_NAME)
+    if not all(stage_exists(stage) for stage in STAGES):
+        print("The email stages of this mailbox aren't complete yet, running them before any incremental sync.")
+        return False
+
+    service = get_gmail_service()
+    mailbox, current_history_id = get_mailbox_profile(service)
+    checkpoint = load_sync_state(sync_state_file).get(mailbox)
+    if checkpoint:
+        print(f"Syncing {mailbox} from historyId {checkpoint['history_id']}...")
+        added_ids, latest_history_id = list_added_message_ids(service, checkpoint['history_id'])
+        latest_history_id = latest_history_id or current_history_id
+        synced_at = checkpoint['synced_at']
+    else:
+        # No history to list from, the date bounded search below finds what arrived since the scan.
+        synced_at = newest_email_timestamp(HOTEL_RESERVATION_EMAILS_STAGE)
+        print(f"No sync checkpoint for {mailbox} yet, syncing the emails since the newest scanned one.")
+        added_ids, latest_history_id = None, current_history_id
+
+    # history.list can't filter by search query, so intersect with a date bounded search of the same query,
+    # listed like a full scan (sharded, paced by the quota scheduler and retried).
+    matching_messages = list_hotel_reservation_messages(args, since_epoch_seconds=sync_search_start(synced_at))
+    if added_ids is not None:
+        added_ids = set(added_ids)
+        matching_messages = [message for message in matching_messages if message['id'] in added_ids]
+
+    # Only known message IDs are skipped: a new email in a known thread can be a separate reservation
+    # (same subject and sender), stage 1 drops the actual replies like in a full scan.
+    known_ids = set(stage_store.ids(HOTEL_RESERVATION_EMAILS_STAGE))
+    new_ids = [message['id'] for message in matching_messages if message['id'] not in known_ids]
+    print(f"Found {len(new_ids)} new matching emails since the last sync.")
+
+    if new_ids:
+        new_email_metadatas = fetch_hotel_reservation_email_metadatas(new_ids)
+        new_hotel_reservation_emails = classify_hotel_reservation_metadatas(new_email_metadatas)
+        new_full_hotel_reservation_emails = fetch_full_hotel_reservation_emails(new_hotel_reservation_emails)
+        new_body_checked_emails = body_check_hotel_reservation_emails(collapse_duplicate_emails(new_full_hotel_reservation_emails))
+        new_key_insights = extract_hotel_reservation_key_insights(new_body_checked_emails)
+
+        stage_store.append_all({
+            HOTEL_RESERVATION_EMAILS_STAGE: new_email_metadatas,
+            HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE: new_hotel_reservation_emails,
+            FULL_HOTEL_RESERVATION_EMAILS_STAGE: new_full_hotel_reservation_emails,
+            FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE: new_body_checked_emails,
+            HOTEL_RESERVATION_KEY_INSIGHTS_STAGE: new_key_insights,
+        })
+        print(f"Added {len(new_key_insights)} new hotel reservation emails with key insights.")
 
-def main():
+    save_sync_checkpoint(sync_state_file, mailbox, latest_history_id)
+    return True
+
+def run_stage_with_journal(stage, input_records, stage_fn):
+    """Run stage_fn(records, journal=...) on the input records not finished by a previous (crashed) run.
+
+    input_records is consumed in chunks (see run_journaled_stage), so it can be the previous stage's
+    records streamed from the stage store.
+
+    Returns:
+        The number of records saved for the stage.
+    """
+    mailbox = current_mailbox()
+    return run_journaled_stage(
+        mailbox.path(f'{stage}.journal'),
+        input_records,
+        lambda pending_records, journal: stage_fn(pending_records, journal=journal),
+        lambda outputs: mailbox.stage_store.replace(stage, outputs),
+    )
+
+def iter_collapsed_stage_records(stage):
+    """Yield a stage's records (with bodies) minus their duplicates, see collapse_duplicate_emails.
+
+    Only the part of each body the deduplication reads is kept in memory for it, the kept records
+    are then streamed again from the stage store with their whole body.
+    """
+    stage_store = current_mailbox().stage_store
+    dedup_records = [
+        {**record, 'body': record['body'][:MAX_DEDUP_TEXT_CHARS]} if record.get('body') else record
+        for record in stage_store.iter_records(stage, with_bodies=True)
+    ]
+    duplicate_ids = {record['id']: record.get('duplicate_ids') for record in collapse_duplicate_emails(dedup_records)}
+    del dedup_records
+    for record in stage_store.iter_records(stage, with_bodies=True):
+        if record['id'] in duplicate_ids:
+            if duplicate_ids[record['id']]:
+                record['duplicate_ids'] = duplicate_ids[record['id']]
+            yield record
+
+def generate_trip_insights_from_emails(trip_message_datas, batch_size, sequential=False):
+    """Generate trip insights from the key insights emails in batches (tree reduction, or a sequential fold)."""
+    # If too much data for context window, split into batches: summarize them concurrently and merge the results in a tree,
+    # or (--sequential-insights) cycle through them while accumulating insights.
+    print(f"\nGenerating insights from hotel confirmation emails...\n")
+    trip_insights = ""
+    if not sequential:
+        trip_insights = generate_trip_insights_tree(
+            trip_message_datas,
+            os.getenv("OPENAI_API_KEY"),
+            batch_size=batch_size,
+        )
+        print(f"Trip insights:\n{trip_insights}\n")
+    else:
+        num_batches = (len(trip_message_datas) + batch_size - 1) // batch_size
+        for i in range(0, len(trip_message_datas), batch_size):
+            current_batch = trip_message_datas[i:i + batch_size]
+            batch_num = i // batch_size + 1
+            print(f"Processing batch {batch_num}/{num_batches} ({len(current_batch)} emails)...")
+
+            # Call generate_trip_insights with the current batch and existing insights
+            trip_insights = generate_trip_insights(
+                current_batch,
+                os.getenv("OPENAI_API_KEY"),
+                existing_trip_insights=trip_insights  # Pass the accumulated insights
+            )
+
+            print(f"Processed batch {batch_num}/{num_batches} ({len(current_batch)} emails), current trip insights:\n{trip_insights}\n")
+    return trip_insights
+
+def build_arg_parser(description='Search Gmail for hotel reservation emails and generate trip insights.'):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only process emails added since the last sync checkpoint (falls back to a full scan if there is none)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='On a full scan, run all email stages concurrently connected by bounded queues')
+    parser.add_argument('--llm-mode', choices=LLM_ROUTER_MODES, default='auto',
+                        help='How LLM stages run: real-time, Groq Batch API, or auto (chosen per stage by prompt count, cost and deadline)')
+    parser.add_argument('--llm-deadline-minutes', type=float, default=30,
+                        help='In auto mode, only use the Batch API when its observed turnaround fits this deadline (0 for no deadline)')
+    parser.add_argument('--llm-realtime-head', type=int, default=0,
+                        help='In auto mode, run the first N prompts of a batched stage real-time for quick early results')
+    parser.add_argument('--sequential-insights', action='store_true',
+                        help='When trip insights come from the emails (no structured key insights), fold batches one after another instead of a concurrent map-reduce tree')
+    parser.add_argument('--list-shard-days', type=float, default=DEFAULT_SHARD_DAYS,
+                        help=f'On a full scan, list matching emails in concurrent after:/before: windows of this many days, split further where busy (default {DEFAULT_SHARD_DAYS}, 0 for a single sequentially paged query)')
+    parser.add_argument('--keyword-shards', type=int, default=1,
+                        help='Split the search keyword phrases into this many groups, each listed as its own shards')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Write a JSON report and a Prometheus text snapshot of the per-stage timings, call latencies, retries, tokens and cost to {PROFILE_DIR}')
+    return parser
+
+def parse_args():
+    return build_arg_parser().parse_args()
+
+def configure_llm_router(args):
+    llm_router.configure(
+        mode=args.llm_mode,
+        deadline_seconds=args.llm_deadline_minutes * 60 if args.llm_deadline_minutes > 0 else None,
+        realtime_head=args.llm_realtime_head,
+    )
+
+def scan_mailbox(args):
+    """Run the email stages and generate the trips of the current mailbox (see mailbox_context.use_mailbox).
+
+    Args:
+        args: Parsed command line arguments (incremental, streaming, list_shard_days, keyword_shards, sequential_insights).
+
+    Returns:
+        The generated trip metadatas, None if no matching emails were found.
+    """
     DISPLAY_LIMIT = 20
     NUM_TRIPS_METADATA_TO_GENERATE = 5
     HOTEL_RESERVATION_EMAILS_BATCH_SIZE = 20
 
-    hotel_reservation_search_keywords = load_jsonl('hotel_reservation_search_keywords.jsonl')
-    hotel_reservation_search_keywords = [f'"{keyword}"' for keyword in hotel_reservation_search_keywords]
-    query = ' OR '.join(hotel_reservation_search_keywords)
+    context = current_mailbox()
+    stage_store = context.stage_store
+
+    if args.incremental:
+        with metrics.stage(context.qualified_name('incremental_sync')):
+            sync_new_hotel_reservation_emails(args)
 
-    if not os.path.exists('./email_data/v0/hotel_reservation_emails.jsonl'):
+    if not stage_exists(HOTEL_RESERVATION_EMAILS_STAGE):
         print("Authenticating with Gmail...")
         service = get_gmail_service()
+        # Checkpoint before listing so messages arriving during the scan are picked up by the next sync.
+        mailbox, history_id = get_mailbox_profile(service)
         
         print("Searching for emails...")
         # query = "label:travel" # Autogenerated google search label, misses a lot of emails...
         # query = """
         # ("Reservation Confirmation" OR "Booking Confirmation" OR "Booking Reference" OR "Confirmation Number" OR "Reservation Number" OR "Hotel Confirmation") -in:chats
         # """
-        messages = search_emails(service, query, max_results=5000)
+        with metrics.stage(context.qualified_name('search')) as stage:
+            messages = list_hotel_reservation_messages(args)
+            stage.set_items(items_out=len(messages))
         if not messages:
             print("No matching emails found.")
-            return
+            return None
         print(f"Found {len(messages)} matching emails.")
 
-        print(f"Getting email metadatas...")
         msg_ids = [message['id'] for message in messages]
-        email_metadatas = get_email_metadatas_batch(msg_ids)
-        print(f"Retrieved {len(email_metadatas)} email metadatas before filtering.")
-
-        email_metadatas = [email_metadata for email_metadata in email_metadatas if "Unknown" in email_metadata['in_reply_to']]
-        print(f"Filtered down to {len(email_metadatas)} by removing emails that are replies to another email in the same thread.")
-        save_to_jsonl('./email_data/v0/hotel_reservation_emails.jsonl', email_metadatas)
-    else:
-        email_metadatas = load_jsonl('./email_data/v0/hotel_reservation_emails.jsonl')
-        print(f"Loaded {len(email_metadatas)} email metadatas from file.")
-    
-    if not os.path.exists('./email_data/v0/hotel_reservation_emails_classification.jsonl'):
-        prompts = {
-            email_metadata['id']: f"Here is metadata for an email, is it a hotel reservation confirmation? Just answer True or False and nothing else. Metadata: {email_metadata}"
-            for email_metadata in email_metadatas
-        }
-        # batch_hotel_reservation_classification = batch_llm_calls(prompts)
-        batch_hotel_reservation_classification = run_groq_inference_batch_with_pool(prompts)
-        hotel_reservation_emails = [
-            email_metadata
-            for email_metadata in email_metadatas
-            if "True" == batch_hotel_reservation_classification.get(email_metadata['id'], 'False')
-        ]
-        save_to_jsonl('./email_data/v0/hotel_reservation_emails_classification.jsonl', hotel_reservation_emails)
-    else:
-        hotel_reservation_emails = load_jsonl('./email_data/v0/hotel_reservation_emails_classification.jsonl')
-        print(f"Loaded {len(hotel_reservation_emails)} hotel reservation emails from file.")
-
-    if not os.path.exists('./email_data/v0/full_hotel_reservation_emails.jsonl'):
-        msg_ids = [message['id'] for message in hotel_reservation_emails]
-        full_hotel_reservation_emails = get_full_email_batch(msg_ids)
-        save_to_jsonl('./email_data/v0/full_hotel_reservation_emails.jsonl', full_hotel_reservation_emails)
-    else:
-        full_hotel_reservation_emails = load_jsonl('./email_data/v0/full_hotel_reservation_emails.jsonl')
-        print(f"Loaded {len(full_hotel_reservation_emails)} full hotel reservation emails from file.")
-    print(f"Filtered down to {len(full_hotel_reservation_emails)} potential hotel reservation emails based on subject and other metadata.")
-
-
-    if not os.path.exists('./email_data/v0/full_hotel_reservation_emails_body_checked.jsonl'):
-        prompts = {
-            email_metadata['id']: f"Here is data for an email, is it a hotel reservation confirmation? Make sure to only keep hotel reservations (and filter out restaurant reservations and other travel related emails). Just answer True or False and nothing else. Metadata: {email_metadata}"
-            for email_metadata in full_hotel_reservation_emails
-        }
-        # batch_hotel_reservation_classification_full_email = batch_llm_calls(prompts)
-        batch_hotel_reservation_classification_full_email = run_groq_inference_batch_with_pool(prompts)
-        body_checked_filtered_hotel_reservation_emails = [
-            email_metadata
-            for email_metadata in full_hotel_reservation_emails
-            if "True" == batch_hotel_reservation_classification_full_email.get(email_metadata['id'], 'False')
-        ]
-        save_to_jsonl('./email_data/v0/full_hotel_reservation_emails_body_checked.jsonl', body_checked_filtered_hotel_reservation_emails)
-    else:
-        body_checked_filtered_hotel_reservation_emails = load_jsonl('./email_data/v0/full_hotel_reservation_emails_body_checked.jsonl')
-        print(f"Loaded {len(body_checked_filtered_hotel_reservation_emails)} body checked filtered hotel reservation emails from file.")
-
-    print(f"Filtered down to {len(body_checked_filtered_hotel_reservation_emails)} potential hotel reservation emails based on full email data including body.")
-
-    if not os.path.exists('./email_data/v0/hotel_reservation_key_insights.jsonl'):
-        prompts = {
-            email_metadata['id']: f""""
-            Here is data for a hotel reservation email. Please extract key insights from the email:
-            - hotel name
-            - check-in, check-out dates, month of year, season of year, is this a ski-week trip? a spring break trip? a summer trip? etc.
-            - location of the hotel, e.g. city, state, country, etc. what type of area is it? a beach, a mountain, a city, a town, etc.
-            - number of and age of guests
-            - total price, price per night, price per room, price per guest, etc.
-            - is the guest a type of loyalty program member of a hotel chain? What membership level?
-            - payment method (credit, debit, points, promotion, etc.)
-            - type of room or suite, views, great and unusual amenities like beach front, pool, gym, michelin dining, etc. (and obvious ones like free wifi, etc.)
-            - special requests made by guests (e.g. roses on arrival, baby crib, etc.)
-            - probable purpose of the trip: use the room type and number of guests to infer the purpose of the trip, e.g. business, family, couple, etc. 2 queen beds and 2 adults probably isn't a couple's getaway.
-            - any other key insights that would be helpful for a travel planner to know.
-
-            Email data:
-            {email_metadata}"
-            """
-            for email_metadata in body_checked_filtered_hotel_reservation_emails
-        }
-        # batch_hotel_reservation_key_insights = batch_llm_calls(prompts, model="meta-llama/llama-4-maverick-17b-128e-instruct")
-        batch_hotel_reservation_key_insights = run_groq_inference_batch_with_pool(prompts, model="meta-llama/llama-4-maverick-17b-128e-instruct")
-        hotel_reservation_key_insights = [
-            {
-                **email_metadata,
-                'key_insights': batch_hotel_reservation_key_insights.get(email_metadata['id'], '')
-            }
-            for email_metadata in body_checked_filtered_hotel_reservation_emails
-        ]
-        save_to_jsonl('./email_data/v0/hotel_reservation_key_insights.jsonl', hotel_reservation_key_insights)
-    else:
-        hotel_reservation_key_insights = load_jsonl('./email_data/v0/hotel_reservation_key_insights.jsonl')
-        print(f"Loaded {len(hotel_reservation_key_insights)} hotel reservation key insights from file.")
+        if args.streaming and not any(stage_exists(stage) for stage in STAGES):
+            print(f"Running all email stages as a streaming pipeline...")
+            with metrics.stage(context.qualified_name('streaming_pipeline')) as stage:
+                num_stage_outputs = run_streaming_hotel_reservation_stages(msg_ids)
+                stage.set_items(items_in=len(msg_ids), items_out=num_stage_outputs[HOTEL_RESERVATION_KEY_INSIGHTS_STAGE])
+        else:
+            print(f"Getting email metadatas...")
+            with metrics.stage(context.qualified_name(HOTEL_RESERVATION_EMAILS_STAGE)) as stage:
+                num_email_metadatas = run_journaled_stage(
+                    context.path(f'{HOTEL_RESERVATION_EMAILS_STAGE}.journal'),
+                    msg_ids,
+                    lambda pending_ids, journal: fetch_hotel_reservation_email_metadatas(pending_ids, journal=journal),
+                    lambda outputs: stage_store.replace(HOTEL_RESERVATION_EMAILS_STAGE, outputs),
+                )
+                stage.set_items(items_in=len(msg_ids), items_out=num_email_metadatas)
+        save_sync_checkpoint(context.path(SYNC_STATE_FILE_NAME), mailbox, history_id)
+
+    # Each stage streams its input from the previous stage's records in the stage store, a chunk
+    # at a time, instead of holding whole stages in memory.
+    if not stage_exists(HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE):
+        with metrics.stage(context.qualified_name(HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE)) as stage:
+            email_metadatas = stage_store.iter_records(HOTEL_RESERVATION_EMAILS_STAGE)
+            num_hotel_reservation_emails = run_stage_with_journal(HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE, email_metadatas, classify_hotel_reservation_metadatas)
+            stage.set_items(items_in=stage_store.count(HOTEL_RESERVATION_EMAILS_STAGE), items_out=num_hotel_reservation_emails)
+
+    if not stage_exists(FULL_HOTEL_RESERVATION_EMAILS_STAGE):
+        with metrics.stage(context.qualified_name(FULL_HOTEL_RESERVATION_EMAILS_STAGE)) as stage:
+            hotel_reservation_emails = stage_store.iter_records(HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE)
+            num_full_hotel_reservation_emails = run_stage_with_journal(FULL_HOTEL_RESERVATION_EMAILS_STAGE, hotel_reservation_emails, fetch_full_hotel_reservation_emails)
+            stage.set_items(items_in=stage_store.count(HOTEL_RESERVATION_EMAILS_CLASSIFICATION_STAGE), items_out=num_full_hotel_reservation_emails)
+    print(f"Filtered down to {stage_store.count(FULL_HOTEL_RESERVATION_EMAILS_STAGE)} potential hotel reservation emails based on subject and other metadata.")
+
+    if not stage_exists(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE):
+        with metrics.stage(context.qualified_name(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE)) as stage:
+            stage.set_items(items_in=stage_store.count(FULL_HOTEL_RESERVATION_EMAILS_STAGE))
+            # Confirmation, modification and reminder emails of one reservation only cost LLM calls once. Collapsed
+            # on the bodies, which carry the confirmation numbers and dates (subjects and snippets alone don't tell stays apart).
+            full_hotel_reservation_emails = iter_collapsed_stage_records(FULL_HOTEL_RESERVATION_EMAILS_STAGE)
+            num_body_checked_emails = run_stage_with_journal(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE, full_hotel_reservation_emails, body_check_hotel_reservation_emails)
+            stage.set_items(items_out=num_body_checked_emails)
+    print(f"Filtered down to {stage_store.count(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE)} potential hotel reservation emails based on full email data including body.")
+
+    if not stage_exists(HOTEL_RESERVATION_KEY_INSIGHTS_STAGE):
+        with metrics.stage(context.qualified_name(HOTEL_RESERVATION_KEY_INSIGHTS_STAGE)) as stage:
+            body_checked_emails = stage_store.iter_records(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE, with_bodies=True)
+            num_key_insights = run_stage_with_journal(HOTEL_RESERVATION_KEY_INSIGHTS_STAGE, body_checked_emails, extract_hotel_reservation_key_insights)
+            stage.set_items(items_in=stage_store.count(FULL_HOTEL_RESERVATION_EMAILS_BODY_CHECKED_STAGE), items_out=num_key_insights)
+    # Key insights are small structured records (bodies aren't loaded), the trip generation below needs all of them.
+    hotel_reservation_key_insights = load_stage(HOTEL_RESERVATION_KEY_INSIGHTS_STAGE)
     print("-" * 80)
     for email_data in hotel_reservation_key_insights[:DISPLAY_LIMIT]:
         print(f"{email_data['subject']}")
@@ -815,6 +1721,12 @@ def main():
         print("-" * 80)
         print()
 
+    # Trips, nights and spend are counted locally from the structured key insights, the LLM only gets the compact aggregate.
+    reservations_table = ReservationTable.from_key_insights(hotel_reservation_key_insights)
+    reservations_table.save(context.path(HOTEL_RESERVATIONS_TABLE_FILE_NAME))
+    reservations_summary = reservations_table.summary()
+    print(f"Reservations summary:\n{json.dumps(reservations_summary, indent=2)}\n")
+
     # Remove body from the email metadata since we extracted the key insights and we want to reduce token llm count.
     hotel_reservation_key_insights = [
         {
@@ -828,33 +1740,43 @@ def main():
     # trip_insights = generate_trip_insights(hotel_reservation_key_insights, os.getenv("OPENAI_API_KEY"), existing_trip_insights = trip_insights)
     # print(f"trip_insights:\n{trip_insights}")
 
-    # If too much data for context window, split into batches, and cycle through them while accumulating insights.
-    print(f"\nGenerating insights from hotel confirmation emails...\n")
-    trip_insights = ""
-    num_batches = (len(hotel_reservation_key_insights) + HOTEL_RESERVATION_EMAILS_BATCH_SIZE - 1) // HOTEL_RESERVATION_EMAILS_BATCH_SIZE
-    for i in range(0, len(hotel_reservation_key_insights), HOTEL_RESERVATION_EMAILS_BATCH_SIZE):
-        current_batch = hotel_reservation_key_insights[i:i + HOTEL_RESERVATION_EMAILS_BATCH_SIZE]
-        batch_num = i // HOTEL_RESERVATION_EMAILS_BATCH_SIZE + 1
-        print(f"Processing batch {batch_num}/{num_batches} ({len(current_batch)} emails)...")
-
-        # Call generate_trip_insights with the current batch and existing insights
-        trip_insights = generate_trip_insights(
-            current_batch,
-            os.getenv("OPENAI_API_KEY"),
-            existing_trip_insights=trip_insights  # Pass the accumulated insights
-        )
-
-        print(f"Processed batch {batch_num}/{num_batches} ({len(current_batch)} emails), current trip insights:\n{trip_insights}\n")
-
+    with metrics.stage(context.qualified_name('trip_insights')) as stage:
+        stage.set_items(items_in=len(reservations_table) or len(hotel_reservation_key_insights))
+        if len(reservations_table) > 0:
+            print(f"\nGenerating insights from the reservations summary...\n")
+            trip_insights = generate_trip_insights(reservations_summary, os.getenv("OPENAI_API_KEY"))
+            print(f"Trip insights:\n{trip_insights}\n")
+        else:
+            # No structured key insights (e.g. free-text ones from an older run): summarize the emails themselves.
+            trip_insights = generate_trip_insights_from_emails(hotel_reservation_key_insights, HOTEL_RESERVATION_EMAILS_BATCH_SIZE, args.sequential_insights)
 
     print(f"Generating up to {NUM_TRIPS_METADATA_TO_GENERATE} trip metadatas...")
     # hotel_reservation_key_insights # If too much data for context window, just send summarized trip_insights, works pretty well.
-    trip_jsons = generate_trips_metadatas([], trip_insights, NUM_TRIPS_METADATA_TO_GENERATE, os.getenv("OPENAI_API_KEY"))
+    with metrics.stage(context.qualified_name('trips_metadata')) as stage:
+        trip_jsons = generate_trips_metadatas(reservations_summary, trip_insights, NUM_TRIPS_METADATA_TO_GENERATE, os.getenv("OPENAI_API_KEY"))
+        stage.set_items(items_out=len(trip_jsons or []))
     # Pretty print the trip JSON data
     if trip_jsons:
         print("\n=== Generated Trip Metadata ===\n")
         print(json.dumps(trip_jsons, indent=4))
         print("\n=============================\n")
 
+    return trip_jsons
+
+def main():
+    args = parse_args()
+    configure_llm_router(args)
+    scan_mailbox(args)
+
+    print_llm_cache_stats()
+    llm_router.print_report()
+    get_email_preclassifier().print_stats()
+    for controller in [default_mailbox.gmail_concurrency, default_mailbox.gmail_batch_concurrency, groq_concurrency]:
+        controller.print_report()
+    default_mailbox.gmail_quota.print_report()
+    metrics.print_summary()
+    if args.profile:
+        metrics.write_report(PROFILE_DIR)
+
 if __name__ == "__main__":
     main()
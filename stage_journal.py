@@ -0,0 +1,183 @@
+import os
+import json
+import threading
+
+# Inputs handed to a journaled stage at once, so a stage streaming its inputs only holds one chunk.
+JOURNAL_CHUNK_SIZE = 1000
+
+def iter_chunks(items, chunk_size):
+    """Yield lists of up to chunk_size items of an iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+def _input_id(item):
+    # Stages get message IDs (stage 1) or records with an 'id'.
+    return item if isinstance(item, str) else item['id']
+
+
+class IncompleteStageError(Exception):
+    """Some inputs of a journaled stage have no journal record: they failed (e.g. LLM calls that
+    still failed after retries) and weren't given a result.
+
+    The stage isn't saved, its journal keeps the finished records so the next run only retries
+    the unfinished inputs.
+
+    Attributes:
+        journal_path: Path of the stage's journal.
+        unfinished_ids: IDs of the inputs without a journal record.
+    """
+
+    def __init__(self, journal_path, unfinished_ids):
+        super().__init__(f"{len(unfinished_ids)} inputs of {journal_path} didn't finish (e.g. {unfinished_ids[:5]}), "
+                         f"run again to retry them")
+        self.journal_path = journal_path
+        self.unfinished_ids = unfinished_ids
+
+
+class StageJournal:
+    """Append-only journal of the records a pipeline stage has finished, keyed by message ID.
+
+    Every finished input is journaled as soon as its result is known: with its output record, or
+    with a null output when the stage filtered it out. On restart the stage indexes the journal
+    and only processes inputs that aren't in it. Inputs that failed are not journaled, so they are
+    retried. Once the stage completes, compact() streams the final stage outputs, read back one at
+    a time by their offset in the journal, to the stage store and removes the journal.
+    """
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def index(self):
+        """Return {input ID: offset of its journal line, or None if the stage dropped it}.
+
+        The outputs aren't kept in memory, read them with iter_outputs().
+        """
+        offsets = {}
+        if not os.path.exists(self.journal_path):
+            return offsets
+        with open(self.journal_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line of a journal interrupted mid-write, that record is simply redone.
+                    entry = None
+                if entry is not None:
+                    offsets[entry['id']] = offset if entry['output'] is not None else None
+                offset += len(line)
+        return offsets
+
+    def iter_outputs(self, input_ids, offsets):
+        """Yield the journaled outputs of input_ids (skipping dropped ones) in that order, given index()."""
+        if not any(offsets.get(input_id) is not None for input_id in input_ids):
+            return
+        with open(self.journal_path, 'rb') as f:
+            for input_id in input_ids:
+                offset = offsets.get(input_id)
+                if offset is not None:
+                    f.seek(offset)
+                    yield json.loads(f.readline())['output']
+
+    def record(self, input_id, output=None):
+        """Journal one finished input (output None means the stage dropped it)."""
+        self.record_many([(input_id, output)])
+
+    def record_many(self, entries):
+        with self._lock:
+            if self._file is None:
+                dirname = os.path.dirname(self.journal_path)
+                if len(dirname.strip()) > 0:
+                    os.makedirs(dirname, exist_ok=True)
+                self._file = open(self.journal_path, 'a')
+                if self._file.tell() > 0 and not _ends_with_newline(self.journal_path):
+                    # Terminate a line torn by a crash, or the next entry would be glued to it and lost.
+                    self._file.write('\n')
+            for input_id, output in entries:
+                self._file.write(json.dumps({'id': input_id, 'output': output}) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def unfinished(self, input_ids, offsets):
+        """IDs of input_ids without a journal record, given index()."""
+        return [input_id for input_id in input_ids if input_id not in offsets]
+
+    def compact(self, save_outputs, input_ids, offsets=None):
+        """Save the outputs of input_ids (in that order) with save_outputs(iterable of outputs) and delete the journal.
+
+        Args:
+            save_outputs: Function (iterable of outputs) -> None.
+            input_ids: All the stage's input IDs, the order outputs are saved in.
+            offsets: index() of the journal, read here when not given.
+
+        Returns:
+            The number of outputs saved.
+        """
+        self.close()
+        if offsets is None:
+            offsets = self.index()
+        num_outputs = sum(1 for input_id in input_ids if offsets.get(input_id) is not None)
+        save_outputs(self.iter_outputs(input_ids, offsets))
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        return num_outputs
+
+
+def run_journaled_stage(journal_path, inputs, process_pending, save_outputs, chunk_size=JOURNAL_CHUNK_SIZE):
+    """Run a stage with crash recovery through a StageJournal.
+
+    Args:
+        journal_path: Path of the stage's journal file.
+        inputs: Iterable of the stage's inputs (message IDs, or records with an 'id'), in output
+            order. It is consumed chunk_size inputs at a time, so it can stream from the stage store.
+        process_pending: Function (inputs not journaled yet, journal) -> None, called once per
+            chunk, which must journal each input as it finishes.
+        save_outputs: Function (iterable of outputs) -> None saving the final stage outputs once
+            the stage completes.
+        chunk_size: Maximum number of inputs handed to process_pending at once.
+
+    Returns:
+        The number of stage outputs saved.
+
+    Raises:
+        IncompleteStageError: If some inputs weren't journaled by process_pending. Nothing is
+            saved then, the next run retries them.
+    """
+    journal = StageJournal(journal_path)
+    completed = journal.index()
+    if completed:
+        print(f"Resuming {journal_path}: {len(completed)} records already done.")
+
+    input_ids = []
+    try:
+        for chunk in iter_chunks(inputs, chunk_size):
+            chunk_ids = [_input_id(item) for item in chunk]
+            input_ids.extend(chunk_ids)
+            pending = [item for item, input_id in zip(chunk, chunk_ids) if input_id not in completed]
+            if pending:
+                process_pending(pending, journal)
+    finally:
+        journal.close()
+    offsets = journal.index()
+    unfinished_ids = journal.unfinished(input_ids, offsets)
+    if unfinished_ids:
+        raise IncompleteStageError(journal_path, unfinished_ids)
+    return journal.compact(save_outputs, input_ids, offsets)
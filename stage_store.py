@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+try:
+    import zstandard
+    _COMPRESSOR = zstandard.ZstdCompressor(level=6)
+    _DECOMPRESSOR = zstandard.ZstdDecompressor()
+except ImportError:
+    # zstandard missing: bodies are stored uncompressed (still apart from the metadata).
+    _COMPRESSOR = None
+    _DECOMPRESSOR = None
+
+ITER_FETCH_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+
+def _encode_body(body):
+    data = body.encode('utf-8')
+    if _COMPRESSOR is None:
+        return b'R' + data
+    return b'Z' + _COMPRESSOR.compress(data)
+
+def _decode_body(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:1] == b'Z':
+        if _DECOMPRESSOR is None:
+            raise RuntimeError("Stage store body is zstd compressed, install zstandard to read it")
+        return _DECOMPRESSOR.decompress(blob[1:]).decode('utf-8')
+    return blob[1:].decode('utf-8')
+
+
+class StageStore:
+    """SQLite store for the email pipeline stage outputs, indexed by stage and message ID.
+
+    Each stage's records are stored without their 'body', which goes (zstd compressed, once per
+    message) to a separate table shared by every stage, so metadata reads never decode bodies.
+    Reads stream through iterators, single messages are looked up by ID and appends are plain
+    inserts, so memory doesn't grow with the mailbox the way whole-file JSONL rewrites do.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._connection = None
+
+    @property
+    def _conn(self):
+        """SQLite connection, opened (and the schema created) on first use."""
+        if self._connection is not None:
+            return self._connection
+        dirname = os.path.dirname(self.db_path)
+        if len(dirname.strip()) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                has_body INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (stage, id)
+            );
+            CREATE TABLE IF NOT EXISTS bodies (
+                id TEXT PRIMARY KEY,
+                body BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stages (
+                stage TEXT PRIMARY KEY,
+                completed_at INTEGER NOT NULL
+            );
+        """)
+        conn.commit()
+        self._connection = conn
+        return conn
+
+    def _insert(self, stage, records):
+        num_records = 0
+        for record in records:
+            record = dict(record)
+            body = record.pop('body', None)
+            if body is not None:
+                self._conn.execute("INSERT OR REPLACE INTO bodies (id, body) VALUES (?, ?)", (record['id'], _encode_body(body)))
+            # Delete first so a re-appended record moves to the end, like an appended JSONL line.
+            self._conn.execute("DELETE FROM records WHERE stage = ? AND id = ?", (stage, record['id']))
+            self._conn.execute(
+                "INSERT INTO records (stage, id, data, has_body) VALUES (?, ?, ?, ?)",
+                (stage, record['id'], json.dumps(record), int(body is not None)),
+            )
+            num_records += 1
+        return num_records
+
+    def append_all(self, records_by_stage):
+        """Append records to several stages in one transaction (all or nothing)."""
+        with self._lock, self._conn:
+            for stage, records in records_by_stage.items():
+                self._insert(stage, records)
+
+    def append(self, stage, records):
+        self.append_all({stage: records})
+
+    def replace(self, stage, records):
+        """Replace a stage's records and mark it complete, in one transaction."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE stage = ?", (stage,))
+            num_records = self._insert(stage, records)
+            self._conn.execute("INSERT OR REPLACE INTO stages (stage, completed_at) VALUES (?, ?)", (stage, int(time.time())))
+        print(f"Saved {num_records} records to stage {stage}")
+
+    def import_jsonl(self, stage, file_path):
+        """Import a stage JSONL file (written by earlier versions) line by line and mark the stage complete."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE stage = ?", (stage,))
+            num_records = 0
+            with open(file_path, 'r') as f:
+                chunk = []
+                for line in f:
+                    if line.strip():
+                        chunk.append(json.loads(line))
+                    if len(chunk) >= IMPORT_CHUNK_SIZE:
+                        num_records += self._insert(stage, chunk)
+                        chunk = []
+                num_records += self._insert(stage, chunk)
+            self._conn.execute("INSERT OR REPLACE INTO stages (stage, completed_at) VALUES (?, ?)", (stage, int(time.time())))
+        print(f"Imported {num_records} records from {file_path} into stage {stage}")
+
+    def is_complete(self, stage):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM stages WHERE stage = ?", (stage,)).fetchone() is not None
+
+    def count(self, stage):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records WHERE stage = ?", (stage,)).fetchone()[0]
+
+    def _query(self, sql, params):
+        """Yield rows of a query in chunks, without holding the lock between chunks."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(sql, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(ITER_FETCH_SIZE)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def ids(self, stage):
+        for (msg_id,) in self._query("SELECT id FROM records WHERE stage = ? ORDER BY seq", (stage,)):
+            yield msg_id
+
+    def iter_records(self, stage, with_bodies=False):
+        """Yield a stage's records in insertion order, with their 'body' only if with_bodies."""
+        if not with_bodies:
+            for (data,) in self._query("SELECT data FROM records WHERE stage = ? ORDER BY seq", (stage,)):
+                yield json.loads(data)
+            return
+        sql = """
+            SELECT r.data, CASE WHEN r.has_body THEN b.body END
+            FROM records r LEFT JOIN bodies b ON b.id = r.id
+            WHERE r.stage = ? ORDER BY r.seq
+        """
+        for data, body in self._query(sql, (stage,)):
+            record = json.loads(data)
+            if body is not None:
+                record['body'] = _decode_body(body)
+            yield record
+
+    def get(self, stage, msg_id, with_body=True):
+        """Return one record of a stage by message ID, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.data, CASE WHEN r.has_body THEN b.body END FROM records r LEFT JOIN bodies b ON b.id = r.id WHERE r.stage = ? AND r.id = ?",
+                (stage, msg_id),
+            ).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        if with_body and row[1] is not None:
+            record['body'] = _decode_body(row[1])
+        return record
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
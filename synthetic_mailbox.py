@@ -0,0 +1,258 @@
+import re
+import base64
+import random
+import datetime
+from email.utils import formatdate
+
+BENCHMARK_EMAIL_ADDRESS = 'benchmark@example.com'
+
+# Hotels of the synthetic corpus. Domains outside of email_preclassifier's lists make the
+# pre-classifier undecided, so those emails go through the LLM stages.
+SYNTHETIC_HOTELS = [
+    {'name': 'Hyatt Regency Lake Tahoe', 'city': 'Incline Village', 'country': 'USA', 'domain': 'hyatt.com', 'currency': 'USD'},
+    {'name': 'St. Regis San Francisco', 'city': 'San Francisco', 'country': 'USA', 'domain': 'marriott.com', 'currency': 'USD'},
+    {'name': 'Hilton Hawaiian Village Waikiki', 'city': 'Honolulu', 'country': 'USA', 'domain': 'hilton.com', 'currency': 'USD'},
+    {'name': 'Rosewood Miramar Beach', 'city': 'Montecito', 'country': 'USA', 'domain': 'rosewoodhotels.com', 'currency': 'USD'},
+    {'name': 'Le Bristol Paris', 'city': 'Paris', 'country': 'France', 'domain': 'oetkercollection.com', 'currency': 'EUR'},
+    {'name': 'Hotel Sacher Wien', 'city': 'Vienna', 'country': 'Austria', 'domain': 'booking.com', 'currency': 'EUR'},
+    {'name': 'Park Hyatt Tokyo', 'city': 'Tokyo', 'country': 'Japan', 'domain': 'hyatt.com', 'currency': 'JPY'},
+    {'name': 'Chalet Alpenrose Zermatt', 'city': 'Zermatt', 'country': 'Switzerland', 'domain': 'alpenrose-zermatt.ch', 'currency': 'CHF'},
+    {'name': 'Casa Palopo Lodge', 'city': 'Santa Catarina Palopo', 'country': 'Guatemala', 'domain': 'casapalopo.example', 'currency': 'USD'},
+    {'name': 'The Lodge at Blue Sky', 'city': 'Park City', 'country': 'USA', 'domain': 'expedia.com', 'currency': 'USD'},
+]
+SYNTHETIC_RESTAURANTS = ['Nopa', 'Le Comptoir du Relais', 'Sushi Saito', 'Zuni Cafe', 'Osteria Francescana']
+SYNTHETIC_AIRLINES = [('United Airlines', 'united.com'), ('Delta', 'delta.com'), ('Swiss', 'swiss.example')]
+ROOM_TYPES = ['1 King Bed Deluxe Room', '2 Queen Beds, Pool View', 'Ocean View Suite, 1 King and 2 Queen beds', 'Junior Suite, Mountain View']
+RATE_PLANS = ['Best Available Rate', 'Advance Purchase, Non-refundable', 'Member Rate with Breakfast']
+PAYMENT_METHODS = ['credit card', 'debit card', 'points', 'credit card']
+LOYALTY_TIERS = [None, 'World of Hyatt Globalist', 'Marriott Bonvoy Platinum', 'Hilton Honors Gold']
+
+# Share of each kind of email in the corpus. Only 'other' never matches the search keywords.
+EMAIL_KIND_WEIGHTS = {
+    'hotel_confirmation': 0.25,
+    'hotel_undecided': 0.10,  # Property domain unknown to the pre-classifier
+    'hotel_modification': 0.05,  # Near-duplicate of an earlier confirmation
+    'hotel_reply': 0.03,  # Reply in a reservation thread, dropped by the metadata stage
+    'hotel_promotion': 0.07,
+    'restaurant': 0.10,
+    'flight': 0.10,
+    'other': 0.30,
+}
+# Terms & conditions paragraph repeated to give reservation emails realistic body sizes.
+POLICY_PARAGRAPH = (
+    "Cancellations made less than 48 hours before the arrival date will be charged one night. Check-in is from "
+    "3:00 PM and check-out until 11:00 AM. Rates are per room per night and exclude local taxes and resort fees. "
+)
+PDF_ATTACHMENT_BYTES = 180 * 1024
+# Plain text parts above this size are served behind an attachment ID, like Gmail does for large parts.
+INLINE_TEXT_PART_MAX_BYTES = 6 * 1024
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def _normalize(text):
+    return ' '.join(text.split()).lower()
+
+
+class SyntheticMailbox:
+    """Deterministic corpus of reservation and non-reservation emails, rendered as Gmail API resources.
+
+    Emails are spread over the last num_years (more of them recently, like a real mailbox) and
+    support the subset of the Gmail search syntax the pipeline uses: OR-ed quoted phrases and
+    after:/before: epoch seconds.
+    """
+
+    def __init__(self, num_emails=2000, num_years=5, seed=0):
+        rng = random.Random(seed)
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        kinds = list(EMAIL_KIND_WEIGHTS)
+        weights = list(EMAIL_KIND_WEIGHTS.values())
+        self.emails = []
+        confirmations = []
+        for i in range(num_emails):
+            # The density of ages falls linearly to zero at num_years: mailboxes get more mail over time.
+            age_seconds = int(num_years * 365 * 86400 * (1 - (1 - rng.random()) ** 0.5))
+            kind = rng.choices(kinds, weights)[0]
+            if kind in ('hotel_modification', 'hotel_reply') and not confirmations:
+                kind = 'hotel_confirmation'
+            email = self._build_email(rng, f'{0x18a0000000000000 + i:x}', now - age_seconds, kind, confirmations)
+            if kind == 'hotel_confirmation':
+                confirmations.append(email)
+            self.emails.append(email)
+        self.emails.sort(key=lambda email: -email['internal_date'])
+        self.emails_by_id = {email['id']: email for email in self.emails}
+        self.history_id = 1000 + num_emails
+
+    def _build_email(self, rng, msg_id, internal_date, kind, confirmations):
+        email = {'id': msg_id, 'thread_id': msg_id, 'internal_date': internal_date, 'kind': kind, 'in_reply_to': None, 'pdf': False}
+        if kind in ('hotel_confirmation', 'hotel_undecided', 'hotel_modification', 'hotel_reply'):
+            if kind in ('hotel_modification', 'hotel_reply'):
+                original = rng.choice(confirmations)
+                reservation = dict(original['reservation'])
+                email['thread_id'] = original['thread_id']
+                if kind == 'hotel_reply':
+                    email['in_reply_to'] = f"<{original['id']}@{reservation['domain']}>"
+            else:
+                hotel = rng.choice(SYNTHETIC_HOTELS)
+                check_in = datetime.date.fromtimestamp(internal_date) + datetime.timedelta(days=rng.randint(7, 120))
+                nights = rng.randint(1, 9)
+                reservation = {
+                    **hotel,
+                    'domain': hotel['domain'] if kind == 'hotel_confirmation' else re.sub(r'[^a-z]', '', hotel['name'].lower()) + '.example',
+                    'confirmation_number': f'{rng.randint(10 ** 7, 10 ** 8 - 1)}',
+                    'check_in': check_in.isoformat(),
+                    'check_out': (check_in + datetime.timedelta(days=nights)).isoformat(),
+                    'guests': rng.randint(1, 5),
+                    'room_type': rng.choice(ROOM_TYPES),
+                    'rate_plan': rng.choice(RATE_PLANS),
+                    'total_price': round(nights * rng.uniform(180, 1400), 2),
+                    'payment_method': rng.choice(PAYMENT_METHODS),
+                    'loyalty_tier': rng.choice(LOYALTY_TIERS),
+                }
+            email['reservation'] = reservation
+            email['sender'] = f"{reservation['name']} <reservations@{reservation['domain']}>"
+            email['subject'] = {
+                'hotel_confirmation': f"Reservation Confirmation #{reservation['confirmation_number']} - {reservation['name']}",
+                'hotel_undecided': f"Your upcoming stay at {reservation['name']}",
+                'hotel_modification': f"Updated: Reservation Confirmation #{reservation['confirmation_number']} - {reservation['name']}",
+                'hotel_reply': f"Re: Your Hotel Reservation at {reservation['name']}",
+            }[kind]
+            email['body'] = self._reservation_body(rng, reservation, kind)
+            email['pdf'] = rng.random() < 0.3
+        elif kind == 'hotel_promotion':
+            hotel = rng.choice(SYNTHETIC_HOTELS)
+            email['sender'] = f"{hotel['name']} <offers@{hotel['domain']}>"
+            email['subject'] = f"Special offer: upgrade your Room Type at {hotel['name']}"
+            email['body'] = f"Book a Room Reservation at {hotel['name']} this season and save 20%. Use Voucher Code SUMMER24.\n" + POLICY_PARAGRAPH
+        elif kind == 'restaurant':
+            restaurant = rng.choice(SYNTHETIC_RESTAURANTS)
+            domain = rng.choice(['opentable.com', 'resy.com', 'bistro.example'])
+            email['sender'] = f"{restaurant} <noreply@{domain}>"
+            email['subject'] = f"Your reservation details at {restaurant}"
+            email['body'] = (f"Guest Name: Alex Benchmark\nParty of {rng.randint(2, 6)} at {restaurant}.\n"
+                             f"Payment Confirmation: a deposit of $50 was charged.\n")
+        elif kind == 'flight':
+            airline, domain = rng.choice(SYNTHETIC_AIRLINES)
+            email['sender'] = f"{airline} <receipts@{domain}>"
+            email['subject'] = f"{airline} Receipt Email for your trip"
+            email['body'] = (f"Payment Confirmation for your {airline} itinerary.\nDeparture Date: "
+                             f"{datetime.date.fromtimestamp(internal_date) + datetime.timedelta(days=30)}\nSeat 14C.\n")
+        else:
+            email['sender'] = 'Team <team@work.example>'
+            email['subject'] = rng.choice(['Weekly sync notes', 'Lunch on Friday?', 'Q3 planning doc', 'Photos from the weekend'])
+            email['body'] = 'See the notes below.\n' + 'Lorem ipsum dolor sit amet. ' * rng.randint(5, 40)
+        email['search_text'] = _normalize(f"{email['subject']} {email['body']}")
+        return email
+
+    def _reservation_body(self, rng, reservation, kind):
+        lines = [
+            'Dear Alex Benchmark,',
+            f"Thank you for your Hotel Reservation at {reservation['name']}, {reservation['city']}, {reservation['country']}."
+            if kind != 'hotel_reply' else f"Thank you for your message about your stay at {reservation['name']}.",
+            f"Confirmation Number: {reservation['confirmation_number']}",
+            'Guest Name: Alex Benchmark',
+            f"Arrival Date: {reservation['check_in']}",
+            f"Departure Date: {reservation['check_out']}",
+            f"Room Type: {reservation['room_type']}",
+            f"Guests: {reservation['guests']}",
+            f"Rate Plan: {reservation['rate_plan']}",
+            f"Total: {reservation['total_price']:.2f} {reservation['currency']}",
+            f"Payment: {reservation['payment_method']}",
+        ]
+        if reservation['loyalty_tier']:
+            lines.append(f"Loyalty: {reservation['loyalty_tier']}")
+        return '\n'.join(lines) + '\n\n' + POLICY_PARAGRAPH * rng.randint(3, 30)
+
+    def search(self, query):
+        """Emails matching a Gmail query, newest first."""
+        phrases = [_normalize(phrase) for phrase in re.findall(r'"([^"]+)"', query or '')]
+        after = re.search(r'\bafter:(\d+)', query or '')
+        before = re.search(r'\bbefore:(\d+)', query or '')
+        return [
+            email for email in self.emails
+            if (not phrases or any(phrase in email['search_text'] for phrase in phrases))
+            and (not after or email['internal_date'] > int(after.group(1)))
+            and (not before or email['internal_date'] < int(before.group(1)))
+        ]
+
+    def headers(self, email):
+        headers = [
+            {'name': 'From', 'value': email['sender']},
+            {'name': 'To', 'value': BENCHMARK_EMAIL_ADDRESS},
+            {'name': 'Subject', 'value': email['subject']},
+            {'name': 'Date', 'value': formatdate(email['internal_date'])},
+            {'name': 'Message-ID', 'value': f"<{email['id']}@synthetic.example>"},
+        ]
+        if email['in_reply_to']:
+            headers.append({'name': 'In-Reply-To', 'value': email['in_reply_to']})
+        return headers
+
+    def _payload(self, email):
+        text = email['body'].encode('utf-8')
+        html = f"<html><body><p>{email['body'].replace(chr(10), '<br>')}</p></body></html>".encode('utf-8')
+        text_body = {'size': len(text)}
+        if len(text) > INLINE_TEXT_PART_MAX_BYTES:
+            text_body['attachmentId'] = f"{email['id']}_text"
+        else:
+            text_body['data'] = _b64(text)
+        parts = [{
+            'partId': '0',
+            'mimeType': 'multipart/alternative',
+            'filename': '',
+            'body': {'size': 0},
+            'parts': [
+                {'partId': '0.0', 'mimeType': 'text/plain', 'filename': '', 'body': text_body},
+                {'partId': '0.1', 'mimeType': 'text/html', 'filename': '', 'body': {'size': len(html), 'data': _b64(html)}},
+            ],
+        }]
+        if email['pdf']:
+            parts.append({
+                'partId': '1',
+                'mimeType': 'application/pdf',
+                'filename': 'confirmation.pdf',
+                'body': {'size': PDF_ATTACHMENT_BYTES, 'attachmentId': f"{email['id']}_pdf"},
+            })
+        return {'partId': '', 'mimeType': 'multipart/mixed', 'filename': '', 'headers': self.headers(email), 'body': {'size': 0}, 'parts': parts}
+
+    def message(self, msg_id, format='full', metadata_headers=None, fields=None):
+        """A users.messages resource as messages().get() returns it, None for an unknown ID.
+
+        A fields mask only drops the headers, snippet and labels (what the pipeline's masks leave out).
+        """
+        email = self.emails_by_id.get(msg_id)
+        if email is None:
+            return None
+        message = {
+            'id': email['id'],
+            'threadId': email['thread_id'],
+            'labelIds': ['INBOX'],
+            'snippet': ' '.join(email['body'].split())[:140],
+            'historyId': str(self.history_id),
+            'internalDate': str(email['internal_date'] * 1000),
+            'sizeEstimate': len(email['body']) * 2 + (PDF_ATTACHMENT_BYTES if email['pdf'] else 0) + 1500,
+        }
+        if format == 'minimal':
+            return message
+        if format == 'metadata':
+            wanted = {name.lower() for name in metadata_headers} if metadata_headers else None
+            message['payload'] = {
+                'mimeType': 'multipart/mixed',
+                'headers': [header for header in self.headers(email) if wanted is None or header['name'].lower() in wanted],
+            }
+            return message
+        message['payload'] = self._payload(email)
+        if fields:
+            message = {key: value for key, value in message.items() if key in ('id', 'threadId', 'sizeEstimate', 'payload')}
+            message['payload'] = {key: value for key, value in message['payload'].items() if key != 'headers'}
+        return message
+
+    def attachment(self, msg_id, attachment_id):
+        email = self.emails_by_id.get(msg_id)
+        if email is None or not attachment_id.startswith(msg_id):
+            return None
+        if attachment_id.endswith('_text'):
+            data = email['body'].encode('utf-8')
+        else:
+            data = b'%PDF-1.4 synthetic' + b'\0' * (PDF_ATTACHMENT_BYTES - 18)
+        return {'size': len(data), 'data': _b64(data)}
@@ -0,0 +1,93 @@
+import pytest
+
+import concurrency_controller
+from concurrency_controller import AIMDConcurrencyController
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(concurrency_controller.time, 'monotonic', fake_clock)
+    return fake_clock
+
+def complete(controller, count, **outcome):
+    for _ in range(count):
+        controller.acquire()
+        controller.release(**outcome)
+
+def test_limit_grows_by_one_after_a_full_healthy_window(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=4, max_limit=10)
+    complete(controller, 3, latency=0.1)
+    assert controller.limit == 4
+    complete(controller, 1, latency=0.1)
+    assert controller.limit == 5
+    # The next window is as large as the new limit.
+    complete(controller, 4, latency=0.1)
+    assert controller.limit == 5
+    complete(controller, 1, latency=0.1)
+    assert controller.limit == 6
+
+def test_limit_never_grows_past_max_limit(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=2, max_limit=3)
+    complete(controller, 50, latency=0.1)
+    assert controller.limit == 3
+
+def test_throttling_halves_the_limit(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=16)
+    complete(controller, 1, throttled=True)
+    assert controller.limit == 8
+    assert controller.num_throttled == 1
+
+def test_slow_requests_decrease_the_limit(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=10, latency_threshold=2.0)
+    complete(controller, 1, latency=1.0)
+    assert controller.limit == 10
+    complete(controller, 1, latency=3.0)
+    assert controller.limit == 5
+    assert controller.num_throttled == 0
+
+def test_a_burst_of_429s_decreases_once_per_cooldown(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=16, decrease_cooldown=1.0)
+    complete(controller, 5, throttled=True)
+    assert controller.limit == 8
+    clock.advance(1.0)
+    complete(controller, 1, throttled=True)
+    assert controller.limit == 4
+
+def test_limit_never_drops_below_min_limit(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=4, min_limit=2, decrease_cooldown=0)
+    complete(controller, 5, throttled=True)
+    assert controller.limit == 2
+
+def test_throttling_restarts_the_healthy_window(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=4)
+    complete(controller, 3, latency=0.1)
+    complete(controller, 1, throttled=True)
+    assert controller.limit == 2
+    complete(controller, 1, latency=0.1)
+    assert controller.limit == 2
+    complete(controller, 1, latency=0.1)
+    assert controller.limit == 3
+
+def test_failures_neither_increase_nor_decrease(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=2)
+    complete(controller, 10, failed=True)
+    assert controller.limit == 2
+    assert controller.num_failed == 10
+
+def test_slot_counts_exceptions_as_failures(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=2)
+    with pytest.raises(RuntimeError):
+        with controller.slot():
+            raise RuntimeError("boom")
+    with controller.slot() as slot:
+        slot.mark_throttled()
+    assert controller.in_flight == 0
+    assert controller.num_failed == 1
+    assert controller.limit == 1
+
+def test_history_records_every_limit_change(clock):
+    controller = AIMDConcurrencyController('test', initial_limit=2)
+    complete(controller, 2, latency=0.1)
+    clock.advance(0.5)
+    complete(controller, 1, throttled=True)
+    assert controller.history == [(0.0, 2), (0.0, 3), (0.5, 1)]
@@ -0,0 +1,76 @@
+from email_dedup import collapse_duplicate_emails, extract_confirmation_numbers
+
+SENDER = 'The Little Nell <reservations@thelittlenell.com>'
+BODY = """Dear Jane Doe,
+Thank you for choosing The Little Nell. Your reservation is confirmed.
+Confirmation Number: {number}
+Check-in: Friday, February 14, 2025   Check-out: Monday, February 17, 2025
+Room Type: Deluxe King Room, Mountain View   Guests: 2 Adults
+Total for stay: $4,385.00 USD (including taxes and fees)
+We look forward to welcoming you to Aspen."""
+
+
+def email(email_id, number=None, body=True, subject='Your reservation at The Little Nell', date='Mon, 6 Jan 2025 10:00:00 +0000', sender=SENDER):
+    text = BODY.format(number=number) if number else BODY.replace('Confirmation Number: {number}\n', '')
+    record = {'id': email_id, 'sender': sender, 'subject': subject, 'date': date, 'snippet': text[:120]}
+    record['body'] = text if body else 'Unknown body'
+    return record
+
+def kept_ids(emails):
+    return [kept['id'] for kept in collapse_duplicate_emails(emails)]
+
+def test_extract_confirmation_numbers():
+    assert extract_confirmation_numbers('Confirmation Number: 73920184') == {'73920184'}
+    assert extract_confirmation_numbers('Your booking #ab-12345 is confirmed') == {'AB-12345'}
+    # Must contain a digit, "confirmation details" isn't a number.
+    assert extract_confirmation_numbers('See your confirmation details below') == set()
+
+def test_same_confirmation_number_collapses_to_the_most_complete_email():
+    reminder = email('reminder', '73920184', subject='Reminder: your reservation at The Little Nell', date='Mon, 10 Feb 2025 10:00:00 +0000')
+    reminder['body'] = 'Reminder: Confirmation Number: 73920184. See you soon in Aspen.'
+    emails = [email('confirmation', '73920184'), reminder]
+    collapsed = collapse_duplicate_emails(emails)
+    assert [kept['id'] for kept in collapsed] == ['confirmation']
+    assert collapsed[0]['duplicate_ids'] == ['reminder']
+
+def test_near_identical_bodies_collapse_to_the_most_recent():
+    modified = email('modified', subject='Updated: your reservation at The Little Nell', date='Tue, 7 Jan 2025 10:00:00 +0000')
+    modified['body'] = modified['body'].replace('2 Adults', '2 Adults, 1 Child')
+    collapsed = collapse_duplicate_emails([email('original'), modified])
+    assert [kept['id'] for kept in collapsed] == ['modified']
+    assert collapsed[0]['duplicate_ids'] == ['original']
+
+def test_different_confirmation_numbers_are_never_merged():
+    # Same template and hotel, two different stays: near-identical text, different numbers.
+    emails = [email('first', '73920184'), email('second', '73920185'), email('third', '73920184')]
+    collapsed = collapse_duplicate_emails(emails)
+    assert [kept['id'] for kept in collapsed] == ['first', 'second']
+    assert collapsed[0]['duplicate_ids'] == ['third']
+    assert 'duplicate_ids' not in collapsed[1]
+
+def test_different_numbers_are_not_merged_through_a_third_email():
+    # The email without a number is similar to both, it must not bridge the two reservations.
+    emails = [email('first', '73920184'), email('bridge'), email('second', '73920185')]
+    kept = kept_ids(emails)
+    assert 'first' in kept and 'second' in kept
+
+def test_metadata_only_emails_are_not_merged_on_similar_text():
+    # Without bodies, two stays at one hotel look the same (subject and snippet).
+    emails = [email('first', body=False), email('second', body=False, date='Mon, 3 Mar 2025 10:00:00 +0000')]
+    assert kept_ids(emails) == ['first', 'second']
+
+def test_metadata_only_emails_merge_on_a_shared_confirmation_number():
+    first = email('first', body=False)
+    second = email('second', body=False)
+    first['snippet'] = 'Your reservation is confirmed. Confirmation Number: 73920184'
+    second['snippet'] = 'Reminder for confirmation number 73920184'
+    assert kept_ids([first, second]) == ['first']
+
+def test_different_sender_domains_are_never_merged():
+    emails = [email('nell'), email('booking', sender='Booking.com <noreply@booking.com>')]
+    assert kept_ids(emails) == ['nell', 'booking']
+
+def test_earlier_duplicates_are_carried_over():
+    first = {**email('first', '73920184'), 'duplicate_ids': ['older']}
+    collapsed = collapse_duplicate_emails([first, email('second', '73920184')])
+    assert collapsed[0]['duplicate_ids'] == ['older', 'second']
@@ -0,0 +1,163 @@
+import pytest
+
+import hotel_collection_stats
+from hotel_collection_stats import CollectionStatsCache, INGEST_MARKERS_COLLECTION, collection_stats_pipeline
+
+CITY_FILTERS = [('city', {'address_obj.city': 'Aspen'})]
+TTL_SECONDS = 600
+REFRESH_SECONDS = 60
+
+
+class FakeMarkers:
+    def __init__(self):
+        self.version = None
+        self.reads = 0
+
+    def find_one(self, query):
+        self.reads += 1
+        return {'_id': query['_id'], 'version': self.version} if self.version else None
+
+
+class FakeHotels:
+    """Answers the stats aggregation with fixed counts and counts the aggregations."""
+
+    name = 'tripadvisor-hotel_review'
+
+    def __init__(self):
+        self.markers = FakeMarkers()
+        self.database = {INGEST_MARKERS_COLLECTION: self.markers}
+        self.aggregations = 0
+        self.before_aggregate = None
+
+    def aggregate(self, pipeline):
+        self.aggregations += 1
+        if self.before_aggregate:
+            self.before_aggregate()
+        result = {name: [{'count': 3}] for name in pipeline[-1]['$facet']}
+        result['price_levels'] = [{'_id': '$$$$', 'count': 5}]
+        return iter([result])
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(hotel_collection_stats.time, 'time', fake_clock)
+    return fake_clock
+
+@pytest.fixture
+def hotels():
+    return FakeHotels()
+
+@pytest.fixture
+def cache(hotels):
+    return CollectionStatsCache(hotels, ttl_seconds=TTL_SECONDS, refresh_seconds=REFRESH_SECONDS)
+
+def test_pipeline_projects_the_counted_fields_before_the_facet():
+    pipeline = collection_stats_pipeline(CITY_FILTERS, '$$$$')
+    assert list(pipeline[0]) == ['$project']
+    assert set(pipeline[0]['$project']) == {'_id', 'address_obj.city', 'address_obj.state', 'address_obj.country', 'price_level'}
+    assert set(pipeline[1]['$facet']) == {'total', 'with_city', 'price_levels', 'city', 'city_price_level'}
+
+def test_stats_are_parsed(clock, cache):
+    stats = cache.get(CITY_FILTERS, '$$$$')
+    assert stats['total_hotels'] == 3
+    assert stats['price_level_hotels'] == 5
+    assert stats['location_hotels'] == {'city': 3, 'city_price_level': 3}
+
+def test_stats_are_cached_until_the_ttl(clock, hotels, cache):
+    first = cache.get(CITY_FILTERS, '$$$$')
+    clock.advance(TTL_SECONDS - 1)
+    assert cache.get(CITY_FILTERS, '$$$$') is first
+    assert hotels.aggregations == 1
+    clock.advance(1)
+    assert cache.get(CITY_FILTERS, '$$$$') is not first
+    assert hotels.aggregations == 2
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+def test_destinations_and_price_levels_are_cached_separately(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    cache.get(CITY_FILTERS, '$$')
+    cache.get([], '$$$$')
+    assert hotels.aggregations == 3
+    assert cache.stats()['entries'] == 3
+
+def test_invalidate_drops_the_entries(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    cache.invalidate()
+    cache.get(CITY_FILTERS, '$$$$')
+    assert hotels.aggregations == 2
+    assert cache.stats()['invalidations'] == 1
+
+def test_a_result_computed_across_an_invalidate_is_not_stored(clock, hotels, cache):
+    hotels.before_aggregate = cache.invalidate
+    cache.get(CITY_FILTERS, '$$$$')
+    hotels.before_aggregate = None
+    assert cache.stats()['entries'] == 0
+
+def test_get_notices_an_ingest_once_the_entry_is_older_than_the_refresh_interval(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    hotels.markers.version = 1
+    clock.advance(REFRESH_SECONDS - 1)
+    cache.get(CITY_FILTERS, '$$$$')
+    assert hotels.aggregations == 1
+    clock.advance(1)
+    cache.get(CITY_FILTERS, '$$$$')
+    assert hotels.aggregations == 2
+    assert cache.stats()['invalidations'] == 1
+
+def test_get_reads_the_ingest_marker_at_most_once_per_refresh_interval(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    clock.advance(REFRESH_SECONDS)
+    reads = hotels.markers.reads
+    for _ in range(10):
+        cache.get(CITY_FILTERS, '$$$$')
+    assert hotels.markers.reads == reads + 1
+    assert hotels.aggregations == 1
+
+def test_a_result_computed_across_an_ingest_is_not_stored(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$')
+
+    def ingest():
+        hotels.markers.version = 1
+        cache.check_ingest_version()
+
+    hotels.before_aggregate = ingest
+    cache.get(CITY_FILTERS, '$$$$')
+    hotels.before_aggregate = None
+    assert cache.stats()['entries'] == 0
+
+def test_refresh_drops_everything_after_an_ingest(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    cache.refresh()
+    assert cache.stats()['entries'] == 1
+    hotels.markers.version = 1
+    cache.refresh()
+    assert cache.stats()['entries'] == 0
+    assert hotels.aggregations == 1
+
+def test_refresh_recomputes_entries_past_half_their_ttl(clock, hotels, cache):
+    first = cache.get(CITY_FILTERS, '$$$$')
+    clock.advance(TTL_SECONDS / 2 - 1)
+    cache.refresh()
+    assert hotels.aggregations == 1
+    clock.advance(1)
+    cache.get(CITY_FILTERS, '$$$$')
+    cache.refresh()
+    assert hotels.aggregations == 2
+    clock.advance(TTL_SECONDS / 2)
+    # Still fresh thanks to the refresh, no aggregation on the read.
+    assert cache.get(CITY_FILTERS, '$$$$') is not first
+    assert hotels.aggregations == 2
+
+def test_refresh_evicts_entries_not_read_within_the_ttl(clock, hotels, cache):
+    cache.get(CITY_FILTERS, '$$$$')
+    cache.get(CITY_FILTERS, '$$')
+    clock.advance(TTL_SECONDS / 2)
+    cache.get(CITY_FILTERS, '$$')
+    clock.advance(TTL_SECONDS / 2)
+    cache.refresh()
+    stats = cache.stats()
+    assert stats['entries'] == 1
+    assert stats['evictions'] == 1
+    # Only the entry still being read was recomputed.
+    assert hotels.aggregations == 3
@@ -0,0 +1,80 @@
+import json
+
+from key_insights_schema import KEY_INSIGHTS_FIELDS, KEY_INSIGHTS_JSON_EXAMPLE, parse_key_insights
+
+
+def test_valid_json_is_normalized_to_the_schema():
+    insights, error = parse_key_insights(KEY_INSIGHTS_JSON_EXAMPLE)
+    assert error is None
+    assert list(insights) == list(KEY_INSIGHTS_FIELDS)
+    assert insights['hotel'] == 'Four Seasons Resort Maui at Wailea'
+    assert insights['check_in'] == '2024-12-21'
+    assert insights['guests'] == 4
+    assert insights['total_price'] == 12450.50
+
+def test_code_fences_and_surrounding_prose_are_stripped():
+    response = 'Here are the key insights:\n```json\n{"hotel": "The Little Nell", "city": "Aspen"}\n```\nLet me know!'
+    insights, error = parse_key_insights(response)
+    assert error is None
+    assert insights['hotel'] == 'The Little Nell'
+    assert insights['city'] == 'Aspen'
+
+def test_trailing_commas_and_python_literals_are_repaired():
+    response = '{"hotel": "The Little Nell", "loyalty_tier": None, "guests": 2,}'
+    insights, error = parse_key_insights(response)
+    assert error is None
+    assert insights['loyalty_tier'] is None
+    assert insights['guests'] == 2
+
+def test_single_quotes_are_repaired():
+    insights, error = parse_key_insights("{'hotel': 'Hotel Jerome', 'currency': 'USD'}")
+    assert error is None
+    assert insights['hotel'] == 'Hotel Jerome'
+    assert insights['currency'] == 'USD'
+
+def test_truncated_answer_keeps_the_complete_fields():
+    insights, error = parse_key_insights('{"hotel": "Hotel Jerome", "city": "Aspen",')
+    assert error is None
+    assert insights['city'] == 'Aspen'
+    assert insights['check_in'] is None
+
+def test_values_are_coerced_to_the_field_types():
+    response = json.dumps({
+        'hotel': '  The   St. Regis  Aspen ',
+        'check_in': 'February 14, 2025',
+        'check_out': '02/17/2025',
+        'guests': '2 adults',
+        'total_price': '$4,385.00',
+        'room_type': ['Deluxe King'],
+        'unexpected': 'dropped',
+    })
+    insights, error = parse_key_insights(response)
+    assert error is None
+    assert insights['hotel'] == 'The St. Regis Aspen'
+    assert insights['check_in'] == '2025-02-14'
+    assert insights['check_out'] == '2025-02-17'
+    assert insights['guests'] == 2
+    assert insights['total_price'] == 4385.0
+    assert insights['room_type'] is None
+    assert 'unexpected' not in insights
+
+def test_inconsistent_values_are_dropped():
+    response = json.dumps({'hotel': 'Hotel Jerome', 'check_in': '2025-02-17', 'check_out': '2025-02-14', 'guests': 0})
+    insights, error = parse_key_insights(response)
+    assert error is None
+    assert insights['check_out'] is None
+    assert insights['guests'] is None
+
+def test_unusable_answers_return_an_error():
+    assert parse_key_insights('') == (None, "empty response")
+    insights, error = parse_key_insights('I could not find a hotel reservation in this email.')
+    assert insights is None and error
+    insights, error = parse_key_insights('{"loyalty_tier": "Gold"}')
+    assert insights is None
+    assert error == "missing both hotel and city"
+
+def test_already_parsed_dicts_are_validated():
+    insights, error = parse_key_insights({'city': 'Aspen', 'guests': 3})
+    assert error is None
+    assert insights['city'] == 'Aspen'
+    assert insights['hotel'] is None
@@ -0,0 +1,58 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', fake_clock)
+    return fake_clock
+
+def test_reserve_is_free_within_capacity(clock):
+    bucket = TokenBucket(capacity=3, refill_per_second=1)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.available() == 0
+
+def test_reserve_queues_callers_behind_each_other(clock):
+    bucket = TokenBucket(capacity=2, refill_per_second=4)
+    bucket.reserve(2)
+    # The balance goes negative, so each caller waits for the tokens of the ones before it.
+    assert bucket.reserve() == pytest.approx(0.25)
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(0.75)
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(capacity=5, refill_per_second=10)
+    bucket.reserve(5)
+    clock.advance(0.2)
+    assert bucket.available() == pytest.approx(2)
+    clock.advance(60)
+    assert bucket.available() == 5
+
+def test_reserve_never_waits_for_more_than_capacity(clock):
+    bucket = TokenBucket(capacity=10, refill_per_second=1)
+    bucket.reserve(10)
+    assert bucket.reserve(1000) == pytest.approx(10)
+
+def test_paces_a_burst_at_the_refill_rate(clock):
+    bucket = TokenBucket.per_minute(60)
+    delays = [bucket.reserve() for _ in range(90)]
+    assert delays[:60] == [0.0] * 60
+    assert delays[60:] == pytest.approx([float(i) for i in range(1, 31)])
+
+def test_set_rate_applies_from_now_on(clock):
+    bucket = TokenBucket(capacity=100, refill_per_second=10)
+    bucket.reserve(100)
+    clock.advance(1)
+    bucket.set_rate(1)
+    # The second before the change refilled at the old rate.
+    assert bucket.available() == pytest.approx(10)
+    clock.advance(1)
+    assert bucket.available() == pytest.approx(11)
+
+def test_set_rate_changes_the_wait_of_later_callers(clock):
+    bucket = TokenBucket(capacity=1, refill_per_second=1)
+    bucket.reserve()
+    bucket.set_rate(4)
+    assert bucket.reserve() == pytest.approx(0.25)
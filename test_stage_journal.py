@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from stage_journal import IncompleteStageError, StageJournal, run_journaled_stage
+
+
+def keep_even(items, journal):
+    """Stage keeping the records with an even number, as journaled stages do: one entry per input."""
+    for item in items:
+        journal.record(item['id'], item if item['n'] % 2 == 0 else None)
+
+def records(count):
+    return [{'id': f'msg{n}', 'n': n} for n in range(count)]
+
+def test_outputs_are_saved_in_input_order_and_the_journal_removed(tmp_path):
+    journal_path = tmp_path / 'stage.journal'
+    saved = []
+    num_outputs = run_journaled_stage(str(journal_path), records(6), keep_even, saved.extend, chunk_size=4)
+    assert num_outputs == 3
+    assert [record['id'] for record in saved] == ['msg0', 'msg2', 'msg4']
+    assert not journal_path.exists()
+
+def test_resume_skips_the_finished_records(tmp_path):
+    journal_path = str(tmp_path / 'stage.journal')
+    # A previous run finished msg0 (kept) and msg1 (dropped) before crashing.
+    journal = StageJournal(journal_path)
+    journal.record('msg0', {'id': 'msg0', 'n': 0})
+    journal.record('msg1')
+    journal.close()
+
+    processed = []
+
+    def process_pending(items, journal):
+        processed.extend(item['id'] for item in items)
+        keep_even(items, journal)
+
+    saved = []
+    num_outputs = run_journaled_stage(journal_path, records(4), process_pending, saved.extend)
+    assert processed == ['msg2', 'msg3']
+    assert num_outputs == 2
+    assert [record['id'] for record in saved] == ['msg0', 'msg2']
+
+def test_failed_records_are_retried(tmp_path):
+    journal_path = str(tmp_path / 'stage.journal')
+
+    def fail_on_msg1(items, journal):
+        for item in items:
+            if item['id'] == 'msg1':
+                raise RuntimeError("API error")
+            journal.record(item['id'], item)
+
+    try:
+        run_journaled_stage(journal_path, records(3), fail_on_msg1, lambda outputs: None)
+    except RuntimeError:
+        pass
+    assert set(StageJournal(journal_path).index()) == {'msg0'}
+
+    processed = []
+
+    def process_pending(items, journal):
+        processed.extend(item['id'] for item in items)
+        for item in items:
+            journal.record(item['id'], item)
+
+    saved = []
+    run_journaled_stage(journal_path, records(3), process_pending, saved.extend)
+    assert processed == ['msg1', 'msg2']
+    assert [record['id'] for record in saved] == ['msg0', 'msg1', 'msg2']
+
+def test_torn_line_is_redone_and_does_not_swallow_the_next_record(tmp_path):
+    journal_path = tmp_path / 'stage.journal'
+    # Crash in the middle of writing the msg1 line.
+    journal_path.write_text(json.dumps({'id': 'msg0', 'output': {'id': 'msg0', 'n': 0}}) + '\n' + '{"id": "msg1", "outp')
+
+    journal = StageJournal(str(journal_path))
+    assert set(journal.index()) == {'msg0'}
+
+    processed = []
+
+    def process_pending(items, journal):
+        processed.extend(item['id'] for item in items)
+        for item in items:
+            journal.record(item['id'], item)
+
+    saved = []
+    num_outputs = run_journaled_stage(str(journal_path), records(3), process_pending, saved.extend)
+    assert processed == ['msg1', 'msg2']
+    assert num_outputs == 3
+    assert [record['id'] for record in saved] == ['msg0', 'msg1', 'msg2']
+
+def test_index_skips_a_corrupt_line_in_the_middle(tmp_path):
+    journal_path = tmp_path / 'stage.journal'
+    journal_path.write_text('\n'.join([
+        json.dumps({'id': 'msg0', 'output': {'id': 'msg0'}}),
+        'not json',
+        json.dumps({'id': 'msg2', 'output': None}),
+        json.dumps({'id': 'msg3', 'output': {'id': 'msg3'}}),
+    ]) + '\n')
+    journal = StageJournal(str(journal_path))
+    offsets = journal.index()
+    assert offsets['msg2'] is None
+    assert 'msg1' not in offsets
+    assert list(journal.iter_outputs(['msg3', 'msg0', 'msg2'], offsets)) == [{'id': 'msg3'}, {'id': 'msg0'}]
+
+def test_stage_with_unjournaled_inputs_is_not_saved_until_they_finish(tmp_path):
+    journal_path = str(tmp_path / 'stage.journal')
+
+    def skip_msg1(items, journal):
+        # Like an LLM call still failing after retries: no result, nothing journaled.
+        for item in items:
+            if item['id'] != 'msg1':
+                journal.record(item['id'], item)
+
+    saved = []
+    with pytest.raises(IncompleteStageError) as error:
+        run_journaled_stage(journal_path, records(3), skip_msg1, saved.extend)
+    assert error.value.unfinished_ids == ['msg1']
+    assert saved == []
+
+    processed = []
+
+    def process_pending(items, journal):
+        processed.extend(item['id'] for item in items)
+        for item in items:
+            journal.record(item['id'], item)
+
+    num_outputs = run_journaled_stage(journal_path, records(3), process_pending, saved.extend)
+    assert processed == ['msg1']
+    assert num_outputs == 3
+    assert [record['id'] for record in saved] == ['msg0', 'msg1', 'msg2']